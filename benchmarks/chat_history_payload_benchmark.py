@@ -0,0 +1,101 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Benchmark of the callback payload bytes and server time of one chat turn.
+
+Compares sending the whole chat-history component tree to and from each of the
+add_chat_card, update_context and format_chat_history callbacks against sending
+only the new or changed cards with Dash Patch, at 5, 20 and 50 turns.
+
+Run from the repository root:
+    python benchmarks/chat_history_payload_benchmark.py
+"""
+import json
+import os
+import time
+import uuid
+
+import pandas as pd
+from dash import Patch
+from dash._utils import to_json
+from langchain.schema import Document
+
+from dashgpt.layout.chat_ui import (
+    generate_user_textbox,
+    generate_ai_textbox,
+    generate_ai_response_card,
+)
+from dash import html
+
+TURNS = [5, 20, 50]
+REPEATS = 20
+
+
+def build_turn(jokes, i):
+    context_docs = [Document(page_content=joke) for joke in jokes[i * 3 : i * 3 + 3]]
+    user_card = generate_user_textbox(f"Tell me a joke about topic {i}")
+    ai_card = html.Div([generate_ai_response_card(jokes[i], context_docs, str(uuid.uuid4()))])
+    return [user_card, ai_card]
+
+
+def time_callbacks(request_payloads, response_payloads):
+    # the server parses each request body and serializes each response body
+    start_time = time.perf_counter()
+    for _ in range(REPEATS):
+        for payload in request_payloads:
+            json.loads(to_json(payload))
+        for payload in response_payloads:
+            to_json(payload)
+    return (time.perf_counter() - start_time) / REPEATS * 1000
+
+
+def measure_full_tree(history, new_turn):
+    placeholder = generate_ai_textbox("streaming-object-1234", text="🔬 Searching relevant content...")
+    with_new_cards = history + [new_turn[0], placeholder]
+    completed = history + new_turn
+
+    # add_chat_card, update_context and format_chat_history each get and return the tree
+    requests = [history, with_new_cards, with_new_cards]
+    responses = [with_new_cards, with_new_cards, completed]
+
+    return requests, responses
+
+
+def measure_patch(history, new_turn):
+    num_cards = len(history) + 2
+
+    add_cards = Patch()
+    add_cards.append(new_turn[0])
+    add_cards.append(generate_ai_textbox("streaming-object-1234", text="🔬 Searching relevant content..."))
+
+    generating = Patch()
+    generating[num_cards - 1]["props"]["children"][0]["props"]["children"]["props"]["children"] = "✨Generating answer..."
+
+    completed = Patch()
+    completed[num_cards - 1] = new_turn[1]
+
+    # only the card count is sent instead of the tree
+    requests = [len(history), num_cards, num_cards]
+    responses = [add_cards, generating, completed]
+
+    return requests, responses
+
+
+def main():
+    jokes = pd.read_csv(os.path.join("data", "raw", "reddit_jokes_sample_2000.csv"))["complete_joke"].tolist()
+
+    print(f"{'turns':>6} {'mode':>10} {'request bytes':>14} {'response bytes':>15} {'server ms':>10}")
+    for num_turns in TURNS:
+        history = [card for i in range(num_turns - 1) for card in build_turn(jokes, i)]
+        new_turn = build_turn(jokes, num_turns)
+
+        for mode, measure in [("full tree", measure_full_tree), ("patch", measure_patch)]:
+            requests, responses = measure(history, new_turn)
+            request_bytes = sum(len(to_json(payload)) for payload in requests)
+            response_bytes = sum(len(to_json(payload)) for payload in responses)
+            server_ms = time_callbacks(requests, responses)
+            print(f"{num_turns:>6} {mode:>10} {request_bytes:>14} {response_bytes:>15} {server_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+A local stand-in for the OpenAI API used by the load tests and benchmarks.
+
+Streams chat completions as server-sent events at a fixed token rate so the app can
+be load tested without spending real API quota. Point the app at it with:
+    OPENAI_API_BASE=http://localhost:8081/v1 OPENAI_API_KEY=fake python src/dashgpt/app.py
+
+Run it with:
+    python benchmarks/fake_openai_server.py --port 8081 --tokens 200 --interval 0.02
+
+To test the timeouts, retries and circuit breakers of dashgpt.chat.upstream it can inject
+faults into both endpoints, e.g. a 5 second wait before the first byte and a 500 error
+on one request in five:
+    python benchmarks/fake_openai_server.py --first-byte-delay 5 --error-rate 0.2
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import random
+
+import numpy as np
+from aiohttp import web
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+def fake_embedding(text):
+    # deterministic unit vector per text so repeated queries return identical embeddings
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:4], "little")
+    embedding = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS)
+    return (embedding / np.linalg.norm(embedding)).tolist()
+
+
+def make_app(num_tokens, token_interval, first_byte_delay=0.0, error_rate=0.0, stall_after=None):
+    async def inject_faults():
+        await asyncio.sleep(first_byte_delay)
+        if random.random() < error_rate:
+            return web.json_response(
+                {"error": {"message": "Injected error", "type": "server_error", "param": None, "code": None}},
+                status=500,
+            )
+        return None
+
+    async def chat_completions(request):
+        body = await request.json()
+        error_response = await inject_faults()
+        if error_response is not None:
+            return error_response
+
+        if not body.get("stream", False):
+            content = " ".join(f"tok{i}" for i in range(num_tokens))
+            return web.json_response(
+                {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        try:
+            for i in range(num_tokens):
+                if stall_after is not None and i == stall_after:
+                    # stops sending without closing the stream, like a stuck upstream
+                    await asyncio.sleep(3600)
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}],
+                }
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await asyncio.sleep(token_interval)
+        except ConnectionResetError:
+            # shows how quickly the app closes the upstream stream when its client goes away
+            print(f"Stream closed by the client after {i} of {num_tokens} tokens.", flush=True)
+            return response
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+
+        return response
+
+    async def embeddings(request):
+        body = await request.json()
+        error_response = await inject_faults()
+        if error_response is not None:
+            return error_response
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        return web.json_response(
+            {
+                "object": "list",
+                "model": body["model"],
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(str(text))}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/embeddings", embeddings)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens streamed per completion.")
+    parser.add_argument("--interval", type=float, default=0.02, help="Seconds between tokens.")
+    parser.add_argument("--first-byte-delay", type=float, default=0.0, help="Seconds before responding.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500.")
+    parser.add_argument("--stall-after", type=int, default=None, help="Stop streaming after this many tokens.")
+    args = parser.parse_args()
+
+    web.run_app(
+        make_app(args.tokens, args.interval, args.first_byte_delay, args.error_rate, args.stall_after),
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
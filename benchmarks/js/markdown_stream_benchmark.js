@@ -0,0 +1,117 @@
+// Author: Ty Andrews
+// Date: 2026-10-17
+//
+// Headless benchmark of rendering a streamed markdown response in the browser.
+//
+// Replays the recorded 1,000-chunk stream in recorded_stream.json against a jsdom window with the
+// same marked.js and highlight.js builds the app serves, and reports the total parse time of:
+//   - naive: marked.parse over the whole accumulated text and highlight.js on every chunk
+//   - incremental: IncrementalMarkdownRenderer rendering on every chunk, the worst case
+//   - incremental + rAF: IncrementalMarkdownRenderer with chunks coalesced into 60fps frames
+//
+// Run from the repository root:
+//     npm install --prefix benchmarks/js
+//     node benchmarks/js/markdown_stream_benchmark.js
+const fs = require("fs");
+const path = require("path");
+const { performance } = require("perf_hooks");
+const { JSDOM } = require("jsdom");
+
+const ASSETS_DIR = path.join(__dirname, "..", "..", "src", "dashgpt", "assets");
+const REPEATS = 5;
+// chunks arriving within one 16ms animation frame when a fast model streams ~250 chunks per second
+const CHUNKS_PER_FRAME = 4;
+
+function createWindow() {
+    const dom = new JSDOM("<!DOCTYPE html><div id='response-window'></div>", { runScripts: "outside-only" });
+    for (const script of ["external/marked.min.js", "external/highlight.min.js", "incrementalMarkdown.js"]) {
+        dom.window.eval(fs.readFileSync(path.join(ASSETS_DIR, script), "utf8"));
+    }
+    return dom.window;
+}
+
+function renderNaive(window, chunks) {
+    const container = window.document.querySelector("#response-window");
+    // the options streamingGPT.js used to set before rendering incrementally
+    window.marked.setOptions({
+        highlight: function (code) {
+            return window.hljs.highlightAuto(code).value;
+        },
+    });
+
+    let text = "";
+    for (const chunk of chunks) {
+        text += chunk;
+        container.innerHTML = window.marked.parse(text);
+    }
+    window.marked.setOptions({ highlight: null });
+
+    return { html: container.innerHTML, renders: chunks.length };
+}
+
+function renderIncremental(window, chunks, chunksPerFrame) {
+    const container = window.document.querySelector("#response-window");
+    const useAnimationFrame = chunksPerFrame !== null;
+
+    // animation frames are run by hand every few chunks so the timing doesn't depend on a real display
+    let frames = [];
+    window.requestAnimationFrame = function (callback) {
+        frames.push(callback);
+    };
+    const renderer = new window.IncrementalMarkdownRenderer(container, { useAnimationFrame: useAnimationFrame });
+
+    let text = "";
+    chunks.forEach(function (chunk, i) {
+        text += chunk;
+        renderer.update(text);
+        if (useAnimationFrame && (i + 1) % chunksPerFrame === 0) {
+            frames.forEach((callback) => callback());
+            frames = [];
+        }
+    });
+    const html = renderer.finish();
+
+    return { html: html, renders: renderer.renderCount };
+}
+
+function timeRender(name, render) {
+    const window = createWindow();
+    let result;
+    const times = [];
+    for (let i = 0; i < REPEATS; i++) {
+        const start = performance.now();
+        result = render(window);
+        times.push(performance.now() - start);
+    }
+    times.sort((a, b) => a - b);
+
+    // compare text rather than html, frozen blocks may be wrapped in separate elements
+    const text = new window.DOMParser().parseFromString(result.html, "text/html").body.textContent;
+    return { name: name, ms: times[Math.floor(REPEATS / 2)], renders: result.renders, text: text };
+}
+
+function main() {
+    const { chunks } = JSON.parse(fs.readFileSync(path.join(__dirname, "recorded_stream.json"), "utf8"));
+    const characters = chunks.join("").length;
+    console.log(`Replaying ${chunks.length} chunks, ${characters} characters, median of ${REPEATS} runs`);
+
+    const results = [
+        timeRender("naive", (window) => renderNaive(window, chunks)),
+        timeRender("incremental", (window) => renderIncremental(window, chunks, null)),
+        timeRender("incremental + rAF", (window) => renderIncremental(window, chunks, CHUNKS_PER_FRAME)),
+    ];
+
+    console.log(`${"renderer".padStart(18)} ${"parse ms".padStart(10)} ${"renders".padStart(8)} ${"speedup".padStart(8)}`);
+    for (const result of results) {
+        const speedup = results[0].ms / result.ms;
+        console.log(
+            `${result.name.padStart(18)} ${result.ms.toFixed(1).padStart(10)} ` +
+                `${String(result.renders).padStart(8)} ${speedup.toFixed(1).padStart(7)}x`
+        );
+        if (result.text.replace(/\s+/g, "") !== results[0].text.replace(/\s+/g, "")) {
+            console.log(`  warning: ${result.name} rendered different text than the naive renderer`);
+        }
+    }
+}
+
+main();
@@ -0,0 +1,113 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Benchmark of maximal marginal relevance re-ranking against plain similarity search.
+
+For each backend and fetch_k, measures the median milliseconds per query of:
+  - similarity: top-k similarity search
+  - langchain mmr: the vector store's own max_marginal_relevance_search_by_vector,
+    langchain's re-ranking recomputes the similarity to every selected document per step
+  - dashgpt mmr: dashgpt.data.mmr, candidates and their embeddings fetched once and
+    re-ranked with one pairwise similarity matrix
+Queries are made by vector so embedding time isn't included.
+
+Run from the repository root:
+    python benchmarks/mmr_benchmark.py --docs 20000 --fetch-k 10,50,100,200
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+DIMENSIONS = 1536
+K = 3
+
+
+def random_unit_vectors(num_vectors, seed):
+    vectors = np.random.default_rng(seed).standard_normal((num_vectors, DIMENSIONS), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def median_ms(function, queries):
+    latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        function(query)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    return float(np.median(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--fetch-k", default="10,50,100,200")
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    sys.path.insert(0, "src")
+    from dashgpt.chat.chat_utils import connect_to_chroma
+    from dashgpt.data.mmr import max_marginal_relevance_search_by_vector
+    from dashgpt.data.numpy_vector_store import NumpyVectorStore
+
+    embeddings = random_unit_vectors(args.docs, seed=0)
+    documents = [f"Joke number {i}" for i in range(args.docs)]
+    ids = [str(i) for i in range(args.docs)]
+    # queries near a document so the candidates are a mix of close and far ones
+    queries = [(embedding + 0.5 * noise).tolist() for embedding, noise in zip(
+        embeddings[: args.queries], random_unit_vectors(args.queries, seed=1)
+    )]
+
+    with tempfile.TemporaryDirectory() as directory:
+        chroma_db = connect_to_chroma(
+            None, persist_directory=os.path.join(directory, "chroma"), collection_name="benchmark"
+        )
+        for start in range(0, args.docs, 5000):
+            chroma_db._collection.add(
+                ids=ids[start : start + 5000],
+                embeddings=embeddings[start : start + 5000].tolist(),
+                documents=documents[start : start + 5000],
+            )
+        vector_stores = {
+            "chroma": chroma_db,
+            "numpy": NumpyVectorStore(None, embeddings, documents, ids=ids),
+        }
+
+        print(f"{'backend':>8} {'fetch_k':>8} {'similarity':>11} {'langchain mmr':>14} {'dashgpt mmr':>12}")
+        for name, vector_store in vector_stores.items():
+            for fetch_k in [int(value) for value in args.fetch_k.split(",")]:
+                similarity_ms = median_ms(
+                    lambda query: vector_store.similarity_search_by_vector_with_relevance_scores(query, k=K),
+                    queries,
+                )
+                if name == "chroma":
+                    langchain_ms = median_ms(
+                        lambda query: vector_store.max_marginal_relevance_search_by_vector(
+                            query, k=K, fetch_k=fetch_k
+                        ),
+                        queries,
+                    )
+                else:
+                    # the numpy index has no langchain re-ranking of its own
+                    from langchain.vectorstores.utils import maximal_marginal_relevance
+
+                    def langchain_mmr(query):
+                        _, candidates = vector_store.similarity_search_by_vector_with_embeddings(query, k=fetch_k)
+                        maximal_marginal_relevance(np.asarray(query), list(candidates), k=K)
+
+                    langchain_ms = median_ms(langchain_mmr, queries)
+                dashgpt_ms = median_ms(
+                    lambda query: max_marginal_relevance_search_by_vector(
+                        vector_store, query, k=K, fetch_k=fetch_k
+                    ),
+                    queries,
+                )
+                print(
+                    f"{name:>8} {fetch_k:>8} {similarity_ms:>11.2f} {langchain_ms:>14.2f} {dashgpt_ms:>12.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Offline evaluation of the retrieval methods on questions built from the jokes CSV.
+
+Each query of the eval set targets one joke of data/raw/reddit_jokes_sample_2000.csv:
+  - keywords: the two rarest terms of the joke's setup, e.g. "dinosaur extinct"
+  - question: the setup of the joke as it was posted
+For every retrieval method it reports recall@k, the share of queries whose joke is in
+the top k documents, and the latency per query. Questions are embedded without the
+embedding cache so the latency includes the embedding request the method makes.
+
+Build the BM25 index first, then run from the repository root:
+    python src/dashgpt/data/bm25_index.py
+    python benchmarks/retrieval_eval.py --methods similarity,lexical,hybrid
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+SOURCE_PATH = os.path.join("data", "raw", "reddit_jokes_sample_2000.csv")
+EVAL_SET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_eval_set.jsonl")
+QUERIES_PER_TYPE = 100
+RECALL_AT = (1, 3, 10)
+
+
+def build_eval_set(source_path=SOURCE_PATH, path=EVAL_SET_PATH, num_queries=QUERIES_PER_TYPE, seed=0):
+    from dashgpt.data.bm25_index import tokenize
+
+    jokes = pd.read_csv(source_path).reset_index(drop=True)
+    document_frequencies = Counter(
+        term for text in jokes["complete_joke"] for term in set(tokenize(text))
+    )
+
+    rows = np.random.default_rng(seed).choice(len(jokes), size=num_queries, replace=False)
+    queries = []
+    for row in sorted(int(row) for row in rows):
+        setup = jokes["joke"].iloc[row]
+        terms = sorted(set(tokenize(setup)), key=lambda term: (document_frequencies[term], term))
+        if terms:
+            queries.append({"query": " ".join(terms[:2]), "type": "keywords", "row": row})
+        queries.append({"query": setup, "type": "question", "row": row})
+
+    with open(path, "w") as f:
+        for query in queries:
+            f.write(json.dumps(query) + "\n")
+
+    return queries
+
+
+def load_eval_set(path=EVAL_SET_PATH):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--methods", default="similarity,mmr,lexical,hybrid")
+    parser.add_argument("--rebuild-eval-set", action="store_true", help="Rebuild the eval set from the CSV.")
+    args = parser.parse_args()
+
+    sys.path.insert(0, "src")
+    from dashgpt.chat.chat_utils import connect_to_vectorstore, get_relevant_documents
+
+    queries = build_eval_set() if args.rebuild_eval_set or not os.path.exists(EVAL_SET_PATH) else load_eval_set()
+    jokes = pd.read_csv(SOURCE_PATH).reset_index(drop=True)
+
+    vector_store = connect_to_vectorstore()
+    # bypass the embedding cache, every query pays for the embedding the method needs
+    vector_store._embedding_function = vector_store.embeddings.embeddings
+
+    print(
+        f"{'method':>10} {'queries':>9} "
+        + " ".join(f"{f'recall@{k}':>9}" for k in RECALL_AT)
+        + f" {'p50 ms':>8} {'p95 ms':>8}"
+    )
+    for method in args.methods.split(","):
+        # loads the indexes the method uses before timing it
+        get_relevant_documents("warm up", vector_store, k=1, method=method)
+
+        results = {query_type: {"hits": Counter(), "latencies": []} for query_type in ("keywords", "question")}
+        for query in queries:
+            start_time = time.perf_counter()
+            documents = get_relevant_documents(query["query"], vector_store, k=max(RECALL_AT), method=method)
+            latency = (time.perf_counter() - start_time) * 1000
+
+            target = jokes["complete_joke"].iloc[query["row"]]
+            contents = [doc.page_content for doc in documents]
+            result = results[query["type"]]
+            result["latencies"].append(latency)
+            for k in RECALL_AT:
+                result["hits"][k] += target in contents[:k]
+
+        for query_type, result in results.items():
+            count = len(result["latencies"])
+            print(
+                f"{method:>10} {query_type:>9} "
+                + " ".join(f"{result['hits'][k] / count:>9.2f}" for k in RECALL_AT)
+                + f" {np.percentile(result['latencies'], 50):>8.2f}"
+                f" {np.percentile(result['latencies'], 95):>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Benchmark of serving streamed answers with and without token coalescing.
+
+Replays the recorded stream in benchmarks/js/recorded_stream.json as the upstream, one
+chunk every --interval seconds, through the serving path of both routes: the events of
+dashgpt.chat.streaming into a StreamBuffer, followed by one connection per stream. For
+--streams concurrent streams it reports per stream:
+  - cpu: process CPU time of producing, buffering and sending the stream
+  - bytes: bytes on the wire, including the chunked transfer encoding of each write
+  - events: token events the browser parses and hands to the markdown renderer
+  - renders: markdown renders of the browser, at most one per 60fps animation frame
+  - ttft: time to the first token event
+
+Run from the repository root:
+    python benchmarks/stream_coalescing_benchmark.py
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+import numpy as np
+
+from dashgpt.chat.streaming import stream_chat_events, async_stream_chat_events
+from dashgpt.chat.stream_buffer import start_stream, async_start_stream, follow_stream, async_follow_stream
+from dashgpt.chat.token_coalescing import TokenCoalescer
+
+RECORDED_STREAM = os.path.join("benchmarks", "js", "recorded_stream.json")
+# the renderer re-parses at most once per animation frame
+FRAME_SECONDS = 1 / 60
+
+
+def recorded_chunks(num_chunks):
+    with open(RECORDED_STREAM, "r") as f:
+        return json.load(f)["chunks"][:num_chunks]
+
+
+def upstream(chunks, interval):
+    for chunk in chunks:
+        time.sleep(interval)
+        yield chunk
+
+
+async def async_upstream(chunks, interval):
+    for chunk in chunks:
+        await asyncio.sleep(interval)
+        yield chunk
+
+
+class ClientStats:
+    """
+    What one client received, the writes of the connection and when they arrived.
+    """
+
+    def __init__(self, start_time):
+        self.start_time = start_time
+        self.bytes = 0
+        self.events = 0
+        self.frames = set()
+        self.first_token_time = None
+
+    def receive(self, data):
+        now = time.perf_counter()
+        size = len(data.encode("utf-8"))
+        # chunked transfer encoding frames each write with its hex length and two CRLFs
+        self.bytes += size + len(f"{size:x}") + 4
+        token_events = data.count('"type": "token"')
+        if token_events:
+            self.events += token_events
+            self.frames.add(int((now - self.start_time) / FRAME_SECONDS))
+            if self.first_token_time is None:
+                self.first_token_time = now - self.start_time
+
+
+def run_flask_streams(chunks, args, make_coalescer):
+    stats = []
+
+    def client():
+        client_stats = ClientStats(time.perf_counter())
+        stats.append(client_stats)
+        events = stream_chat_events([], upstream(chunks, args.interval), coalescer=make_coalescer())
+        for data in follow_stream(start_stream(events)):
+            client_stats.receive(data)
+
+    # one thread per connection like the threaded WSGI servers, the stream produces on its own thread
+    threads = [threading.Thread(target=client) for _ in range(args.streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def run_asgi_streams(chunks, args, make_coalescer):
+    stats = []
+
+    async def client():
+        client_stats = ClientStats(time.perf_counter())
+        stats.append(client_stats)
+        events = async_stream_chat_events([], async_upstream(chunks, args.interval), coalescer=make_coalescer())
+        async for data in async_follow_stream(async_start_stream(events)):
+            client_stats.receive(data)
+
+    async def main():
+        await asyncio.gather(*[client() for _ in range(args.streams)])
+
+    asyncio.run(main())
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20, help="Concurrent streams.")
+    parser.add_argument("--chunks", type=int, default=300, help="Chunks of the recorded stream per answer.")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between upstream chunks.")
+    parser.add_argument("--coalesce-bytes", type=int, default=64)
+    parser.add_argument("--coalesce-window-ms", type=float, default=40)
+    args = parser.parse_args()
+
+    chunks = recorded_chunks(args.chunks)
+    modes = [
+        ("off", lambda: TokenCoalescer(max_bytes=0)),
+        ("on", lambda: TokenCoalescer(max_bytes=args.coalesce_bytes, window=args.coalesce_window_ms / 1000)),
+    ]
+
+    print(f"{args.streams} streams of {len(chunks)} chunks, one every {args.interval * 1000:.0f}ms")
+    print(f"{'route':<6}{'coalescing':<12}{'cpu ms':>8}{'bytes':>9}{'events':>8}{'renders':>9}{'ttft ms':>9}")
+    for route, run_streams in [("flask", run_flask_streams), ("asgi", run_asgi_streams)]:
+        for mode, make_coalescer in modes:
+            start_cpu = time.process_time()
+            stats = run_streams(chunks, args, make_coalescer)
+            cpu_per_stream = (time.process_time() - start_cpu) / args.streams
+
+            print(
+                f"{route:<6}{mode:<12}{cpu_per_stream * 1000:>8.1f}"
+                f"{np.mean([s.bytes for s in stats]):>9.0f}"
+                f"{np.mean([s.events for s in stats]):>8.0f}"
+                f"{np.mean([len(s.frames) for s in stats]):>9.0f}"
+                f"{np.mean([s.first_token_time for s in stats]) * 1000:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
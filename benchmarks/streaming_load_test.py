@@ -0,0 +1,88 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Load test of /streaming-chat that finds the concurrent-stream ceiling of one worker.
+
+Start the fake upstream and a single worker of the app, then run the load test:
+    python benchmarks/fake_openai_server.py --port 8081
+
+    # blocking Flask route, one worker with the default 4 waitress threads
+    OPENAI_API_BASE=http://localhost:8081/v1 OPENAI_API_KEY=fake \\
+        waitress-serve --listen=localhost:8050 src.dashgpt.app:flask_server
+
+    # or the asyncio route, one uvicorn worker
+    OPENAI_API_BASE=http://localhost:8081/v1 OPENAI_API_KEY=fake \\
+        uvicorn --port 8050 src.dashgpt.asgi:app
+
+    python benchmarks/streaming_load_test.py --url http://localhost:8050/streaming-chat
+
+For each concurrency level all streams are opened at once; a level passes when every
+stream completes and the p95 time-to-first-token stays under --max-ttft seconds.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+import numpy as np
+
+async def run_stream(session, url, stream_number):
+    # a unique question and conversation per stream so no answer is served from the response cache
+    body = {
+        "prompt": f"Tell me joke number {stream_number} about cats",
+        "conversation_id": f"load-test-{stream_number}",
+    }
+    start_time = time.perf_counter()
+    first_token_time = None
+
+    async with session.post(url, json=body) as response:
+        response.raise_for_status()
+        # server-sent events with a JSON data line each, the retrieved context comes before the first token
+        async for line in response.content:
+            if not line.startswith(b"data: "):
+                continue
+            if first_token_time is None and json.loads(line[6:])["type"] == "token":
+                first_token_time = time.perf_counter() - start_time
+
+    return first_token_time, time.perf_counter() - start_time
+
+
+async def run_level(url, concurrency, timeout):
+    connector = aiohttp.TCPConnector(limit=0)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        results = await asyncio.gather(
+            *[run_stream(session, url, i) for i in range(concurrency)], return_exceptions=True
+        )
+
+    completed = [r for r in results if not isinstance(r, BaseException) and r[0] is not None]
+    ttft = np.array([r[0] for r in completed]) if completed else np.array([np.nan])
+    total = np.array([r[1] for r in completed]) if completed else np.array([np.nan])
+
+    return len(completed), np.percentile(ttft, 50), np.percentile(ttft, 95), np.percentile(total, 95)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8050/streaming-chat")
+    parser.add_argument("--levels", default="4,8,16,32,64,128,256,512")
+    parser.add_argument("--max-ttft", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    ceiling = 0
+    print(f"{'streams':>8} {'completed':>10} {'p50 ttft':>9} {'p95 ttft':>9} {'p95 total':>10}")
+    for concurrency in [int(level) for level in args.levels.split(",")]:
+        completed, p50_ttft, p95_ttft, p95_total = await run_level(args.url, concurrency, args.timeout)
+        print(f"{concurrency:>8} {completed:>10} {p50_ttft:>8.2f}s {p95_ttft:>8.2f}s {p95_total:>9.2f}s")
+
+        if completed < concurrency or p95_ttft > args.max_ttft:
+            break
+        ceiling = concurrency
+
+    print(f"Concurrent-stream ceiling per worker: {ceiling}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Micro-benchmark of per-request token accounting for the chat completion prompt.
+
+Compares the original approach of resolving the tiktoken encoding for every message
+against the cached, batched counting in dashgpt.data.token_utils.
+
+Run from the repository root:
+    python benchmarks/token_counting_benchmark.py
+"""
+import os
+import timeit
+
+import pandas as pd
+import tiktoken
+
+from dashgpt.chat.prompts import generate_user_prompt
+from dashgpt.data.token_utils import count_message_tokens
+
+NUM_REQUESTS = 2000
+
+
+def count_tokens_original(text, model="gpt-3.5-turbo"):
+    # the token counting as it was before token_utils, re-resolving the encoding each call
+    tokenizer = tiktoken.encoding_for_model(model)
+    return len(tokenizer.encode(text))
+
+
+def count_prompt_original(prompt):
+    total_tokens = 0
+    for message in prompt:
+        total_tokens += count_tokens_original(message["content"])
+    return total_tokens
+
+
+def build_sample_prompt():
+    with open(os.path.join("prompts", "system", "sys-prompt_v1.txt"), "r") as f:
+        system_prompt = f.read()
+
+    jokes = pd.read_csv(os.path.join("data", "raw", "reddit_jokes_sample_2000.csv"))
+    context = "\n".join(jokes["complete_joke"].head(3))
+
+    return [
+        {"role": "system", "content": system_prompt},
+        generate_user_prompt(
+            user_prompt="Tell me a joke about cats",
+            chat_context=context,
+            chat_history="user: Tell me a joke about dogs\nassistant: " + jokes["complete_joke"][4],
+        ),
+    ]
+
+
+def main():
+    prompt = build_sample_prompt()
+
+    # load the encoding once up front so neither timing includes the first download/parse
+    count_message_tokens(prompt)
+
+    for name, func in [
+        ("original (encoding per message)", count_prompt_original),
+        ("token_utils.count_message_tokens", count_message_tokens),
+    ]:
+        seconds = timeit.timeit(lambda: func(prompt), number=NUM_REQUESTS)
+        print(f"{name:<40} {seconds / NUM_REQUESTS * 1e6:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Benchmark of the Chroma and NumPy vector store backends.
+
+Builds a Chroma collection and NumPy indexes of random unit vectors at each corpus
+size, then measures each backend in a fresh process so imports and memory are not
+shared between them:
+  - startup: seconds to import the backend, open the index and answer one query
+  - query p50/p95: milliseconds per single top-k query by vector
+  - batch: milliseconds per query when 32 queries are searched at once
+  - rss: resident memory of the process after the queries
+  - exact top: whether the best match of the first query is the exact nearest
+    neighbour, Chroma's HNSW search is approximate
+
+Run from the repository root:
+    python benchmarks/vector_store_benchmark.py --sizes 2000,20000,100000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+DIMENSIONS = 1536
+K = 3
+BATCH_SIZE = 32
+COLLECTION_NAME = "benchmark"
+
+
+def get_rss_mb():
+    # current rather than peak resident memory, so the pages touched by the index count
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def random_unit_vectors(num_vectors, seed):
+    vectors = np.random.default_rng(seed).standard_normal((num_vectors, DIMENSIONS), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_indexes(directory, num_docs, dtypes):
+    from dashgpt.chat.chat_utils import connect_to_chroma
+    from dashgpt.data.numpy_vector_store import NumpyVectorStore, quantize_embeddings
+
+    embeddings = random_unit_vectors(num_docs, seed=0)
+    documents = [f"Joke number {i}" for i in range(num_docs)]
+    ids = [str(i) for i in range(num_docs)]
+
+    collection = connect_to_chroma(
+        None, persist_directory=os.path.join(directory, "chroma"), collection_name=COLLECTION_NAME
+    )._collection
+    for start in range(0, num_docs, 5000):
+        collection.add(
+            ids=ids[start : start + 5000],
+            embeddings=embeddings[start : start + 5000].tolist(),
+            documents=documents[start : start + 5000],
+        )
+
+    for dtype in dtypes:
+        quantized, scales = quantize_embeddings(embeddings, dtype)
+        NumpyVectorStore(None, quantized, documents, ids=ids, scales=scales).save(
+            os.path.join(directory, f"numpy_{dtype}")
+        )
+
+    # the exact nearest neighbour of the first query
+    return documents[int(np.argmax(embeddings @ random_unit_vectors(1, seed=1)[0]))]
+
+
+def measure(backend, directory, num_queries):
+    # runs in its own process, started by main
+    start_time = time.perf_counter()
+    queries = random_unit_vectors(num_queries, seed=1)
+
+    if backend == "chroma":
+        from dashgpt.chat.chat_utils import connect_to_chroma
+
+        vector_store = connect_to_chroma(
+            None, persist_directory=os.path.join(directory, "chroma"), collection_name=COLLECTION_NAME
+        )
+
+        def batch_search(batch):
+            vector_store._collection.query(query_embeddings=batch.tolist(), n_results=K)
+    else:
+        from dashgpt.data.numpy_vector_store import NumpyVectorStore
+
+        vector_store = NumpyVectorStore.load(os.path.join(directory, backend), embedding_function=None)
+
+        def batch_search(batch):
+            vector_store.batch_similarity_search_by_vector_with_score(batch, k=K)
+
+    first_result = vector_store.similarity_search_by_vector_with_relevance_scores(queries[0].tolist(), k=K)
+    startup_seconds = time.perf_counter() - start_time
+
+    latencies = []
+    for query in queries:
+        query_start = time.perf_counter()
+        vector_store.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=K)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+
+    batch_start = time.perf_counter()
+    for start in range(0, num_queries, BATCH_SIZE):
+        batch_search(queries[start : start + BATCH_SIZE])
+    batch_ms = (time.perf_counter() - batch_start) * 1000 / num_queries
+
+    print(
+        json.dumps(
+            {
+                "startup_seconds": startup_seconds,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "batch_ms": batch_ms,
+                "rss_mb": get_rss_mb(),
+                "top_document": first_result[0][0].page_content,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="2000,20000")
+    parser.add_argument("--dtypes", default="float32,float16,int8")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.directory, args.queries)
+        return
+
+    dtypes = args.dtypes.split(",")
+    print(
+        f"{'docs':>7} {'backend':>14} {'startup s':>10} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'batch ms':>9} {'rss MB':>8} {'exact top':>10}"
+    )
+    for num_docs in [int(size) for size in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            exact_top = build_indexes(directory, num_docs, dtypes)
+
+            for backend in ["chroma"] + [f"numpy_{dtype}" for dtype in dtypes]:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--measure", backend, "--directory", directory,
+                     "--queries", str(args.queries)],
+                    capture_output=True, text=True, check=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{num_docs:>7} {backend:>14} {result['startup_seconds']:>10.2f} "
+                    f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['batch_ms']:>9.2f} "
+                    f"{result['rss_mb']:>8.0f} {str(result['top_document'] == exact_top):>10}"
+                )
+
+
+if __name__ == "__main__":
+    main()
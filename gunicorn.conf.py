@@ -0,0 +1,23 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+# gunicorn settings, read automatically when gunicorn is started from the repository root.
+# The app is imported once in the master and the vector store is loaded and warmed up there
+# before any worker is forked, so every worker shares the index copy-on-write instead of
+# loading its own. Each worker then only reopens its connections in the background.
+
+# import the app in the master before forking the workers
+preload_app = True
+
+
+def when_ready(server):
+    # runs in the master after the app is imported and before the workers are forked
+    if server.cfg.preload_app:
+        from dashgpt.chat.vector_store import vector_store_manager
+
+        vector_store_manager.warm_up()
+
+
+def post_worker_init(worker):
+    from dashgpt.chat.vector_store import vector_store_manager
+
+    vector_store_manager.start_warm_up()
@@ -4,10 +4,13 @@ import dash
 from dash import html
 import dash_bootstrap_components as dbc
 import os
-from flask import Flask
+from flask import Flask, Response, jsonify, request
 from dotenv import load_dotenv, find_dotenv
 
 from dashgpt.logs import get_logger
+from dashgpt.chat.vector_store import vector_store_manager
+from dashgpt.metrics import render_metrics, METRICS_CONTENT_TYPE
+from dashgpt.chat.feedback_store import get_feedback_sink
 
 load_dotenv(find_dotenv())
 
@@ -72,6 +75,37 @@ dash_app.layout = html.Div(
 )
 dash_app._favicon = "dashgpt.ico"
 
+
+# liveness, the process is up and serving requests
+@flask_server.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+
+# readiness, the vector store is loaded and warmed up so retrievals won't wait on it
+@flask_server.route("/readyz")
+def readyz():
+    status = vector_store_manager.get_status()
+    if not status["ready"]:
+        # a process nobody has warmed up yet, e.g. a plain WSGI server, starts on the first probe
+        vector_store_manager.start_warm_up()
+        return jsonify(status), 503
+    return jsonify(status)
+
+
+# latency histograms of this process in the Prometheus text format
+@flask_server.route("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype=METRICS_CONTENT_TYPE)
+
+
+# thumbs up/down counts and approval rates overall and per prompt version, ?since=<unix time>
+@flask_server.route("/feedback-stats")
+def feedback_stats():
+    since = request.args.get("since", type=float)
+    return jsonify(get_feedback_sink().get_stats(since=since))
+
 if __name__ == "__main__":
 
+    vector_store_manager.start_warm_up()
     dash_app.run(debug=False, port=8050)
@@ -0,0 +1,188 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+# ASGI entrypoint serving /streaming-chat from an asyncio event loop, the Dash app is
+# mounted as a WSGI sub-app for everything else. Streams are multiplexed on the event
+# loop instead of each holding a worker thread for the whole generation.
+import asyncio
+import contextlib
+import functools
+
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from dashgpt.app import flask_server
+from dashgpt.logs import get_logger
+from dashgpt.metrics import RequestMetrics, get_request_id, time_stage, REQUEST_ID_HEADER
+from dashgpt.chat.vector_store import get_vector_store, vector_store_manager
+from dashgpt.chat.response_cache import response_cache, replay_response
+from dashgpt.chat.streaming import (
+    retrieve_context,
+    build_chat_completion_prompt,
+    RETRIEVAL_ERRORS,
+    UPSTREAM_ERROR_MESSAGE,
+    get_response_cache_key,
+    async_stream_send_messages,
+    async_cache_response_stream,
+    stream_chat_events,
+    async_stream_chat_events,
+)
+from dashgpt.chat.upstream import close_aiohttp_session
+from dashgpt.chat.prompt_assembly import MAX_COMPLETION_TOKENS
+from dashgpt.chat.admission import (
+    admission_controller,
+    get_client_key,
+    AsyncReleaseUnusedTokens,
+    RateLimitExceeded,
+)
+from dashgpt.chat.stream_buffer import (
+    start_stream,
+    async_start_stream,
+    async_follow_stream,
+    resume_stream,
+    stream_registry,
+    StreamNotFound,
+    StreamExpired,
+    STREAM_ID_HEADER,
+    LAST_EVENT_ID_HEADER,
+    SSE_HEADERS,
+)
+
+logger = get_logger(__name__)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse closing its body once sent or when the client disconnects.
+
+    A disconnect cancels the send the body is waiting on, without this the body would
+    only be closed when garbage collected and the stream would count as followed until then.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+def event_stream_response(buffer, events, headers):
+    return ClosingStreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={**headers, **SSE_HEADERS, STREAM_ID_HEADER: buffer.stream_id},
+    )
+
+
+def rate_limited_response(error, headers):
+    body, retry_headers = error.to_response()
+    logger.info(f"Rejected /streaming-chat request: {error}")
+    return JSONResponse(body, status_code=429, headers={**headers, **retry_headers})
+
+
+def upstream_error_response(error, headers):
+    logger.error(f"Retrieving the context failed: {error!r}")
+    return JSONResponse({"message": UPSTREAM_ERROR_MESSAGE}, status_code=503, headers=headers)
+
+
+async def streaming_chat(request: Request):
+    request_json = await request.json()
+    request_metrics = RequestMetrics(get_request_id(request.headers))
+    with request_metrics.activate():
+        headers = {REQUEST_ID_HEADER: request_metrics.request_id}
+
+        client_key = get_client_key(
+            request.client.host if request.client else None, request.headers, request_json["conversation_id"]
+        )
+        try:
+            admission_controller.check_client(client_key)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e, headers)
+
+        vector_store = get_vector_store()
+
+        # retrieval and a cache miss on the question embedding are blocking calls, keep them off the loop
+        try:
+            complete_context = await run_in_threadpool(retrieve_context, request_json["prompt"], vector_store)
+        except RETRIEVAL_ERRORS as e:
+            # the embeddings upstream is down and there's no BM25 index to fall back to
+            return upstream_error_response(e, headers)
+        with time_stage("cache_lookup"):
+            cache_key = await run_in_threadpool(
+                get_response_cache_key, request_json, complete_context, vector_store
+            )
+            cached_response = response_cache.lookup(*cache_key) if cache_key else None
+        if cached_response is not None:
+            request_metrics.cached = True
+            # replaying a cached answer is quick, a thread spares wrapping it as async
+            events = stream_chat_events(complete_context, replay_response(cached_response), request_metrics)
+            buffer = start_stream(events)
+            return event_stream_response(buffer, async_follow_stream(buffer), headers)
+
+        # reads the conversation history, from SQLite with CONVERSATION_STORE=sqlite, and counts tokens
+        chat_completion_prompt, prompt_tokens = await run_in_threadpool(
+            build_chat_completion_prompt, request_json, complete_context
+        )
+        try:
+            reservation = admission_controller.reserve(prompt_tokens + MAX_COMPLETION_TOKENS)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e, headers)
+        if reservation.wait > 0:
+            # waiting for the budget doesn't hold the loop, other streams carry on meanwhile
+            with time_stage("admission"):
+                try:
+                    await asyncio.sleep(reservation.wait)
+                finally:
+                    reservation.done_waiting()
+
+        response_stream = AsyncReleaseUnusedTokens(
+            async_stream_send_messages(chat_completion_prompt), reservation, MAX_COMPLETION_TOKENS
+        )
+        if cache_key is not None:
+            response_stream = async_cache_response_stream(response_stream, cache_key)
+
+        events = async_stream_chat_events(complete_context, response_stream, request_metrics)
+        buffer = async_start_stream(
+            events, on_finish=functools.partial(reservation.release_unused, MAX_COMPLETION_TOKENS)
+        )
+        return event_stream_response(buffer, async_follow_stream(buffer), headers)
+
+
+async def resume_streaming_chat(request: Request):
+    try:
+        buffer, after_seq = resume_stream(request.headers.get(LAST_EVENT_ID_HEADER))
+    except StreamNotFound as e:
+        logger.info(f"Can't resume stream: {e}")
+        status_code = 410 if isinstance(e, StreamExpired) else 404
+        return JSONResponse(
+            {"message": "The answer can no longer be resumed, please ask again."}, status_code=status_code
+        )
+
+    return event_stream_response(buffer, async_follow_stream(buffer, after_seq), {})
+
+
+async def cancel_streaming_chat(request: Request):
+    stream_registry.cancel(request.path_params["stream_id"])
+    return Response(status_code=204)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # warm up in the background so the worker accepts requests, and answers /readyz, straight away
+    vector_store_manager.start_warm_up()
+    yield
+    await close_aiohttp_session()
+
+
+app = Starlette(
+    routes=[
+        Route("/streaming-chat", streaming_chat, methods=["POST"]),
+        Route("/streaming-chat", resume_streaming_chat, methods=["GET"]),
+        Route("/streaming-chat/{stream_id}", cancel_streaming_chat, methods=["DELETE"]),
+        Mount("/", app=WsgiToAsgi(flask_server)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,118 @@
+// Incremental markdown renderer for streamed responses.
+// Re-parsing the whole accumulated text on every network chunk makes client CPU quadratic in the
+// response length, instead completed blocks are parsed and highlighted once then frozen in the DOM
+// and only the trailing open block is re-parsed. DOM updates are coalesced to one per animation frame.
+(function (root) {
+
+    // a block is complete once a blank line is followed by an unindented line outside of a code fence,
+    // indented lines and list items may still belong to the previous list so they don't end a block
+    function findLastBlockBoundary(text, start) {
+        let inFence = false;
+        let boundary = -1;
+        let lineStart = start;
+        let previousLineBlank = false;
+
+        while (lineStart < text.length) {
+            let lineEnd = text.indexOf("\n", lineStart);
+            // the last line may still be growing, it can't be used to decide anything yet
+            if (lineEnd === -1) break;
+
+            const line = text.slice(lineStart, lineEnd);
+            const isFence = /^\s{0,3}(```|~~~)/.test(line);
+            const isBlank = line.trim() === "";
+
+            const continuesBlock = /^[ \t]/.test(line) || /^([*+-]|\d+[.)])\s/.test(line);
+            if (!inFence && previousLineBlank && !isBlank && !continuesBlock) {
+                boundary = lineStart;
+            }
+            if (isFence) {
+                inFence = !inFence;
+                // a block ending with a closing fence is complete without waiting for a blank line
+                if (!inFence) boundary = lineEnd + 1;
+            }
+
+            previousLineBlank = isBlank && !inFence;
+            lineStart = lineEnd + 1;
+        }
+
+        return boundary;
+    }
+
+    function highlightCode(element) {
+        if (typeof hljs === "undefined") return;
+        element.querySelectorAll("pre code").forEach(function (block) {
+            hljs.highlightElement(block);
+        });
+    }
+
+    function IncrementalMarkdownRenderer(container, options) {
+        this.container = container;
+        this.options = Object.assign({ useAnimationFrame: true }, options);
+        this.text = "";
+        this.frozenLength = 0;
+        this.frameRequested = false;
+        this.renderCount = 0;
+
+        this.container.innerHTML = "";
+        this.tail = container.ownerDocument.createElement("div");
+        this.container.appendChild(this.tail);
+    }
+
+    // append a parsed block in front of the tail, its html never changes again
+    IncrementalMarkdownRenderer.prototype._freeze = function (markdown) {
+        const holder = this.container.ownerDocument.createElement("div");
+        holder.innerHTML = marked.parse(markdown, { highlight: null });
+        highlightCode(holder);
+        while (holder.firstChild) {
+            this.container.insertBefore(holder.firstChild, this.tail);
+        }
+    };
+
+    IncrementalMarkdownRenderer.prototype.flush = function () {
+        this.frameRequested = false;
+
+        const boundary = findLastBlockBoundary(this.text, this.frozenLength);
+        if (boundary > this.frozenLength) {
+            this._freeze(this.text.slice(this.frozenLength, boundary));
+            this.frozenLength = boundary;
+        }
+
+        // the open block is re-parsed each frame but not highlighted until it is frozen
+        this.tail.innerHTML = marked.parse(this.text.slice(this.frozenLength), { highlight: null });
+        this.renderCount += 1;
+    };
+
+    // replace the rendered text, rendering at most once per animation frame
+    IncrementalMarkdownRenderer.prototype.update = function (text) {
+        this.text = text;
+
+        if (!this.options.useAnimationFrame || typeof root.requestAnimationFrame === "undefined") {
+            this.flush();
+        } else if (!this.frameRequested) {
+            this.frameRequested = true;
+            const renderer = this;
+            root.requestAnimationFrame(function () {
+                if (renderer.frameRequested) renderer.flush();
+            });
+        }
+    };
+
+    // freeze whatever is left once the stream has ended and return the final html
+    IncrementalMarkdownRenderer.prototype.finish = function () {
+        this.frameRequested = false;
+
+        if (this.text.length > this.frozenLength) {
+            this._freeze(this.text.slice(this.frozenLength));
+            this.frozenLength = this.text.length;
+        }
+        this.container.removeChild(this.tail);
+        this.renderCount += 1;
+
+        return this.container.innerHTML;
+    };
+
+    root.IncrementalMarkdownRenderer = IncrementalMarkdownRenderer;
+    if (typeof module !== "undefined" && module.exports) {
+        module.exports = { IncrementalMarkdownRenderer: IncrementalMarkdownRenderer, findLastBlockBoundary: findLastBlockBoundary };
+    }
+})(typeof window !== "undefined" ? window : globalThis);
@@ -1,62 +1,230 @@
+// the answer being streamed, aborting it closes the connection and tells the server to
+// stop generating it, a dropped connection instead resumes where it left off
+let activeStream = null;
+
+// reconnects after a dropped connection, with a growing delay between them
+const MAX_RESUME_ATTEMPTS = 5;
+const RESUME_DELAY_MS = 1000;
+
+function abortActiveStream() {
+    if (activeStream !== null) {
+        activeStream.controller.abort();
+        if (activeStream.streamId !== null) {
+            // keepalive lets the request outlive the page when it's being closed
+            fetch("/streaming-chat/" + activeStream.streamId, { method: "DELETE", keepalive: true });
+        }
+        activeStream = null;
+    }
+}
+
+// leaving or reloading the page
+window.addEventListener("pagehide", abortActiveStream);
+
 window.dash_clientside = Object.assign({}, window.dash_clientside, {
     clientside: {
-        streaming_GPT: async function streamingGPT(formatted_context, n_clicks, prompt, streaming_object_id, chat_history) {
+        streaming_GPT: async function streamingGPT(prompt, streaming_object_id, conversation_id, request_id) {
 
             // if prompt is empty, return an empty string and false
             if (prompt === "") {
-                return [false, ""];
+                return [false, "", window.dash_clientside.no_update];
             }
 
+            // only one answer is streamed at a time, a new question cancels the previous one
+            abortActiveStream();
+            const controller = new AbortController();
+            const stream = { controller, streamId: null };
+            activeStream = stream;
+            const no_update = window.dash_clientside.no_update;
+            // when cancelled there's nothing to format into the chat history, the submit button
+            // is left to the stream that replaced this one, if any
+            const cancelled = () => {
+                if (activeStream === stream) {
+                    activeStream = null;
+                }
+                return [activeStream === null ? false : no_update, no_update, no_update];
+            };
+
             // id of the window we want to write the response to
             // you may use dynamically created id's here if you have multiple windows 
             // eg "#response-window-${element_id}"
-            const responseWindow = document.querySelector("#" + streaming_object_id);
+            // it is looked up once the first response arrives so the card added in the same update has rendered
+            let responseWindow = null;
             // const responseWindow = document.querySelector("#${stream_object_id}");
 
-            // "marked.js" is used to parse the incoming stream
+            // "marked.js" is used to parse the incoming stream, see "assets/incrementalMarkdown.js"
             // it is also a good idea to state in the prompt that the "response should be markdown formatted"
-            // this definition changes the color scheme of the parsed code. If your use-case does not include parsing code, you can remove this part, as well as "asssets/external/highlight.min.js" and "asssets/external/markdown-code.css"
+            // completed code blocks are highlighted with "highlight.js", if your use-case does not include parsing code, you can remove "asssets/external/highlight.min.js" and "asssets/external/markdown-code.css"
             // if your application use-case includes parsing code and wish to change color scheme of the parsed code, you can do so in "asssets/external/markdown-code.css"
             // alternatively, you can go to "https://highlightjs.org/static/demo/" to find a theme you like and then download it from "https://github.com/highlightjs/highlight.js/tree/main/src/styles"
-            marked.setOptions({
-                highlight: function (code) {
-                    return hljs.highlightAuto(code).value;
-                }
-            });
-
-            // Send the messages to the server to get the streaming response
-            // if you have more parameters python side, you can add them to the body
-            // eg. body: JSON.stringify({ prompt, parameter1, parameter2 }),
-            const response = await fetch("/streaming-chat", {
-                method: "POST",
-                headers: {
-                    "Content-Type": "application/json",
-                },
-                body: JSON.stringify({ prompt, formatted_context, chat_history }),
-            });
-
-            // Create a new TextDecoder to decode the streamed response text
-            const decoder = new TextDecoder();
-
-            // Set up a new ReadableStream to read the response body
-            const reader = response.body.getReader();
+            // the renderer is created with the first token so the status text shows until then
+            let renderer = null;
             let chunks = "";
+            let completeContext = [];
+
+            // the id of the last event received, sent as Last-Event-ID to resume the stream
+            let lastEventId = null;
+            let finished = false;
+
+            const handleEvent = (event) => {
+                if (event.type === "context") {
+                    // the retrieved documents for the context accordion
+                    completeContext = event.documents;
+                    responseWindow.textContent = "✨Generating answer...";
+                } else if (event.type === "token") {
+                    chunks += event.content;
+                    if (renderer === null) {
+                        renderer = new IncrementalMarkdownRenderer(responseWindow);
+                    }
+                    // only the trailing open block is re-parsed, at most once per animation frame
+                    renderer.update(chunks);
+                } else if (event.type === "error") {
+                    // the answer couldn't be generated, e.g. the OpenAI API is unavailable
+                    if (renderer !== null) {
+                        renderer.finish();
+                        renderer = null;
+                    }
+                    chunks = "";
+                    responseWindow.textContent = event.message;
+                } else if (event.type === "done") {
+                    finished = true;
+                }
+            };
+
+            const showMessage = (message) => {
+                if (renderer !== null) {
+                    renderer.finish();
+                    renderer = null;
+                }
+                responseWindow.textContent = message;
+            };
 
-            // Read the response stream as chunks and append them to the chat log
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) break;
-                chunks += decoder.decode(value);
-                const htmlText = marked.parse(chunks); // this line will parse the incoming stream as markdown text, using "marked.js" package
-                responseWindow.innerHTML = htmlText;
+            for (let attempt = 0; !finished; attempt++) {
+                let response;
+                try {
+                    if (attempt === 0) {
+                        // Send the messages to the server to get the context and streaming response in one request
+                        // if you have more parameters python side, you can add them to the body
+                        // eg. body: JSON.stringify({ prompt, parameter1, parameter2 }),
+                        response = await fetch("/streaming-chat", {
+                            method: "POST",
+                            headers: {
+                                "Content-Type": "application/json",
+                                // ties the server side timings of this request to the Dash callbacks in the logs
+                                "X-Request-ID": request_id,
+                            },
+                            body: JSON.stringify({ prompt, conversation_id }),
+                            signal: controller.signal,
+                        });
+                    } else {
+                        // the connection dropped before the answer was done, the server kept
+                        // generating it and sends everything after the last event received
+                        await new Promise((resolve) => setTimeout(resolve, RESUME_DELAY_MS * attempt));
+                        response = await fetch("/streaming-chat", {
+                            method: "GET",
+                            headers: { "Last-Event-ID": lastEventId },
+                            signal: controller.signal,
+                        });
+                    }
+                } catch (error) {
+                    if (error.name === "AbortError" || controller.signal.aborted) {
+                        return cancelled();
+                    }
+                    // offline, try again after the delay
+                    response = null;
+                }
+
+                if (responseWindow === null) {
+                    responseWindow = document.querySelector("#" + streaming_object_id);
+                }
+
+                if (response !== null && !response.ok) {
+                    // the question wasn't admitted, e.g. too many questions at once (429), or the
+                    // answer can no longer be resumed, the body says why and the user can ask again
+                    let message = "Something went wrong, please try again.";
+                    try {
+                        message = (await response.json()).message || message;
+                    } catch (e) {}
+                    showMessage(message);
+                    break;
+                }
+
+                if (response !== null) {
+                    stream.streamId = response.headers.get("X-Stream-ID") || stream.streamId;
+
+                    // Create a new TextDecoder to decode the streamed response text
+                    const decoder = new TextDecoder();
+                    // Set up a new ReadableStream to read the response body
+                    const reader = response.body.getReader();
+                    // the response is server-sent events separated by blank lines, an event may be
+                    // split across chunks so anything after the last blank line is kept until the rest arrives
+                    let buffer = "";
+
+                    // Read the response stream as chunks and append the answer to the chat log
+                    try {
+                        while (true) {
+                            const { done, value } = await reader.read();
+                            if (done) break;
+                            // the card was removed, e.g. by navigating to another page, stop the answer
+                            if (!responseWindow.isConnected) {
+                                if (activeStream === stream) {
+                                    abortActiveStream();
+                                }
+                                return cancelled();
+                            }
+                            // stream: true keeps multi-byte characters split across chunks intact
+                            buffer += decoder.decode(value, { stream: true });
+                            const frames = buffer.split("\n\n");
+                            buffer = frames.pop();
+
+                            for (const frame of frames) {
+                                let id = null;
+                                let data = null;
+                                for (const line of frame.split("\n")) {
+                                    // lines starting with a colon are keep-alive comments
+                                    if (line.startsWith("id: ")) {
+                                        id = line.slice(4);
+                                    } else if (line.startsWith("data: ")) {
+                                        data = line.slice(6);
+                                    }
+                                }
+                                if (data !== null) {
+                                    handleEvent(JSON.parse(data));
+                                }
+                                if (id !== null) {
+                                    lastEventId = id;
+                                }
+                            }
+                        }
+                    } catch (error) {
+                        if (error.name === "AbortError" || controller.signal.aborted) {
+                            // cancelled mid answer, the partial answer stays as it is
+                            if (renderer !== null) renderer.finish();
+                            return cancelled();
+                        }
+                        // the connection dropped, resumed below
+                    }
+                }
+
+                if (!finished && (lastEventId === null || attempt >= MAX_RESUME_ATTEMPTS)) {
+                    showMessage("The connection was lost, please try again.");
+                    break;
+                }
             }
 
             // Get the generated text from the response window
             // const generatedText = responseWindow.textContent;
-            const generatedText = responseWindow.innerHTML;
+            const generatedText = renderer === null ? "" : renderer.finish();
+            activeStream = activeStream === stream ? null : activeStream;
+
+            // Return false to enable the submit button again (disabled=false), the generated text
+            // and the documents it was generated from
+            return [false, generatedText, finished ? completeContext : no_update];
+        },
 
-            // Return the generated text and false to enable the submit button again (disabled=false)
-            return [false, generatedText];
+        // starting a new conversation cancels the answer being streamed
+        abort_streaming_GPT: function abortStreamingGPT(n_clicks) {
+            abortActiveStream();
+            return window.dash_clientside.no_update;
         }
     }
 });
\ No newline at end of file
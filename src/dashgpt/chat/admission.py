@@ -0,0 +1,426 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Admission control of /streaming-chat requests.
+
+Each client gets a token bucket of requests so one client can't open many streams at
+once, checked before any work is done. Requests that will call the OpenAI API then
+reserve their prompt and completion tokens from the global requests and tokens per
+minute budgets, matching the upstream quota. When a budget is used up requests wait in
+line for it, up to ADMISSION_MAX_WAIT seconds and ADMISSION_QUEUE_SIZE requests, anything
+beyond that is rejected straight away with a 429 so admitted requests keep a
+predictable latency under overload.
+
+Budgets are kept per process, gunicorn's WEB_CONCURRENCY workers each get their share.
+"""
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+
+from dashgpt.logs import get_logger
+from dashgpt.metrics import ADMISSION_REJECTIONS
+
+logger = get_logger(__name__)
+
+# requests per minute and burst of one client, 0 turns the per client limit off
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "20"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "5"))
+# what identifies a client: "ip", the client address of the connection, "forwarded-for",
+# the address the proxy in front of the app appended to X-Forwarded-For, or "conversation"
+RATE_LIMIT_KEY = os.getenv("RATE_LIMIT_KEY", "ip")
+# the upstream quota of the chat model, 0 turns the budget off
+UPSTREAM_RPM = float(os.getenv("UPSTREAM_RPM", "3500"))
+UPSTREAM_TPM = float(os.getenv("UPSTREAM_TPM", "90000"))
+# requests waiting for the budget and the longest they may wait before being rejected
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+# gunicorn's worker count, each worker enforces its share of the upstream quota
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# clients whose buckets are kept, the least recently seen are dropped first
+MAX_CLIENTS = 10000
+
+RATE_LIMIT_KEYS = ["ip", "forwarded-for", "conversation"]
+
+RATE_LIMIT_MESSAGE = "Too many questions are being asked right now, please try again in a few seconds."
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a request is not admitted.
+
+    Parameters
+    ----------
+    reason : str
+        "client_rate", "queue_full" or "over_budget".
+    retry_after : float
+        Seconds after which the request would likely be admitted.
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Request rejected ({reason}), retry after {retry_after:.1f}s.")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_response(self):
+        """
+        Get the body and headers of the 429 response.
+
+        Returns
+        -------
+        dict
+            The JSON body with the message shown to the user.
+        dict
+            The Retry-After header, in whole seconds.
+        """
+        body = {"error": self.reason, "message": RATE_LIMIT_MESSAGE}
+        return body, {"Retry-After": str(max(math.ceil(self.retry_after), 1))}
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a fixed rate up to its capacity.
+
+    Not thread safe, the AdmissionController serializes access.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    capacity : float
+        The most tokens the bucket holds, the largest burst.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_consume(self, amount=1):
+        """
+        Take tokens if the bucket has them.
+
+        Returns
+        -------
+        float
+            0 if the tokens were taken, otherwise the seconds until they're available.
+        """
+        self._refill()
+        if self._tokens >= amount:
+            self._tokens -= amount
+            return 0.0
+        return (amount - self._tokens) / self.rate
+
+    def reserve(self, amount):
+        """
+        Take tokens, going into debt if the bucket doesn't have them.
+
+        Later reservations queue behind the debt, so requests are served in order.
+
+        Returns
+        -------
+        float
+            The seconds to wait until the reserved tokens are covered.
+        """
+        self._refill()
+        self._tokens -= amount
+        return max(-self._tokens, 0.0) / self.rate
+
+    def refund(self, amount):
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class Reservation:
+    """
+    Requests and tokens reserved from the upstream budget for one request.
+
+    Parameters
+    ----------
+    controller : AdmissionController
+        The controller the budget was reserved from.
+    tokens : int
+        The tokens reserved.
+    wait : float
+        The seconds to wait before calling the upstream.
+    """
+
+    def __init__(self, controller, tokens, wait):
+        self.controller = controller
+        self.tokens = tokens
+        self.wait = wait
+        self.used_tokens = 0
+        self._waiting = wait > 0
+        self._released = False
+
+    def done_waiting(self):
+        """
+        Leave the wait queue, call this after waiting, including when the wait was cancelled.
+        """
+        if self._waiting:
+            self._waiting = False
+            self.controller._leave_queue()
+
+    def refund(self, tokens):
+        """
+        Return reserved tokens that weren't used, e.g. when the answer was shorter than
+        the completion tokens reserved.
+        """
+        tokens = min(max(tokens, 0), self.tokens)
+        self.tokens -= tokens
+        self.controller._refund_tokens(tokens)
+
+    def release_unused(self, max_completion_tokens):
+        """
+        Refund the completion tokens the answer didn't use, once however often it's called.
+
+        Called when the stream ends, also when it was cancelled or abandoned before its
+        first token was pulled and nothing was counted.
+
+        Parameters
+        ----------
+        max_completion_tokens : int
+            The completion tokens reserved, used_tokens of them were streamed.
+        """
+        if not self._released:
+            self._released = True
+            self.refund(max_completion_tokens - self.used_tokens)
+
+
+class AdmissionController:
+    """
+    Per client token buckets and the upstream requests and tokens per minute budgets.
+
+    Parameters
+    ----------
+    client_rate_per_minute : float, optional
+        Requests per minute of one client, 0 for no limit.
+    client_burst : float, optional
+        Requests one client can make at once.
+    requests_per_minute : float, optional
+        The upstream requests per minute budget of this process, 0 for no limit.
+    tokens_per_minute : float, optional
+        The upstream tokens per minute budget of this process, 0 for no limit.
+    queue_size : int, optional
+        Requests that may wait for the upstream budget at once.
+    max_wait : float, optional
+        The longest a request may wait for the upstream budget.
+    """
+
+    def __init__(
+        self,
+        client_rate_per_minute=RATE_LIMIT_PER_MINUTE,
+        client_burst=RATE_LIMIT_BURST,
+        requests_per_minute=UPSTREAM_RPM / WEB_CONCURRENCY,
+        tokens_per_minute=UPSTREAM_TPM / WEB_CONCURRENCY,
+        queue_size=ADMISSION_QUEUE_SIZE,
+        max_wait=ADMISSION_MAX_WAIT,
+    ):
+        self.client_rate = client_rate_per_minute / 60
+        self.client_burst = client_burst
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        # a minute of quota can be used at once, like the upstream allows
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self._clients = OrderedDict()
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def _reject(self, reason, retry_after):
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        raise RateLimitExceeded(reason, retry_after)
+
+    def check_client(self, client_key):
+        """
+        Count a request against the bucket of its client.
+
+        Parameters
+        ----------
+        client_key : str
+            Identifies the client, see get_client_key.
+
+        Raises
+        ------
+        RateLimitExceeded
+            If the client has no requests left.
+        """
+        if not self.client_rate:
+            return
+
+        with self._lock:
+            bucket = self._clients.pop(client_key, None) or TokenBucket(self.client_rate, self.client_burst)
+            self._clients[client_key] = bucket
+            if len(self._clients) > MAX_CLIENTS:
+                # a bucket unused for long is full again, dropping it changes nothing
+                self._clients.popitem(last=False)
+
+            wait = bucket.try_consume(1)
+        if wait > 0:
+            self._reject("client_rate", wait)
+
+    def reserve(self, tokens):
+        """
+        Reserve a request and its tokens from the upstream budget.
+
+        Parameters
+        ----------
+        tokens : int
+            The prompt tokens plus the completion tokens requested.
+
+        Returns
+        -------
+        Reservation
+            The reservation, wait its wait seconds before calling the upstream.
+
+        Raises
+        ------
+        RateLimitExceeded
+            If the wait queue is full or the wait would be longer than max_wait.
+        """
+        with self._lock:
+            if self._waiting >= self.queue_size:
+                self._reject("queue_full", self.max_wait)
+
+            wait = 0.0
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens))
+
+            if wait > self.max_wait:
+                if self.requests is not None:
+                    self.requests.refund(1)
+                if self.tokens is not None:
+                    self.tokens.refund(tokens)
+                self._reject("over_budget", wait)
+
+            if wait > 0:
+                self._waiting += 1
+
+        return Reservation(self, tokens, wait)
+
+    def _leave_queue(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def _refund_tokens(self, tokens):
+        if self.tokens is not None and tokens:
+            with self._lock:
+                self.tokens.refund(tokens)
+
+    def get_status(self):
+        return {"waiting": self._waiting, "clients": len(self._clients)}
+
+
+admission_controller = AdmissionController()
+
+
+def get_client_key(remote_address, headers, conversation_id):
+    """
+    Get the key of the bucket a request counts against, set by RATE_LIMIT_KEY.
+
+    Parameters
+    ----------
+    remote_address : str
+        The address of the connection.
+    headers : mapping
+        The request headers.
+    conversation_id : str
+        The id of the conversation of the request.
+
+    Returns
+    -------
+    str
+        The client key.
+    """
+    if RATE_LIMIT_KEY not in RATE_LIMIT_KEYS:
+        raise ValueError("RATE_LIMIT_KEY must be one of " + ", ".join(RATE_LIMIT_KEYS))
+
+    if RATE_LIMIT_KEY == "conversation":
+        # conversation ids are made by the browser, a client can start new ones at will
+        return f"conversation:{conversation_id}"
+    if RATE_LIMIT_KEY == "forwarded-for" and headers.get("X-Forwarded-For"):
+        # the last address is the one our proxy appended, the ones before can be forged
+        return "ip:" + headers["X-Forwarded-For"].split(",")[-1].strip()
+
+    return f"ip:{remote_address}"
+
+
+class ReleaseUnusedTokens:
+    """
+    Pass a response stream through, refunding the completion tokens it didn't use.
+
+    An iterator rather than a generator so closing it refunds the tokens even before the
+    first chunk was pulled, a generator's cleanup only runs once it started. Streams
+    closed unstarted further out also call Reservation.release_unused, see start_stream.
+
+    Parameters
+    ----------
+    response_stream : generator of str
+        The streamed chunks of the answer, one token each, closed with this iterator.
+    reservation : Reservation
+        The reservation of the request.
+    max_completion_tokens : int
+        The completion tokens reserved.
+    """
+
+    def __init__(self, response_stream, reservation, max_completion_tokens):
+        self.response_stream = response_stream
+        self.reservation = reservation
+        self.max_completion_tokens = max_completion_tokens
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.response_stream)
+        except BaseException:
+            # the stream ended or failed, the rest of the reservation isn't needed
+            self.close()
+            raise
+        self.reservation.used_tokens += 1
+        return chunk
+
+    def close(self):
+        try:
+            self.response_stream.close()
+        finally:
+            self.reservation.release_unused(self.max_completion_tokens)
+
+
+class AsyncReleaseUnusedTokens:
+    """
+    Async version of ReleaseUnusedTokens for the ASGI streaming route.
+    """
+
+    def __init__(self, response_stream, reservation, max_completion_tokens):
+        self.response_stream = response_stream
+        self.reservation = reservation
+        self.max_completion_tokens = max_completion_tokens
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self.response_stream.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+        self.reservation.used_tokens += 1
+        return chunk
+
+    async def aclose(self):
+        try:
+            await self.response_stream.aclose()
+        finally:
+            self.reservation.release_unused(self.max_completion_tokens)
@@ -1,26 +1,27 @@
 # Author: Ty ANdrews
 # Date: 2023-09021
 import os
+import sys
 
 import openai
 import platform
 from dotenv import load_dotenv, find_dotenv
-from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.schema import Document
 import re
 
 from dashgpt.logs import get_logger
-from dashgpt.data.langchain_utils import count_tokens
-
-# for eployment on azure, Chroma SQlite version is out oof date, over write
-# inspired from: https://gist.github.com/defulmere/8b9695e415a44271061cc8e272f3c300
-if platform.system() == "Linux":
-    # these three lines swap the stdlib sqlite3 lib with the pysqlite3 package
-    __import__('pysqlite3')
-    import sys
-    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
-
-from langchain.vectorstores import Chroma
+from dashgpt.metrics import time_stage
+from dashgpt.data.embedding_cache import CachedEmbeddings
+from dashgpt.data.embedding_providers import (
+    get_collection_embedding_config,
+    get_embeddings,
+    create_embeddings,
+)
+from dashgpt.data.numpy_vector_store import NumpyVectorStore
+from dashgpt.data.bm25_index import get_bm25_index
+from dashgpt.data.mmr import max_marginal_relevance_search_by_vector
+from dashgpt.chat.prompt_assembly import DEFAULT_MODEL, MAX_COMPLETION_TOKENS
+from dashgpt.chat.upstream import UpstreamEmbeddings, stream_chat_completion, REQUEST_TIMEOUT
 
 logger = get_logger(__name__)
 
@@ -30,72 +31,214 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 openai.api_key = OPENAI_API_KEY
 
-
-def connect_to_vectorstore():
+# which vector store to retrieve from, "chroma" or "numpy", the numpy index is built from
+# the chroma collection with dashgpt.data.export_numpy_index
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+CHROMA_PERSIST_DIRECTORY = os.path.join("data", "processed", "reddit_jokes_chroma_db")
+CHROMA_COLLECTION_NAME = "reddit_jokes_2000"
+NUMPY_INDEX_PATH = os.getenv(
+    "NUMPY_INDEX_PATH", os.path.join("data", "processed", "reddit_jokes_numpy_index")
+)
+
+# how questions are answered, "similarity", "mmr", "lexical" for BM25 only, which makes no
+# embedding request, or "hybrid" for BM25 and similarity fused by reciprocal rank
+RETRIEVAL_METHOD = os.getenv("RETRIEVAL_METHOD", "similarity")
+RETRIEVAL_METHODS = ("similarity", "mmr", "lexical", "hybrid")
+# documents taken from each of the BM25 and similarity rankings before fusing them
+HYBRID_FETCH_K = 20
+# dampens the weight of the top ranks in reciprocal rank fusion, 60 is the usual choice
+RRF_K = 60
+# candidates re-ranked by mmr and the trade off between relevance (1) and diversity (0)
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", 10))
+MMR_LAMBDA_MULT = float(os.getenv("MMR_LAMBDA_MULT", 0.5))
+
+
+def connect_to_chroma(
+    embedding_function,
+    persist_directory=CHROMA_PERSIST_DIRECTORY,
+    collection_name=CHROMA_COLLECTION_NAME,
+    collection_metadata=None,
+):
     """
-    Connect to the VectorStore and return a VectorStore object.
+    Connect to the Chroma collection, it is created if it doesn't exist.
+
+    Parameters
+    ----------
+    embedding_function : Embeddings
+        The embeddings used for the queries.
+    persist_directory : str, optional
+        The folder Chroma persists the collection to.
+    collection_name : str, optional
+        The name of the collection.
+    collection_metadata : dict, optional
+        Metadata of the collection, replaces the metadata of an existing collection.
 
     Returns
     -------
-    VectorStore object
-        The VectorStore object connected to the VectorStore.
+    Chroma
+        The Chroma VectorStore.
     """
-    embedding_function = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+    # for eployment on azure, Chroma SQlite version is out oof date, over write
+    # inspired from: https://gist.github.com/defulmere/8b9695e415a44271061cc8e272f3c300
+    # only done when Chroma is used and before it is imported for the first time
+    if platform.system() == "Linux" and "chromadb" not in sys.modules:
+        # these three lines swap the stdlib sqlite3 lib with the pysqlite3 package
+        __import__('pysqlite3')
+        sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+    from langchain.vectorstores import Chroma
 
     chroma_db = Chroma(
-        persist_directory = "data/processed/reddit_jokes_chroma_db",
+        persist_directory = persist_directory,
         embedding_function = embedding_function,
-        collection_name = "reddit_jokes_2000"
+        collection_name = collection_name,
+        collection_metadata = collection_metadata,
     )
 
     return chroma_db
 
 
-def stream_send_messages(prompt):
+def get_collection_metadata(vector_store):
+    """
+    Get the metadata of the collection of a VectorStore.
+
+    Parameters
+    ----------
+    vector_store : VectorStore object
+        A Chroma or NumPy VectorStore.
+
+    Returns
+    -------
+    dict
+        The metadata of the collection, empty if it has none.
+    """
+    if hasattr(vector_store, "_collection"):
+        return vector_store._collection.metadata or {}
+
+    return getattr(vector_store, "collection_metadata", {})
+
+
+def connect_to_numpy_index(embedding_function):
     """
-    Send a prompt to the OpenAI API and return the response.
+    Load the memory-mapped NumPy index.
 
     Parameters
     ----------
-    prompt : str
-        The prompt to send to the OpenAI API.
+    embedding_function : Embeddings
+        The embeddings used for the queries.
+
+    Returns
+    -------
+    NumpyVectorStore
+        The NumPy VectorStore.
+    """
+    return NumpyVectorStore.load(NUMPY_INDEX_PATH, embedding_function)
+
+
+VECTOR_STORE_BACKENDS = {
+    "chroma": connect_to_chroma,
+    "numpy": connect_to_numpy_index,
+}
+
+
+def connect_to_vectorstore():
+    """
+    Connect to the VectorStore configured by the VECTOR_STORE_BACKEND environment variable.
 
     Returns
     -------
-    OpenAI ChatCompletion object
-        The response from the OpenAI API.
+    VectorStore object
+        The VectorStore object connected to the VectorStore.
     """
+    if VECTOR_STORE_BACKEND not in VECTOR_STORE_BACKENDS:
+        raise ValueError("VECTOR_STORE_BACKEND must be one of " + ", ".join(VECTOR_STORE_BACKENDS))
 
-    # calculate the number of tokens by combining the prompt and the user prompt
-    total_tokens = 0
-    for message in prompt:
-        total_tokens += count_tokens(message["content"])
+    vector_store = VECTOR_STORE_BACKENDS[VECTOR_STORE_BACKEND](embedding_function=None)
 
-    if total_tokens > 2048:
-        logger.warning(
-            f"Total tokens {total_tokens} exceeds maximum of 2048. Using turbo 16k context model."
+    # questions are embedded with the provider and model the collection was built with
+    provider, model_name = get_collection_embedding_config(get_collection_metadata(vector_store))
+
+    if provider == "openai":
+        # retried with jittered backoff and behind a circuit breaker by the upstream layer
+        # instead of by langchain, which waits up to a minute between its own retries
+        embeddings = UpstreamEmbeddings(
+            create_embeddings(provider, model_name, max_retries=1, request_timeout=REQUEST_TIMEOUT)
         )
-        # uncomment this to auto flip to 16k model
-        # model = "gpt-3.5-turbo-16k"
-        # instead only use the last 512 tokens of user prompt to limit abuse
-        prompt[-1]["content"] = prompt[-1]["content"][-512:]
     else:
-        model = "gpt-3.5-turbo"
-
-    """OpenAI API call. You may choose parameters here but `stream=True` is required."""
-    return openai.ChatCompletion.create(
-        model=model,
-        messages=prompt,
-        stream=True,
-        max_tokens=1024,
-        temperature=0.5,
-    )
+        embeddings = get_embeddings(provider, model_name)
+
+    # repeated and sample questions are served from the cache without embedding them again,
+    # both backends keep the embeddings of the queries in _embedding_function
+    vector_store._embedding_function = CachedEmbeddings(embeddings, model_name=model_name)
+
+    logger.info(f"Using {VECTOR_STORE_BACKEND} vector store with {provider} {model_name} embeddings.")
+
+    return vector_store
+
+
+def stream_send_messages(prompt, model=DEFAULT_MODEL, max_tokens=MAX_COMPLETION_TOKENS):
+    """
+    Send a prompt to the OpenAI API and yield the response text.
+
+    The prompt should already fit the model context window, see
+    dashgpt.chat.prompt_assembly.assemble_prompt. The request goes through the pooled
+    session, timeouts and circuit breaker of dashgpt.chat.upstream.
+
+    Parameters
+    ----------
+    prompt : list of dict
+        The chat completion messages to send to the OpenAI API.
+    model : str, optional
+        The chat model to use. Default is "gpt-3.5-turbo".
+    max_tokens : int, optional
+        The maximum number of tokens to generate. Default is 1024.
+
+    Yields
+    ------
+    str
+        The content of each streamed chunk of the response.
+    """
+    yield from stream_chat_completion(prompt, model=model, max_tokens=max_tokens)
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """
+    Fuse rankings of documents by summing 1 / (rrf_k + rank) over the rankings.
+
+    Parameters
+    ----------
+    rankings : list of list of Document objects
+        The rankings to fuse, best first. Documents are matched on their content.
+    k : int
+        The number of documents to return.
+    rrf_k : int, optional
+        The rank offset, larger values weigh the top ranks less.
+
+    Returns
+    -------
+    list of Document objects
+        The k documents with the highest fused score, stored in their "score" metadata.
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc.page_content] = scores.get(doc.page_content, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(doc.page_content, doc)
+
+    fused = sorted(scores, key=scores.get, reverse=True)[:k]
+    for content in fused:
+        documents[content].metadata["score"] = scores[content]
+
+    return [documents[content] for content in fused]
+
 
 def get_relevant_documents(
     user_prompt,
     vector_store,
     k=3,
     method="similarity",
+    fetch_k=MMR_FETCH_K,
+    lambda_mult=MMR_LAMBDA_MULT,
 ):
     """
     Get the most relevant documents from the VectorStore for a given user prompt.
@@ -107,7 +250,13 @@ def get_relevant_documents(
     vector_store : Zilliz object
         The object connected to the VectorStore.
     method: str, optional
-        The method to use for searching the VectorStore, options are mmr, similarity. Default is "similarity".
+        The method to use for searching the VectorStore, options are mmr, similarity,
+        lexical and hybrid. Default is "similarity".
+    fetch_k : int, optional
+        The number of candidates mmr re-ranks. Default is the MMR_FETCH_K environment variable.
+    lambda_mult : float, optional
+        The mmr trade off between relevance (1) and diversity (0). Default is the
+        MMR_LAMBDA_MULT environment variable.
 
     Returns
     -------
@@ -116,18 +265,32 @@ def get_relevant_documents(
     """
 
     if method == "mmr":
-        relevant_documents = vector_store.max_marginal_relevance_search(
-            query=user_prompt,
-            k=k,
-            fetch_k=10,
-        )
+        with time_stage("embed"):
+            embedding = vector_store.embeddings.embed_query(user_prompt)
+
+        # candidates are fetched once with their embeddings and re-ranked in process
+        with time_stage("vector_search"):
+            relevant_documents = max_marginal_relevance_search_by_vector(
+                vector_store,
+                embedding,
+                k=k,
+                fetch_k=fetch_k,
+                lambda_mult=lambda_mult,
+            )
+        for doc, score in relevant_documents:
+            doc.metadata["score"] = score
 
-        return relevant_documents
+        return [doc for doc, score in relevant_documents]
     elif method == "similarity":
-        relevant_documents = vector_store.similarity_search_with_score(
-            query=user_prompt,
-            k=k,
-        )
+        # embedded separately from the search so the two are timed apart
+        with time_stage("embed"):
+            embedding = vector_store.embeddings.embed_query(user_prompt)
+
+        with time_stage("vector_search"):
+            relevant_documents = vector_store.similarity_search_by_vector_with_relevance_scores(
+                embedding,
+                k=k,
+            )
         # take the relavant documents which is a list of tuples of Document, score and convert to a list of Document
         # with a new field in metadata of each document called score
         for doc, score in relevant_documents:
@@ -138,8 +301,25 @@ def get_relevant_documents(
 
         # return selected_relevant_documents
         return relevant_documents_with_score
+    elif method == "lexical":
+        # answered from the BM25 index alone, the question is never embedded
+        with time_stage("lexical_search"):
+            relevant_documents = get_bm25_index().search_with_score(user_prompt, k=k)
+        for doc, score in relevant_documents:
+            doc.metadata["score"] = score
+
+        return [doc for doc, score in relevant_documents]
+    elif method == "hybrid":
+        lexical_documents = get_relevant_documents(
+            user_prompt, vector_store, k=HYBRID_FETCH_K, method="lexical"
+        )
+        similar_documents = get_relevant_documents(
+            user_prompt, vector_store, k=HYBRID_FETCH_K, method="similarity"
+        )
+
+        return reciprocal_rank_fusion([lexical_documents, similar_documents], k=k)
     else:
-        raise ValueError("method must be mmr or similarity")
+        raise ValueError("method must be one of " + ", ".join(RETRIEVAL_METHODS))
 
 
 def convert_documents_to_chat_context(relevant_documents):
@@ -0,0 +1,270 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+import os
+import json
+import time
+import sqlite3
+import threading
+from functools import lru_cache
+
+from dashgpt.logs import get_logger
+
+logger = get_logger(__name__)
+
+# which backend to keep conversations in, "memory" is per worker so use "sqlite"
+# when running more than one gunicorn worker
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory")
+CONVERSATION_STORE_PATH = os.getenv(
+    "CONVERSATION_STORE_PATH", os.path.join("data", "conversations.sqlite3")
+)
+# seconds since its last message after which a conversation is deleted
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "86400"))
+# minimum seconds between sweeps for expired conversations
+EVICTION_INTERVAL = 60
+
+
+class ConversationStore:
+    """
+    Interface for storing the messages of each conversation server side, keyed by
+    conversation id, so the browser only sends the id and the new message.
+
+    Messages are dictionaries with at least a "role" and "content", any other keys
+    are stored and returned as is. Subclass this and add it to
+    CONVERSATION_STORE_BACKENDS to plug in another backend.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds since its last message after which a conversation is deleted.
+    """
+
+    def __init__(self, ttl=CONVERSATION_TTL):
+        self.ttl = ttl
+        self._last_eviction = time.time()
+
+    def get_messages(self, conversation_id):
+        """
+        Get the messages of a conversation, oldest first.
+
+        Parameters
+        ----------
+        conversation_id : str
+            The id of the conversation.
+
+        Returns
+        -------
+        list of dict
+            The messages, empty if the conversation doesn't exist or has expired.
+        """
+        raise NotImplementedError
+
+    def append_message(self, conversation_id, message):
+        """
+        Add a message to the end of a conversation, creating it if needed.
+
+        Parameters
+        ----------
+        conversation_id : str
+            The id of the conversation.
+        message : dict
+            The message with at least a "role" and "content".
+        """
+        raise NotImplementedError
+
+    def delete_conversation(self, conversation_id):
+        """
+        Delete a conversation and all of its messages.
+
+        Parameters
+        ----------
+        conversation_id : str
+            The id of the conversation.
+        """
+        raise NotImplementedError
+
+    def evict_expired(self):
+        """
+        Delete every conversation that hasn't had a message within the ttl.
+        """
+        raise NotImplementedError
+
+    def _maybe_evict(self):
+        # sweep on writes but no more than once per interval to keep appends cheap
+        if time.time() - self._last_eviction > EVICTION_INTERVAL:
+            self._last_eviction = time.time()
+            self.evict_expired()
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Conversation store held in the memory of a single worker process.
+    """
+
+    def __init__(self, ttl=CONVERSATION_TTL):
+        super().__init__(ttl=ttl)
+        self._conversations = {}
+        self._lock = threading.Lock()
+
+    def get_messages(self, conversation_id):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None or time.time() - conversation["updated_at"] > self.ttl:
+                return []
+            return list(conversation["messages"])
+
+    def append_message(self, conversation_id, message):
+        with self._lock:
+            conversation = self._conversations.setdefault(
+                conversation_id, {"messages": [], "updated_at": time.time()}
+            )
+            conversation["messages"].append(message)
+            conversation["updated_at"] = time.time()
+
+        self._maybe_evict()
+
+    def delete_conversation(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+    def evict_expired(self):
+        expiry = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                conversation_id
+                for conversation_id, conversation in self._conversations.items()
+                if conversation["updated_at"] < expiry
+            ]
+            for conversation_id in expired:
+                del self._conversations[conversation_id]
+
+        if expired:
+            logger.debug(f"Evicted {len(expired)} expired conversations.")
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Conversation store in a SQLite file which can be shared by all workers on a machine.
+
+    Parameters
+    ----------
+    path : str, optional
+        The path of the SQLite database file.
+    ttl : float, optional
+        Seconds since its last message after which a conversation is deleted.
+    """
+
+    def __init__(self, path=CONVERSATION_STORE_PATH, ttl=CONVERSATION_TTL):
+        super().__init__(ttl=ttl)
+        self.path = path
+        # sqlite connections can't be shared between threads so each thread opens its own
+        self._local = threading.local()
+
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversations (
+                    conversation_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    conversation_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    message TEXT NOT NULL,
+                    PRIMARY KEY (conversation_id, position)
+                )
+                """
+            )
+
+    def _get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        # a connection opened before a fork, e.g. with gunicorn preload_app, can't be used
+        # by the child so each process opens its own
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            # WAL lets many worker processes read while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_messages(self, conversation_id):
+        connection = self._get_connection()
+        row = connection.execute(
+            "SELECT updated_at FROM conversations WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return []
+
+        rows = connection.execute(
+            "SELECT message FROM messages WHERE conversation_id = ? ORDER BY position",
+            (conversation_id,),
+        ).fetchall()
+        return [json.loads(message) for (message,) in rows]
+
+    def append_message(self, conversation_id, message):
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                """
+                INSERT INTO messages (conversation_id, position, message)
+                SELECT ?, COALESCE(MAX(position) + 1, 0), ? FROM messages WHERE conversation_id = ?
+                """,
+                (conversation_id, json.dumps(message), conversation_id),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO conversations (conversation_id, updated_at) VALUES (?, ?)",
+                (conversation_id, time.time()),
+            )
+
+        self._maybe_evict()
+
+    def delete_conversation(self, conversation_id):
+        connection = self._get_connection()
+        with connection:
+            connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            connection.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+
+    def evict_expired(self):
+        expiry = time.time() - self.ttl
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                """
+                DELETE FROM messages WHERE conversation_id IN (
+                    SELECT conversation_id FROM conversations WHERE updated_at < ?
+                )
+                """,
+                (expiry,),
+            )
+            connection.execute("DELETE FROM conversations WHERE updated_at < ?", (expiry,))
+
+
+CONVERSATION_STORE_BACKENDS = {
+    "memory": InMemoryConversationStore,
+    "sqlite": SQLiteConversationStore,
+}
+
+
+@lru_cache(maxsize=None)
+def get_conversation_store():
+    """
+    Get the conversation store configured by the CONVERSATION_STORE environment variable.
+
+    Returns
+    -------
+    ConversationStore
+        The conversation store shared by every callback and route of this process.
+    """
+    if CONVERSATION_STORE not in CONVERSATION_STORE_BACKENDS:
+        raise ValueError(
+            "CONVERSATION_STORE must be one of " + ", ".join(CONVERSATION_STORE_BACKENDS)
+        )
+
+    logger.info(f"Using {CONVERSATION_STORE} conversation store.")
+
+    return CONVERSATION_STORE_BACKENDS[CONVERSATION_STORE]()
@@ -0,0 +1,396 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+import os
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from functools import lru_cache
+
+from dashgpt.logs import get_logger
+
+logger = get_logger(__name__)
+
+# where thumbs up/down and feedback modal submissions are kept, "sqlite" or "jsonl"
+FEEDBACK_STORE = os.getenv("FEEDBACK_STORE", "sqlite")
+FEEDBACK_STORE_PATH = os.getenv("FEEDBACK_STORE_PATH", "")
+DEFAULT_FEEDBACK_STORE_PATHS = {
+    "sqlite": os.path.join("data", "feedback.sqlite3"),
+    "jsonl": os.path.join("data", "feedback.jsonl"),
+}
+# seconds queued feedback waits at most before it is written
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "1.0"))
+# maximum records written per batch
+FEEDBACK_BATCH_SIZE = 100
+# records waiting to be written, more are dropped rather than blocking a callback
+FEEDBACK_QUEUE_SIZE = 10000
+
+FEEDBACK_FIELDS = [
+    "message_id",
+    "conversation_id",
+    "request_id",
+    "rating",
+    "feedback_type",
+    "feedback_text",
+    "prompt_version",
+    "document_ids",
+    "created_at",
+]
+# the reasons given for a rating, cleared when a later record changes the rating
+RATING_DETAIL_FIELDS = ["feedback_type", "feedback_text"]
+
+
+def merge_feedback(records):
+    """
+    Merge feedback records into the latest feedback of each message.
+
+    A message has one feedback, e.g. a thumbs down followed by the feedback modal, later
+    records replace the rating and fill in any fields they have. A record changing the
+    rating clears the feedback type and text given for the old one.
+
+    Parameters
+    ----------
+    records : iterable of dict
+        The feedback records, oldest first.
+
+    Returns
+    -------
+    dict
+        The merged feedback of each message, keyed by message id.
+    """
+    messages = {}
+    for record in records:
+        merged = messages.setdefault(record["message_id"], {})
+        if record.get("rating") is not None and record["rating"] != merged.get("rating"):
+            for field in RATING_DETAIL_FIELDS:
+                merged.pop(field, None)
+        merged.update({key: value for key, value in record.items() if value is not None})
+
+    return messages
+
+
+def summarize_feedback(messages):
+    """
+    Aggregate the feedback of each message into counts and approval rates.
+
+    Parameters
+    ----------
+    messages : iterable of dict
+        The merged feedback of each message.
+
+    Returns
+    -------
+    dict
+        The number of rated messages, thumbs up and down, the approval rate, the count
+        of each feedback type and the same ratings per prompt version.
+    """
+
+    def summarize_ratings(up, down):
+        return {
+            "messages": up + down,
+            "up": up,
+            "down": down,
+            "approval_rate": up / (up + down) if up + down else None,
+        }
+
+    ratings = {}
+    feedback_types = {}
+    for message in messages:
+        counts = ratings.setdefault(message.get("prompt_version"), {"up": 0, "down": 0})
+        if message.get("rating") in counts:
+            counts[message["rating"]] += 1
+        if message.get("feedback_type"):
+            feedback_types[message["feedback_type"]] = feedback_types.get(message["feedback_type"], 0) + 1
+
+    return {
+        **summarize_ratings(
+            sum(counts["up"] for counts in ratings.values()),
+            sum(counts["down"] for counts in ratings.values()),
+        ),
+        "feedback_types": feedback_types,
+        "prompt_versions": {
+            str(version): summarize_ratings(counts["up"], counts["down"])
+            for version, counts in ratings.items()
+        },
+    }
+
+
+class FeedbackStore:
+    """
+    Interface for persisting user feedback on answers, keyed by message id.
+
+    Records are dictionaries with the FEEDBACK_FIELDS, a later record of a message
+    replaces its rating and fills in the fields it has. Subclass this and add it to
+    FEEDBACK_STORE_BACKENDS to plug in another backend.
+    """
+
+    def write_batch(self, records):
+        """
+        Persist a batch of feedback records.
+
+        Parameters
+        ----------
+        records : list of dict
+            The feedback records, oldest first.
+        """
+        raise NotImplementedError
+
+    def get_stats(self, since=None):
+        """
+        Aggregate the stored feedback, see summarize_feedback.
+
+        Parameters
+        ----------
+        since : float, optional
+            Only include feedback given after this unix time.
+
+        Returns
+        -------
+        dict
+            The feedback counts and approval rates, overall and per prompt version.
+        """
+        raise NotImplementedError
+
+
+class SQLiteFeedbackStore(FeedbackStore):
+    """
+    Feedback store in a SQLite file which can be shared by all workers on a machine.
+
+    Parameters
+    ----------
+    path : str, optional
+        The path of the SQLite database file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or FEEDBACK_STORE_PATH or DEFAULT_FEEDBACK_STORE_PATHS["sqlite"]
+        # only the writer thread writes, the lock guards the connection against stats queries
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS feedback (
+                        message_id TEXT PRIMARY KEY,
+                        conversation_id TEXT,
+                        request_id TEXT,
+                        rating TEXT,
+                        feedback_type TEXT,
+                        feedback_text TEXT,
+                        prompt_version TEXT,
+                        document_ids TEXT,
+                        created_at REAL NOT NULL
+                    )
+                    """
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS feedback_created_at ON feedback (created_at)")
+
+    def _get_connection(self):
+        # a connection opened before a fork, e.g. with gunicorn preload_app, can't be used
+        # by the child so each process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            # WAL lets many worker processes read while one writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def write_batch(self, records):
+        rows = [
+            tuple(
+                json.dumps(record.get(field)) if field == "document_ids" and record.get(field) is not None
+                else record.get(field)
+                for field in FEEDBACK_FIELDS
+            )
+            for record in records
+        ]
+        # the right hand sides all see the stored row, so rating is the old rating
+        rating_changed = "excluded.rating IS NOT NULL AND excluded.rating IS NOT rating"
+        updates = ", ".join(
+            f"{field} = CASE WHEN {rating_changed} THEN excluded.{field} ELSE COALESCE(excluded.{field}, {field}) END"
+            if field in RATING_DETAIL_FIELDS
+            else f"{field} = COALESCE(excluded.{field}, {field})"
+            for field in FEEDBACK_FIELDS
+            if field != "message_id"
+        )
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                connection.executemany(
+                    f"""
+                    INSERT INTO feedback ({", ".join(FEEDBACK_FIELDS)})
+                    VALUES ({", ".join("?" for _ in FEEDBACK_FIELDS)})
+                    ON CONFLICT (message_id) DO UPDATE SET {updates}
+                    """,
+                    rows,
+                )
+
+    def get_stats(self, since=None):
+        with self._lock:
+            rows = self._get_connection().execute(
+                "SELECT rating, feedback_type, prompt_version FROM feedback WHERE created_at >= ?",
+                (since or 0,),
+            ).fetchall()
+
+        return summarize_feedback(
+            {"rating": rating, "feedback_type": feedback_type, "prompt_version": prompt_version}
+            for rating, feedback_type, prompt_version in rows
+        )
+
+
+class JSONLFeedbackStore(FeedbackStore):
+    """
+    Feedback store appending one JSON line per record, easy to ship to a log pipeline.
+
+    Parameters
+    ----------
+    path : str, optional
+        The path of the JSONL file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or FEEDBACK_STORE_PATH or DEFAULT_FEEDBACK_STORE_PATHS["jsonl"]
+        self._lock = threading.Lock()
+
+    def write_batch(self, records):
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        # one write per batch, appends of whole lines from several workers don't interleave
+        with self._lock, open(self.path, "a") as f:
+            f.write(lines)
+
+    def get_stats(self, since=None):
+        if not os.path.exists(self.path):
+            return summarize_feedback([])
+
+        with self._lock, open(self.path, "r") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+
+        messages = merge_feedback(records).values()
+        return summarize_feedback(message for message in messages if message["created_at"] >= (since or 0))
+
+
+class FeedbackSink:
+    """
+    Queue of feedback records written to a FeedbackStore in batches by a background
+    thread, so recording feedback in a callback never waits on disk I/O.
+
+    The thread is started on the first record of each process, under gunicorn the
+    master's thread isn't copied to the workers.
+
+    Parameters
+    ----------
+    store : FeedbackStore
+        Where the records are written.
+    flush_interval : float, optional
+        Seconds a record waits at most before it is written.
+    batch_size : int, optional
+        Maximum records written per batch.
+    """
+
+    def __init__(self, store, flush_interval=FEEDBACK_FLUSH_INTERVAL, batch_size=FEEDBACK_BATCH_SIZE):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(FEEDBACK_QUEUE_SIZE)
+                self._thread = threading.Thread(target=self._run, name="feedback-sink", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def record(self, **feedback):
+        """
+        Queue the feedback on a message to be written.
+
+        Parameters
+        ----------
+        **feedback
+            The FEEDBACK_FIELDS of the record, message_id is required.
+        """
+        self._ensure_started()
+
+        record = {field: feedback.get(field) for field in FEEDBACK_FIELDS}
+        record["created_at"] = record["created_at"] or time.time()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Feedback queue is full, dropped feedback on message {record['message_id']}.")
+
+    def _write(self, records):
+        try:
+            self.store.write_batch(records)
+        except Exception as e:
+            logger.error(f"Writing {len(records)} feedback records failed: {e}")
+
+    def _run(self):
+        batch_queue = self._queue
+        while True:
+            records = [batch_queue.get()]
+            # wait up to the flush interval for the rest of the batch
+            deadline = time.monotonic() + self.flush_interval
+            while len(records) < self.batch_size:
+                try:
+                    records.append(batch_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            self._write(records)
+            for _ in records:
+                batch_queue.task_done()
+
+    def flush(self):
+        """
+        Wait until every queued record was written, called at exit.
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.join()
+
+    def get_stats(self, since=None):
+        """
+        Aggregate the written feedback, see FeedbackStore.get_stats.
+        """
+        return self.store.get_stats(since=since)
+
+
+FEEDBACK_STORE_BACKENDS = {
+    "sqlite": SQLiteFeedbackStore,
+    "jsonl": JSONLFeedbackStore,
+}
+
+
+@lru_cache(maxsize=None)
+def get_feedback_sink():
+    """
+    Get the feedback sink writing to the store set by the FEEDBACK_STORE environment variable.
+
+    Returns
+    -------
+    FeedbackSink
+        The feedback sink shared by every callback of this process.
+    """
+    if FEEDBACK_STORE not in FEEDBACK_STORE_BACKENDS:
+        raise ValueError("FEEDBACK_STORE must be one of " + ", ".join(FEEDBACK_STORE_BACKENDS))
+
+    logger.info(f"Using {FEEDBACK_STORE} feedback store.")
+
+    sink = FeedbackSink(FEEDBACK_STORE_BACKENDS[FEEDBACK_STORE]())
+    atexit.register(sink.flush)
+
+    return sink
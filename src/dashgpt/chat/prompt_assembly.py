@@ -0,0 +1,204 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+
+from dashgpt.logs import get_logger
+from dashgpt.chat.prompts import generate_user_prompt
+from dashgpt.data.token_utils import (
+    get_encoding,
+    count_tokens,
+    count_tokens_cached,
+    TOKENS_PER_MESSAGE,
+    TOKENS_PER_REPLY,
+)
+
+logger = get_logger(__name__)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+# total tokens (prompt + completion) each model accepts
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+}
+
+# tokens reserved for the generated answer, passed as max_tokens to the API
+MAX_COMPLETION_TOKENS = 1024
+
+# upper limit of tokens each section of the prompt may use
+DEFAULT_SECTION_BUDGETS = {
+    "question": 256,
+    "documents": 1024,
+    "history": 512,
+}
+
+
+def truncate_to_tokens(text, max_tokens, model=DEFAULT_MODEL):
+    """
+    Truncate a string to a maximum number of tokens, cutting on a token boundary.
+
+    Parameters
+    ----------
+    text : str
+        The text to truncate.
+    max_tokens : int
+        The maximum number of tokens to keep from the start of the text.
+    model : str, optional
+        The model whose tokenizer is used. Default is "gpt-3.5-turbo".
+
+    Returns
+    -------
+    tuple of (str, int)
+        The truncated text and its number of tokens.
+    """
+    encoding = get_encoding(model)
+    tokens = encoding.encode_ordinary(text)
+
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+
+    return encoding.decode(tokens[:max_tokens]), max_tokens
+
+
+def select_within_budget(token_counts, budget):
+    """
+    Select items in order until the next one no longer fits in the token budget.
+
+    Parameters
+    ----------
+    token_counts : list of int
+        The number of tokens of each item, in order of priority.
+    budget : int
+        The number of tokens available.
+
+    Returns
+    -------
+    tuple of (int, int)
+        The number of items selected and the tokens they use.
+    """
+    used_tokens = 0
+    for i, num_tokens in enumerate(token_counts):
+        if used_tokens + num_tokens > budget:
+            return i, used_tokens
+        used_tokens += num_tokens
+
+    return len(token_counts), used_tokens
+
+
+def assemble_prompt(
+    system_prompt,
+    documents,
+    chat_history,
+    question,
+    model=DEFAULT_MODEL,
+    max_completion_tokens=MAX_COMPLETION_TOKENS,
+    section_budgets=None,
+    system_prompt_tokens=None,
+):
+    """
+    Assemble the chat completion prompt so it fits within the model context window.
+
+    Each section is tokenized once, then whole documents are dropped starting with the
+    least relevant and whole chat history messages are dropped starting with the oldest
+    until every section is within its budget and the total fits the context window.
+
+    Parameters
+    ----------
+    system_prompt : str
+        The system prompt, always included in full.
+    documents : list of Document objects
+        The retrieved documents ordered from most to least relevant.
+    chat_history : list of dict
+        The previous messages of the conversation, oldest first, each with a "role" and "content".
+    question : str
+        The users question, truncated on a token boundary if it exceeds its budget.
+    model : str, optional
+        The model the prompt is for. Default is "gpt-3.5-turbo".
+    max_completion_tokens : int, optional
+        The number of tokens reserved for the response. Default is 1024.
+    section_budgets : dict, optional
+        Overrides of the "question", "documents" and "history" token budgets.
+    system_prompt_tokens : int, optional
+        The number of tokens of the system prompt if already known, e.g. from the
+        prompt registry, otherwise it is counted.
+
+    Returns
+    -------
+    tuple of (list of dict, int)
+        The chat completion messages and the number of prompt tokens they use.
+    """
+    budgets = {**DEFAULT_SECTION_BUDGETS, **(section_budgets or {})}
+
+    # the system prompt and template wording are fixed so their counts are memoized
+    if system_prompt_tokens is None:
+        system_prompt_tokens = count_tokens_cached(system_prompt, model=model)
+    system_tokens = system_prompt_tokens
+    template_tokens = count_tokens_cached(
+        generate_user_prompt(user_prompt="?", chat_context="", chat_history="")["content"],
+        model=model,
+    )
+    message_overhead_tokens = (
+        2 * TOKENS_PER_MESSAGE
+        + TOKENS_PER_REPLY
+        + count_tokens_cached("system", model=model)
+        + count_tokens_cached("user", model=model)
+    )
+    available_tokens = (
+        CONTEXT_WINDOWS[model]
+        - max_completion_tokens
+        - system_tokens
+        - template_tokens
+        - message_overhead_tokens
+    )
+
+    question, question_tokens = truncate_to_tokens(
+        question, min(budgets["question"], max(available_tokens, 0)), model=model
+    )
+    available_tokens -= question_tokens
+
+    # documents are kept in relevance order so the least relevant are dropped first
+    document_tokens = [count_tokens(f"{doc.page_content}\n", model=model) for doc in documents]
+    num_documents, used_document_tokens = select_within_budget(
+        document_tokens, min(budgets["documents"], max(available_tokens, 0))
+    )
+    available_tokens -= used_document_tokens
+
+    # walk the history newest first so the oldest messages are the ones dropped
+    history_lines = [
+        f"{message['role']}: {message['content'].strip()}\n" for message in reversed(chat_history)
+    ]
+    history_tokens = [count_tokens(line, model=model) for line in history_lines]
+    num_history, used_history_tokens = select_within_budget(
+        history_tokens, min(budgets["history"], max(available_tokens, 0))
+    )
+
+    if num_documents < len(documents) or num_history < len(chat_history):
+        logger.info(
+            f"Prompt trimmed to fit token budget, kept {num_documents}/{len(documents)} documents "
+            f"and {num_history}/{len(chat_history)} history messages."
+        )
+
+    chat_context = "".join(f"{doc.page_content}\n" for doc in documents[:num_documents])
+    chat_history_str = "".join(reversed(history_lines[:num_history]))
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        generate_user_prompt(
+            user_prompt=question,
+            chat_context=chat_context,
+            chat_history=chat_history_str,
+        ),
+    ]
+
+    # the total is the sum of the section counts rather than re-encoding the final prompt
+    total_tokens = (
+        system_tokens
+        + template_tokens
+        + question_tokens
+        + used_document_tokens
+        + used_history_tokens
+        + message_overhead_tokens
+    )
+
+    return messages, total_tokens
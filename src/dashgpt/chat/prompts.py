@@ -2,10 +2,15 @@
 # Date: 2023-09-28
 
 import os
+import time
+import hashlib
+import threading
+from collections import namedtuple
 
 from dotenv import load_dotenv, find_dotenv
 
 from dashgpt.logs import get_logger
+from dashgpt.data.token_utils import count_tokens
 
 load_dotenv(find_dotenv())
 
@@ -13,6 +18,15 @@ logger = get_logger(__name__)
 
 SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT")
 QUESTION_AUG_PROMPT = os.getenv("QUESTION_AUG_PROMPT")
+# A/B test of system prompts, versions and weights e.g. "sys-prompt_v1:90,sys-prompt_v2:10",
+# every conversation is assigned one of them, empty uses SYSTEM_PROMPT for all
+SYSTEM_PROMPT_VARIANTS = os.getenv("SYSTEM_PROMPT_VARIANTS", "")
+# seconds between checks of the prompt files for changes, 0 checks on every request
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "5"))
+
+SYSTEM_PROMPTS_DIR = os.path.join("prompts", "system")
+
+SystemPrompt = namedtuple("SystemPrompt", ["version", "text", "tokens"])
 
 
 def generate_user_prompt(user_prompt: str, chat_context: str, chat_history: str):
@@ -63,31 +77,202 @@ def generate_user_prompt(user_prompt: str, chat_context: str, chat_history: str)
     return openai_user_prompt
 
 
-def load_system_prompt(version=None):
+def parse_prompt_variants(variants):
     """
-    Load the system prompt from a file located in the prompts/system folder.
+    Parse the SYSTEM_PROMPT_VARIANTS setting.
 
     Parameters
     ----------
-    prompt_name : str
-        The name of the system prompt to load.
+    variants : str
+        Comma separated versions, each optionally followed by ":" and its weight.
 
     Returns
     -------
-    str
-        The loaded system prompt.
+    list of tuple of (str, float)
+        The versions and their weights, empty if no variants are set.
+    """
+    parsed = []
+    for variant in variants.split(","):
+        if not variant.strip():
+            continue
+        version, _, weight = variant.partition(":")
+        weight = float(weight) if weight.strip() else 1.0
+        if weight <= 0:
+            raise ValueError(f"System prompt variant {version.strip()} must have a positive weight.")
+        parsed.append((version.strip(), weight))
+
+    return parsed
+
+
+class PromptRegistry:
     """
+    The system prompts of prompts/system, read once and kept in memory with their token counts.
+
+    Files are checked for changes with a stat of each at most every reload_interval
+    seconds and only new or modified ones are read again, so prompts can be edited
+    without restarting the workers and requests do no file I/O in between.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The folder of the prompts, one <version>.txt file each.
+    default_version : str, optional
+        The version used when no variants are set. Default is SYSTEM_PROMPT.
+    variants : list of tuple of (str, float), optional
+        The versions conversations are split between and their weights.
+    reload_interval : float, optional
+        Seconds between checks for changed files.
+    """
+
+    def __init__(
+        self,
+        directory=SYSTEM_PROMPTS_DIR,
+        default_version=SYSTEM_PROMPT,
+        variants=None,
+        reload_interval=PROMPT_RELOAD_INTERVAL,
+    ):
+        self.directory = directory
+        self.default_version = default_version
+        self.variants = variants if variants is not None else parse_prompt_variants(SYSTEM_PROMPT_VARIANTS)
+        self.reload_interval = reload_interval
+        # version -> SystemPrompt, replaced as a whole so readers never see it half updated
+        self._prompts = {}
+        self._file_stats = {}
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def _reload_changed(self):
+        prompts = dict(self._prompts)
+        file_stats = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                version, extension = os.path.splitext(entry.name)
+                if extension != ".txt" or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                file_stats[version] = (stat.st_mtime_ns, stat.st_size)
+                if self._file_stats.get(version) == file_stats[version]:
+                    continue
+
+                with open(entry.path, "r") as f:
+                    text = f.read()
+                prompts[version] = SystemPrompt(version, text, count_tokens(text))
+                logger.info(f"Loaded system prompt {version} ({prompts[version].tokens} tokens).")
+
+        for version in set(prompts) - set(file_stats):
+            logger.info(f"System prompt {version} was removed.")
+            del prompts[version]
+
+        self._prompts = prompts
+        self._file_stats = file_stats
+
+    def refresh(self, force=False):
+        """
+        Reload the prompt files that changed if reload_interval passed since the last check.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Check the files regardless of when they were last checked.
+        """
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.reload_interval:
+            return
+
+        with self._lock:
+            # another thread may have checked while this one waited for the lock
+            if force or self._last_check is None or now - self._last_check >= self.reload_interval:
+                self._reload_changed()
+                self._last_check = time.monotonic()
+
+    def versions(self):
+        self.refresh()
+        return sorted(self._prompts)
 
-    if version is None:
-        version = SYSTEM_PROMPT
+    def get(self, version=None):
+        """
+        Get a system prompt.
 
-    logger.debug(f"Loading system prompt: {version}")
+        Parameters
+        ----------
+        version : str, optional
+            The version to get. Default is default_version.
 
-    # Construct the file path using os.path.join
-    file_path = os.path.join("prompts", "system", f"{version}.txt")
+        Returns
+        -------
+        SystemPrompt
+            The version, text and number of tokens of the prompt.
+        """
+        self.refresh()
+        version = version or self.default_version
 
-    # Load the system prompt from the file
-    with open(file_path, "r") as f:
-        system_prompt = f.read()
+        try:
+            return self._prompts[version]
+        except KeyError:
+            raise ValueError(f"Unknown system prompt version: {version}") from None
 
-    return system_prompt
\ No newline at end of file
+    def assign_version(self, conversation_id):
+        """
+        Assign a conversation to one of the prompt variants.
+
+        The assignment is a hash of the conversation id so it is the same in every
+        worker and on every turn of the conversation without being stored.
+
+        Parameters
+        ----------
+        conversation_id : str
+            The id of the conversation.
+
+        Returns
+        -------
+        str
+            The version assigned, default_version if no variants are set.
+        """
+        if not self.variants or conversation_id is None:
+            return self.default_version
+
+        total_weight = sum(weight for _, weight in self.variants)
+        digest = hashlib.sha256(str(conversation_id).encode()).digest()
+        point = int.from_bytes(digest[:8], "big") / 2**64 * total_weight
+        for version, weight in self.variants:
+            point -= weight
+            if point < 0:
+                return version
+
+        return self.variants[-1][0]
+
+    def get_for_conversation(self, conversation_id):
+        """
+        Get the system prompt a conversation was assigned.
+
+        Parameters
+        ----------
+        conversation_id : str
+            The id of the conversation.
+
+        Returns
+        -------
+        SystemPrompt
+            The version, text and number of tokens of the prompt.
+        """
+        return self.get(self.assign_version(conversation_id))
+
+
+prompt_registry = PromptRegistry()
+
+
+def load_system_prompt(version=None):
+    """
+    Load a system prompt from the prompt registry, see PromptRegistry.
+
+    Parameters
+    ----------
+    version : str, optional
+        The version of the system prompt to load. Default is SYSTEM_PROMPT.
+
+    Returns
+    -------
+    str
+        The loaded system prompt.
+    """
+    return prompt_registry.get(version).text
@@ -0,0 +1,232 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from dashgpt.logs import get_logger
+from dashgpt.metrics import RESPONSE_CACHE_LOOKUPS, RESPONSE_CACHE_LATENCY_SAVED
+
+logger = get_logger(__name__)
+
+# minimum cosine similarity between two questions for them to share a cached answer
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.97"))
+# seconds a cached answer is served for before it is regenerated
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# maximum number of answers kept, least recently used are evicted first
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# characters per chunk when replaying a cached answer as a stream
+RESPONSE_CACHE_REPLAY_CHUNK_SIZE = 16
+
+
+def get_document_ids(documents):
+    """
+    Get stable ids for retrieved documents from a hash of their content.
+
+    Parameters
+    ----------
+    documents : list of dict
+        The documents as dictionaries with a "page_content" key.
+
+    Returns
+    -------
+    tuple of str
+        An id for each document, in order.
+    """
+    return tuple(
+        hashlib.sha1(doc["page_content"].encode()).hexdigest()[:16] for doc in documents
+    )
+
+
+def replay_response(response, chunk_size=RESPONSE_CACHE_REPLAY_CHUNK_SIZE):
+    """
+    Split a cached response into chunks so it can be streamed like a generated one.
+
+    Parameters
+    ----------
+    response : str
+        The cached response text.
+    chunk_size : int, optional
+        The number of characters per chunk.
+
+    Yields
+    ------
+    str
+        The next chunk of the response.
+    """
+    for i in range(0, len(response), chunk_size):
+        yield response[i : i + chunk_size]
+
+
+class SemanticResponseCache:
+    """
+    Cache of generated answers keyed on the question embedding, the retrieved
+    document ids and the system prompt version.
+
+    A lookup hits when an unexpired entry has the same document ids and prompt
+    version and its question embedding is within the similarity threshold.
+
+    Parameters
+    ----------
+    similarity_threshold : float, optional
+        The minimum cosine similarity between question embeddings for a hit.
+    ttl : float, optional
+        The number of seconds an entry is valid for.
+    max_size : int, optional
+        The maximum number of entries, least recently used are evicted first.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold=RESPONSE_CACHE_SIMILARITY,
+        ttl=RESPONSE_CACHE_TTL,
+        max_size=RESPONSE_CACHE_SIZE,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_size = max_size
+
+        # entry id -> entry, ordered from least to most recently used
+        self._entries = OrderedDict()
+        # (doc ids, prompt version) -> entry ids, only these are compared on lookup
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved_seconds = 0.0
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        bucket = self._buckets[entry["bucket"]]
+        bucket.remove(entry_id)
+        if not bucket:
+            del self._buckets[entry["bucket"]]
+
+    def lookup(self, query_embedding, doc_ids, prompt_version):
+        """
+        Find a cached answer for a semantically similar question.
+
+        Parameters
+        ----------
+        query_embedding : list of float
+            The embedding of the question.
+        doc_ids : tuple of str
+            The ids of the documents retrieved for the question.
+        prompt_version : str
+            The version of the system prompt the answer is generated with.
+
+        Returns
+        -------
+        str or None
+            The cached answer, None on a miss.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        # an all-zero embedding, e.g. hashing embeddings of a question without words, has
+        # no direction so nothing is similar to it
+        if not norm > 0:
+            with self._lock:
+                self.misses += 1
+            RESPONSE_CACHE_LOOKUPS.inc(result="miss")
+            return None
+        query /= norm
+
+        with self._lock:
+            now = time.time()
+            entry_ids = list(self._buckets.get((doc_ids, prompt_version), []))
+
+            best_id, best_similarity = None, self.similarity_threshold
+            for entry_id in entry_ids:
+                entry = self._entries[entry_id]
+                if now - entry["created_at"] > self.ttl:
+                    self._remove(entry_id)
+                    continue
+
+                similarity = float(entry["embedding"] @ query)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None:
+                self.misses += 1
+                RESPONSE_CACHE_LOOKUPS.inc(result="miss")
+                return None
+
+            entry = self._entries[best_id]
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            self.latency_saved_seconds += entry["generation_seconds"]
+            RESPONSE_CACHE_LOOKUPS.inc(result="hit")
+            RESPONSE_CACHE_LATENCY_SAVED.inc(entry["generation_seconds"])
+
+        logger.debug(f"Response cache hit with similarity {best_similarity:.3f}")
+
+        return entry["response"]
+
+    def store(self, query_embedding, doc_ids, prompt_version, response, generation_seconds):
+        """
+        Add a generated answer to the cache.
+
+        Parameters
+        ----------
+        query_embedding : list of float
+            The embedding of the question.
+        doc_ids : tuple of str
+            The ids of the documents retrieved for the question.
+        prompt_version : str
+            The version of the system prompt the answer was generated with.
+        response : str
+            The generated answer.
+        generation_seconds : float
+            How long generating the answer took, counted as saved on every hit.
+        """
+        embedding = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        # it could never be looked up, see lookup
+        if not norm > 0:
+            return
+        embedding /= norm
+        bucket = (doc_ids, prompt_version)
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+
+            self._entries[entry_id] = {
+                "embedding": embedding,
+                "bucket": bucket,
+                "response": response,
+                "generation_seconds": generation_seconds,
+                "created_at": time.time(),
+            }
+            self._buckets.setdefault(bucket, []).append(entry_id)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def get_stats(self):
+        """
+        Get the hit rate and latency saved by the cache.
+
+        Returns
+        -------
+        dict
+            The hits, misses, hit rate, seconds of generation saved and number of entries.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": self.latency_saved_seconds,
+            "size": len(self._entries),
+        }
+
+
+# shared by every request handled by this worker
+response_cache = SemanticResponseCache()
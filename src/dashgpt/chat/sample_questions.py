@@ -35,6 +35,22 @@ SAMPLE_QUESTIONS = [
 ]
 
 
+def get_all_sample_questions():
+    """
+    Lists every sample question that a sample question button can ask.
+
+    Returns
+    -------
+    list of str
+        The full text of each sample question.
+    """
+    return [
+        sample_question["question_start"] + question_end
+        for sample_question in SAMPLE_QUESTIONS
+        for question_end in sample_question["question_end"]
+    ]
+
+
 def get_random_sample_question():
     """
     Randomly picks a sample question from the list of sample questions.
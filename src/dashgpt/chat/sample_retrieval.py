@@ -0,0 +1,269 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+import os
+import json
+import base64
+import hashlib
+
+import numpy as np
+
+from dashgpt.logs import get_logger
+from dashgpt.chat.chat_utils import get_relevant_documents
+from dashgpt.chat.sample_questions import get_all_sample_questions
+from dashgpt.data.bm25_index import get_bm25_index
+from dashgpt.data.langchain_utils import (
+    convert_documents_to_dict,
+    convert_dict_to_documents,
+)
+
+logger = get_logger(__name__)
+
+SAMPLE_RETRIEVAL_PATH = os.path.join("data", "processed", "sample_question_retrieval.json")
+
+# the retrieval results of each sample question, loaded once at startup
+_sample_retrieval = {}
+
+
+def get_collection_fingerprint(vector_store):
+    """
+    Fingerprint the vector store collection so changes to it can be detected.
+
+    Parameters
+    ----------
+    vector_store : VectorStore object
+        The object connected to the VectorStore.
+
+    Returns
+    -------
+    str
+        A string that changes whenever documents are added to or removed from the collection.
+    """
+    # vector stores other than Chroma fingerprint themselves
+    if hasattr(vector_store, "get_fingerprint"):
+        return vector_store.get_fingerprint()
+
+    collection = vector_store._collection
+    fingerprint = f"{collection.name}:{collection.count()}"
+
+    # the file sizes catch most in place updates, mtimes aren't used as Chroma touches
+    # its files on every connection which would force a rebuild on each startup
+    persist_directory = vector_store._persist_directory
+    if persist_directory and os.path.isdir(persist_directory):
+        for root, _, files in sorted(os.walk(persist_directory)):
+            for file in sorted(files):
+                file_size = os.path.getsize(os.path.join(root, file))
+                fingerprint += f":{file}:{file_size}"
+
+    return fingerprint
+
+
+def compute_sample_retrieval_fingerprint(vector_store, questions, k, method):
+    """
+    Compute the fingerprint the precomputed sample retrieval artifact is valid for.
+
+    Parameters
+    ----------
+    vector_store : VectorStore object
+        The object connected to the VectorStore.
+    questions : list of str
+        The sample questions.
+    k : int
+        The number of documents retrieved per question.
+    method : str
+        The retrieval method used.
+
+    Returns
+    -------
+    str
+        The hex digest identifying the collection, embedding model, questions and
+        retrieval settings.
+    """
+    # the artifact keeps the question embeddings, which only fit the model that made them
+    model_name = getattr(vector_store.embeddings, "model_name", None)
+    collection_fingerprint = get_collection_fingerprint(vector_store)
+    if method in ("lexical", "hybrid"):
+        collection_fingerprint += ":" + get_bm25_index().get_fingerprint()
+    fingerprint = json.dumps(
+        [collection_fingerprint, model_name, sorted(questions), k, method]
+    )
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def build_sample_retrieval(vector_store, k=3, method="similarity", path=SAMPLE_RETRIEVAL_PATH):
+    """
+    Embed every sample question, retrieve its documents and save them to an artifact.
+
+    Parameters
+    ----------
+    vector_store : VectorStore object
+        The object connected to the VectorStore.
+    k : int, optional
+        The number of documents to retrieve per question. Default is 3.
+    method : str, optional
+        The retrieval method to use. Default is "similarity".
+    path : str, optional
+        Where to write the artifact.
+
+    Returns
+    -------
+    dict
+        The artifact that was written.
+    """
+    questions = get_all_sample_questions()
+
+    artifact = {
+        "fingerprint": compute_sample_retrieval_fingerprint(vector_store, questions, k, method),
+        "k": k,
+        "method": method,
+        "questions": {},
+    }
+
+    for question in questions:
+        # lexical retrieval never needs the question embedding
+        embedding = [] if method == "lexical" else vector_store.embeddings.embed_query(question)
+        relevant_docs = get_relevant_documents(
+            user_prompt=question,
+            vector_store=vector_store,
+            k=k,
+            method=method,
+        )
+        artifact["questions"][question] = {
+            # stored as base64 float32 which is a fraction of the size of a JSON list
+            "embedding": base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode(),
+            "documents": convert_documents_to_dict(relevant_docs),
+        }
+
+    # write to a temporary file first so a worker never reads a half written artifact
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(artifact, f)
+    os.replace(tmp_path, path)
+
+    logger.info(f"Precomputed retrieval for {len(questions)} sample questions to {path}")
+
+    return artifact
+
+
+def read_sample_retrieval(path, fingerprint):
+    """
+    Read the precomputed sample question retrieval if it is up to date.
+
+    Parameters
+    ----------
+    path : str
+        Where the artifact is stored.
+    fingerprint : str
+        The fingerprint of the current collection, questions and retrieval settings.
+
+    Returns
+    -------
+    dict or None
+        The artifact, None if it is missing, out of date or can't be read, e.g. it was
+        truncated or edited by hand, so that it is rebuilt.
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r") as f:
+            artifact = json.load(f)
+        if artifact["fingerprint"] != fingerprint:
+            return None
+        # the fields load_sample_retrieval reads
+        artifact["k"], artifact["method"]
+        for retrieval in artifact["questions"].values():
+            retrieval["documents"], retrieval["embedding"]
+    except (OSError, json.JSONDecodeError, KeyError, TypeError, AttributeError) as e:
+        logger.warning(f"Could not read the sample question retrieval at {path}: {e!r}")
+        return None
+
+    return artifact
+
+
+def load_sample_retrieval(vector_store, k=3, method="similarity", path=SAMPLE_RETRIEVAL_PATH):
+    """
+    Load the precomputed sample question retrieval, rebuilding it if it is out of date.
+
+    The artifact is rebuilt when the collection, the sample question list or the
+    retrieval settings have changed since it was written. Question embeddings are
+    added to the vector store's embedding cache when it has one.
+
+    Parameters
+    ----------
+    vector_store : VectorStore object
+        The object connected to the VectorStore.
+    k : int, optional
+        The number of documents to retrieve per question. Default is 3.
+    method : str, optional
+        The retrieval method to use. Default is "similarity".
+    path : str, optional
+        Where the artifact is stored.
+
+    Returns
+    -------
+    int
+        The number of sample questions that can be served from memory.
+    """
+    global _sample_retrieval
+
+    questions = get_all_sample_questions()
+
+    try:
+        fingerprint = compute_sample_retrieval_fingerprint(vector_store, questions, k, method)
+        artifact = read_sample_retrieval(path, fingerprint)
+        if artifact is None:
+            logger.info("Sample question retrieval is missing or out of date, rebuilding.")
+            artifact = build_sample_retrieval(vector_store, k=k, method=method, path=path)
+    except Exception as e:
+        # retrieval still works without the artifact, just with a network call per click
+        logger.warning(f"Could not precompute sample question retrieval: {e}")
+        _sample_retrieval = {}
+        return 0
+
+    embedding_cache = getattr(vector_store.embeddings, "prime", None)
+
+    _sample_retrieval = {}
+    for question, retrieval in artifact["questions"].items():
+        _sample_retrieval[(question, artifact["k"], artifact["method"])] = retrieval["documents"]
+
+        if embedding_cache is not None and retrieval["embedding"]:
+            embedding = np.frombuffer(base64.b64decode(retrieval["embedding"]), dtype=np.float32)
+            embedding_cache(question, embedding.tolist())
+
+    return len(_sample_retrieval)
+
+
+def get_sample_question_documents(user_prompt, k=3, method="similarity"):
+    """
+    Get the precomputed relevant documents for a sample question.
+
+    Parameters
+    ----------
+    user_prompt : str
+        The user prompt, matched exactly against the sample questions.
+    k : int, optional
+        The number of documents that were retrieved. Default is 3.
+    method : str, optional
+        The retrieval method that was used. Default is "similarity".
+
+    Returns
+    -------
+    list of Document objects or None
+        New Document objects for the sample question, None if it isn't a sample question.
+    """
+    docs_dict = _sample_retrieval.get((user_prompt, k, method))
+    if docs_dict is None:
+        return None
+
+    # return copies so callers can't modify the cached documents
+    return convert_dict_to_documents(
+        [{"page_content": doc["page_content"], "metadata": dict(doc["metadata"])} for doc in docs_dict]
+    )
+
+
+if __name__ == "__main__":
+    # build time entrypoint: python src/dashgpt/chat/sample_retrieval.py
+    from dashgpt.chat.chat_utils import connect_to_vectorstore
+
+    num_questions = load_sample_retrieval(connect_to_vectorstore())
+    logger.info(f"{num_questions} sample questions ready to serve from memory.")
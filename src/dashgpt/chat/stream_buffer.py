@@ -0,0 +1,520 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Resumable server-sent event streams of /streaming-chat.
+
+The events of an answer are produced by a background thread, or task on the ASGI
+event loop, into a bounded ring buffer keyed by a random stream id. The response only
+follows the buffer, so when a connection drops the answer keeps being generated and a
+reconnect sending the id of the last event it received in Last-Event-ID is sent the
+rest from the buffer instead of calling the OpenAI API again. A stream nobody follows
+for STREAM_RESUME_TIMEOUT seconds, or that the browser cancels, is stopped which
+closes its upstream request.
+
+Buffers are kept per process, a reconnect has to reach the same worker.
+"""
+import os
+import time
+import uuid
+import asyncio
+import threading
+import itertools
+import contextlib
+import contextvars
+from collections import deque
+
+from dashgpt.logs import get_logger
+from dashgpt.chat.upstream import CancelScope, UpstreamCancelledError, cancel_scope
+
+logger = get_logger(__name__)
+
+# events kept per stream, an answer of MAX_COMPLETION_TOKENS tokens with its context fits
+STREAM_BUFFER_EVENTS = int(os.getenv("STREAM_BUFFER_EVENTS", "2048"))
+# seconds an answer keeps being generated with no connection following it
+STREAM_RESUME_TIMEOUT = float(os.getenv("STREAM_RESUME_TIMEOUT", "15"))
+# seconds a finished stream can still be resumed
+STREAM_BUFFER_TTL = float(os.getenv("STREAM_BUFFER_TTL", "60"))
+# seconds between comments sent while waiting for events, keeps proxies from closing the connection
+STREAM_KEEPALIVE_INTERVAL = 15.0
+
+STREAM_ID_HEADER = "X-Stream-ID"
+LAST_EVENT_ID_HEADER = "Last-Event-ID"
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # tells nginx not to buffer the stream
+    "X-Accel-Buffering": "no",
+}
+KEEPALIVE_COMMENT = ": keep-alive\n\n"
+
+
+class StreamNotFound(Exception):
+    """
+    Raised when a stream to resume doesn't exist, was cancelled or has expired.
+    """
+
+
+class StreamExpired(StreamNotFound):
+    """
+    Raised when the events after the last received one were dropped from the ring buffer.
+    """
+
+
+def format_sse(event_id, data):
+    """
+    Frame an event as a server-sent event.
+
+    Parameters
+    ----------
+    event_id : str
+        The id of the event, sent back in Last-Event-ID on reconnect.
+    data : str
+        The data of the event, a single line.
+
+    Returns
+    -------
+    str
+        The event.
+    """
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+
+def parse_last_event_id(last_event_id):
+    """
+    Split a Last-Event-ID header into the stream id and the number of the event.
+
+    Parameters
+    ----------
+    last_event_id : str
+        The header value, "<stream id>:<event number>".
+
+    Returns
+    -------
+    str
+        The stream id.
+    int
+        The number of the last event received.
+
+    Raises
+    ------
+    StreamNotFound
+        If the header isn't an event id of this app.
+    """
+    stream_id, _, seq = (last_event_id or "").rpartition(":")
+    if not stream_id or not seq.isdigit():
+        raise StreamNotFound(f"Invalid Last-Event-ID {last_event_id!r}.")
+
+    return stream_id, int(seq)
+
+
+class StreamBuffer:
+    """
+    Ring buffer of the framed events of one stream, written by one producer and followed
+    by any number of connections, blocking or async.
+
+    Parameters
+    ----------
+    stream_id : str
+        The id of the stream.
+    max_events : int, optional
+        The number of most recent events kept.
+    """
+
+    def __init__(self, stream_id, max_events=STREAM_BUFFER_EVENTS):
+        self.stream_id = stream_id
+        self.finished = False
+        self.finished_at = None
+        self.cancelled = False
+        self.followers = 0
+        self.unfollowed_at = time.monotonic()
+        # what interrupts the producer, its task on the ASGI route or the upstream
+        # requests of its thread
+        self.task = None
+        self.upstream_scope = CancelScope()
+        self._events = deque(maxlen=max_events)
+        self._next_seq = 0
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    def _notify(self):
+        # called with the condition held, wakes blocking and async followers alike
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._async_waiters.clear()
+
+    def append(self, data):
+        """
+        Add an event to the stream.
+
+        Parameters
+        ----------
+        data : str
+            The data of the event, a single line.
+        """
+        with self._condition:
+            self._events.append(format_sse(f"{self.stream_id}:{self._next_seq}", data))
+            self._next_seq += 1
+            self._notify()
+
+    def finish(self):
+        """
+        Mark the stream as complete, followers end once they sent every event.
+        """
+        with self._condition:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def cancel(self):
+        """
+        Stop the stream, its producer closes it with the next event.
+        """
+        with self._condition:
+            self.cancelled = True
+            self._notify()
+
+    def interrupt(self):
+        """
+        Stop the producer now, while it waits for its next event on the upstream.
+        """
+        if self.task is not None and not self.task.done():
+            # may be called from another thread than the task's event loop
+            self.task.get_loop().call_soon_threadsafe(self.task.cancel)
+        self.upstream_scope.cancel()
+
+    def read(self, after_seq):
+        """
+        Get the events after an event.
+
+        Parameters
+        ----------
+        after_seq : int
+            The number of the last event already sent, -1 for none.
+
+        Returns
+        -------
+        list of str
+            The framed events.
+        int
+            The number of the last event returned, or after_seq if none were.
+        bool
+            Whether the stream is finished and these are its last events.
+
+        Raises
+        ------
+        StreamExpired
+            If events after after_seq were already dropped from the buffer.
+        """
+        with self._condition:
+            first_seq = self._next_seq - len(self._events)
+            if after_seq + 1 < first_seq:
+                raise StreamExpired(f"Events {after_seq + 1} to {first_seq - 1} of stream {self.stream_id} were dropped.")
+
+            events = list(itertools.islice(self._events, after_seq + 1 - first_seq, None))
+            return events, self._next_seq - 1, self.finished or self.cancelled
+
+    def _has_news(self, after_seq):
+        return self._next_seq > after_seq + 1 or self.finished or self.cancelled
+
+    def wait(self, after_seq, timeout):
+        """
+        Block until there are events after after_seq or the stream ends.
+
+        Returns
+        -------
+        bool
+            False if the timeout passed first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._has_news(after_seq), timeout)
+
+    async def async_wait(self, after_seq, timeout):
+        """
+        Async version of wait for followers on an event loop.
+        """
+        event = asyncio.Event()
+        with self._condition:
+            if self._has_news(after_seq):
+                return True
+            self._async_waiters.append((asyncio.get_running_loop(), event))
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def follow(self):
+        with self._condition:
+            self.followers += 1
+
+    def unfollow(self):
+        with self._condition:
+            self.followers -= 1
+            self.unfollowed_at = time.monotonic()
+
+    def abandoned(self, timeout=STREAM_RESUME_TIMEOUT):
+        """
+        Whether the stream was cancelled or nobody followed it for timeout seconds.
+        """
+        with self._condition:
+            return self.cancelled or (self.followers == 0 and time.monotonic() - self.unfollowed_at > timeout)
+
+
+class StreamRegistry:
+    """
+    The streams of this process by id, finished streams are dropped after ttl seconds.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds a finished stream can still be resumed.
+    """
+
+    def __init__(self, ttl=STREAM_BUFFER_TTL):
+        self.ttl = ttl
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def create(self):
+        """
+        Create a stream with a new random id, the id is all a client needs to resume it.
+
+        Returns
+        -------
+        StreamBuffer
+            The buffer of the stream.
+        """
+        buffer = StreamBuffer(uuid.uuid4().hex)
+        now = time.monotonic()
+        with self._lock:
+            for stream_id, stream in list(self._streams.items()):
+                if stream.finished and now - stream.finished_at > self.ttl:
+                    del self._streams[stream_id]
+            self._streams[buffer.stream_id] = buffer
+        return buffer
+
+    def get(self, stream_id):
+        """
+        Get a stream to resume.
+
+        Raises
+        ------
+        StreamNotFound
+            If there is no such stream or it was cancelled.
+        """
+        with self._lock:
+            buffer = self._streams.get(stream_id)
+        if buffer is None or buffer.cancelled:
+            raise StreamNotFound(f"No stream {stream_id} to resume.")
+        return buffer
+
+    def cancel(self, stream_id):
+        """
+        Cancel a stream and close its upstream request, does nothing if there is no such stream.
+        """
+        with self._lock:
+            buffer = self._streams.get(stream_id)
+        if buffer is not None:
+            buffer.cancel()
+            buffer.interrupt()
+
+
+stream_registry = StreamRegistry()
+
+
+def resume_stream(last_event_id):
+    """
+    Find the stream and the last received event a reconnect resumes from.
+
+    Parameters
+    ----------
+    last_event_id : str
+        The Last-Event-ID header of the reconnect.
+
+    Returns
+    -------
+    StreamBuffer
+        The buffer of the stream.
+    int
+        The number of the last event the client received.
+
+    Raises
+    ------
+    StreamNotFound
+        If the stream doesn't exist or was cancelled.
+    StreamExpired
+        If the events after the last received one are no longer buffered.
+    """
+    stream_id, after_seq = parse_last_event_id(last_event_id)
+    buffer = stream_registry.get(stream_id)
+    # raises here rather than once the response started
+    buffer.read(after_seq)
+
+    return buffer, after_seq
+
+
+def run_stream(buffer, events, resume_timeout=STREAM_RESUME_TIMEOUT, on_finish=None):
+    """
+    Write events into a stream buffer until they end or the stream is abandoned.
+
+    Parameters
+    ----------
+    buffer : StreamBuffer
+        The buffer of the stream.
+    events : iterator of str
+        The events, see stream_chat_events.
+    resume_timeout : float, optional
+        Seconds the events keep being produced with nobody following the stream.
+    on_finish : callable, optional
+        Called without arguments once the events are closed, however the stream ended.
+    """
+    try:
+        # closing the events when abandoned closes the upstream request behind them, a
+        # cancel while waiting on the upstream shuts its connection down through the scope
+        with contextlib.closing(events), cancel_scope(buffer.upstream_scope):
+            for data in events:
+                buffer.append(data)
+                if buffer.abandoned(resume_timeout):
+                    reason = "it was cancelled" if buffer.cancelled else "nobody follows it"
+                    logger.info(f"Stopping stream {buffer.stream_id}, {reason}.")
+                    buffer.cancel()
+                    break
+    except UpstreamCancelledError:
+        logger.info(f"Stopping stream {buffer.stream_id}, it was cancelled.")
+    except Exception:
+        logger.exception(f"Producing stream {buffer.stream_id} failed.")
+    finally:
+        if on_finish is not None:
+            on_finish()
+        buffer.finish()
+
+
+async def async_run_stream(buffer, events, resume_timeout=STREAM_RESUME_TIMEOUT):
+    """
+    Async version of run_stream for async events, run as a task on the event loop.
+    """
+    try:
+        async with contextlib.aclosing(events):
+            async for data in events:
+                buffer.append(data)
+                if buffer.abandoned(resume_timeout):
+                    reason = "it was cancelled" if buffer.cancelled else "nobody follows it"
+                    logger.info(f"Stopping stream {buffer.stream_id}, {reason}.")
+                    buffer.cancel()
+                    break
+    except asyncio.CancelledError:
+        # cancelled by StreamBuffer.interrupt or the event loop shutting down
+        logger.info(f"Stopping stream {buffer.stream_id}, it was cancelled.")
+        raise
+    except Exception:
+        logger.exception(f"Producing stream {buffer.stream_id} failed.")
+    finally:
+        buffer.finish()
+
+
+def start_stream(events, on_finish=None):
+    """
+    Produce a stream from blocking events on a background thread.
+
+    The thread runs in a copy of the current context so the events are still timed and
+    logged as part of the request.
+
+    Parameters
+    ----------
+    events : iterator of str
+        The events of the stream.
+    on_finish : callable, optional
+        Called without arguments when the stream ends, also when it ends before its first
+        event was pulled, e.g. to release what was reserved for it.
+
+    Returns
+    -------
+    StreamBuffer
+        The buffer of the new stream.
+    """
+    buffer = stream_registry.create()
+    context = contextvars.copy_context()
+    threading.Thread(
+        target=context.run,
+        args=(run_stream, buffer, events),
+        kwargs={"on_finish": on_finish},
+        name=f"stream-{buffer.stream_id}",
+        daemon=True,
+    ).start()
+    return buffer
+
+
+def async_start_stream(events, on_finish=None):
+    """
+    Produce a stream from async events as a task on the running event loop.
+
+    Parameters
+    ----------
+    events : async iterator of str
+        The events of the stream.
+    on_finish : callable, optional
+        See start_stream.
+
+    Returns
+    -------
+    StreamBuffer
+        The buffer of the new stream.
+    """
+    buffer = stream_registry.create()
+    # the loop only keeps weak references to its tasks
+    buffer.task = asyncio.get_running_loop().create_task(async_run_stream(buffer, events))
+    if on_finish is not None:
+        # done callbacks also run when the task is cancelled before it started
+        buffer.task.add_done_callback(lambda task: on_finish())
+    return buffer
+
+
+def follow_stream(buffer, after_seq=-1, keepalive_interval=STREAM_KEEPALIVE_INTERVAL):
+    """
+    Send the events of a stream to one connection, from after an event until it ends.
+
+    Parameters
+    ----------
+    buffer : StreamBuffer
+        The buffer of the stream.
+    after_seq : int, optional
+        The number of the last event the client received, -1 for a new stream.
+    keepalive_interval : float, optional
+        Seconds between keep-alive comments while there are no events.
+
+    Yields
+    ------
+    str
+        The framed events, those ready at once are sent together.
+    """
+    buffer.follow()
+    try:
+        while True:
+            events, after_seq, finished = buffer.read(after_seq)
+            if events:
+                yield "".join(events)
+            if finished:
+                return
+            if not buffer.wait(after_seq, keepalive_interval):
+                yield KEEPALIVE_COMMENT
+    finally:
+        buffer.unfollow()
+
+
+async def async_follow_stream(buffer, after_seq=-1, keepalive_interval=STREAM_KEEPALIVE_INTERVAL):
+    """
+    Async version of follow_stream for the ASGI streaming route.
+    """
+    buffer.follow()
+    try:
+        while True:
+            events, after_seq, finished = buffer.read(after_seq)
+            if events:
+                yield "".join(events)
+            if finished:
+                return
+            if not await buffer.async_wait(after_seq, keepalive_interval):
+                yield KEEPALIVE_COMMENT
+    finally:
+        buffer.unfollow()
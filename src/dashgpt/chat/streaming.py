@@ -0,0 +1,382 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+import json
+import time
+import logging
+import asyncio
+import contextlib
+
+import openai
+
+from dashgpt.logs import get_logger, truncate
+from dashgpt.metrics import time_stage
+from dashgpt.chat.prompts import prompt_registry
+from dashgpt.chat.response_cache import response_cache, get_document_ids
+from dashgpt.chat.conversation_store import get_conversation_store
+from dashgpt.chat.prompt_assembly import (
+    assemble_prompt,
+    DEFAULT_MODEL,
+    MAX_COMPLETION_TOKENS,
+)
+from dashgpt.chat.chat_utils import get_relevant_documents, RETRIEVAL_METHOD
+from dashgpt.chat.upstream import (
+    async_stream_chat_completion,
+    UpstreamUnavailableError,
+    UpstreamCancelledError,
+    UPSTREAM_ERRORS,
+)
+from dashgpt.chat.token_coalescing import coalesce_tokens, async_coalesce_tokens
+from dashgpt.chat.sample_retrieval import get_sample_question_documents
+from dashgpt.data.bm25_index import bm25_index_exists
+from dashgpt.data.langchain_utils import (
+    convert_documents_to_dict,
+    convert_dict_to_documents,
+)
+
+logger = get_logger(__name__)
+
+# shown in place of the answer when the OpenAI API fails or its circuit is open
+UPSTREAM_ERROR_MESSAGE = "Sorry, I can't answer right now, please try again in a moment."
+
+# errors of answering that end the stream with an error event rather than breaking it
+STREAM_ERRORS = (UpstreamUnavailableError, openai.error.OpenAIError) + UPSTREAM_ERRORS
+
+# errors of retrieval the routes answer with a 503 and UPSTREAM_ERROR_MESSAGE
+RETRIEVAL_ERRORS = (UpstreamUnavailableError,) + UPSTREAM_ERRORS
+
+
+def retrieve_context(user_prompt, vector_store, k=3, method=RETRIEVAL_METHOD):
+    """
+    Retrieve the documents used to answer a question in the /streaming-chat request.
+
+    Sample questions are served from the precomputed results, anything else is
+    searched for in the vector store.
+
+    Parameters
+    ----------
+    user_prompt : str
+        The question from the user.
+    vector_store : VectorStore object
+        The VectorStore to search.
+    k : int, optional
+        The number of documents to retrieve. Default is 3.
+    method : str, optional
+        The retrieval method, see dashgpt.chat.chat_utils.RETRIEVAL_METHODS. Default is
+        the RETRIEVAL_METHOD environment variable.
+
+    Returns
+    -------
+    list of dict
+        The retrieved documents as dictionaries, ready to send to the browser.
+
+    Raises
+    ------
+    RETRIEVAL_ERRORS
+        If the embeddings upstream failed and there is no BM25 index to fall back to.
+    """
+    with time_stage("retrieval"):
+        relevant_docs = get_sample_question_documents(user_prompt, k=k, method=method)
+        if relevant_docs is None:
+            try:
+                relevant_docs = get_relevant_documents(
+                    user_prompt=user_prompt,
+                    vector_store=vector_store,
+                    k=k,
+                    method=method,
+                )
+            except RETRIEVAL_ERRORS as e:
+                if method == "lexical" or not bm25_index_exists():
+                    raise
+                # the BM25 index answers without the embeddings upstream
+                logger.warning(f"{method} retrieval failed ({e!r}), falling back to lexical retrieval.")
+                relevant_docs = get_relevant_documents(
+                    user_prompt=user_prompt,
+                    vector_store=vector_store,
+                    k=k,
+                    method="lexical",
+                )
+
+    return convert_documents_to_dict(relevant_docs)
+
+
+def build_chat_completion_prompt(request_json, complete_context):
+    """
+    Build the chat completion messages from the body of a /streaming-chat request.
+
+    Parameters
+    ----------
+    request_json : dict
+        The request body containing the "prompt" and "conversation_id".
+    complete_context : list of dict
+        The documents retrieved for the prompt.
+
+    Returns
+    -------
+    list of dict
+        The chat completion messages to send to the OpenAI API.
+    int
+        The number of tokens of the messages.
+    """
+    user_prompt = request_json["prompt"]
+    context_docs = convert_dict_to_documents(complete_context)
+    chat_history = get_conversation_store().get_messages(request_json["conversation_id"])
+    system_prompt = prompt_registry.get_for_conversation(request_json["conversation_id"])
+
+    # prompt engineering/data augmentation can be performed here
+    # important thing is that this is happening on the backend, so that the users can't tamper with this
+    # JS front-end only handles the response, and nothing else
+    # keep all but the last message of the history as it is the prompt, the assembler
+    # trims whole documents and the oldest messages to stay within the token budget
+    with time_stage("prompt_assembly"):
+        chat_completion_prompt, prompt_tokens = assemble_prompt(
+            system_prompt=system_prompt.text,
+            system_prompt_tokens=system_prompt.tokens,
+            documents=context_docs,
+            chat_history=chat_history[:-1],
+            question=user_prompt,
+        )
+
+    # the prompt repeats the system prompt and documents, it's only serialized when debug
+    # logging is on and cut to the first LOG_MAX_MESSAGE_CHARS characters
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"chat Prompt {system_prompt.version} ({prompt_tokens} tokens): {truncate(json.dumps(chat_completion_prompt))}")
+
+    return chat_completion_prompt, prompt_tokens
+
+
+def get_response_cache_key(request_json, complete_context, vector_store):
+    """
+    Get the semantic response cache key of a /streaming-chat request.
+
+    Parameters
+    ----------
+    request_json : dict
+        The request body containing the "prompt" and "conversation_id".
+    complete_context : list of dict
+        The documents retrieved for the prompt.
+    vector_store : VectorStore object
+        The VectorStore whose embeddings are used for the question, the question was just
+        embedded for retrieval so this is served from the embedding cache.
+
+    Returns
+    -------
+    tuple or None
+        The question embedding, document ids and system prompt version, None if the
+        answer can't be cached.
+    """
+    chat_history = get_conversation_store().get_messages(request_json["conversation_id"])
+
+    # answers to follow up questions depend on the earlier turns so aren't reusable
+    if len(chat_history) > 1:
+        return None
+
+    # lexical retrieval doesn't embed the question, the cache lookup shouldn't either
+    if RETRIEVAL_METHOD == "lexical":
+        return None
+
+    try:
+        query_embedding = vector_store.embeddings.embed_query(request_json["prompt"])
+    except (UpstreamUnavailableError,) + UPSTREAM_ERRORS:
+        # the question couldn't be embedded for retrieval either, answer without the cache
+        return None
+
+    return (
+        query_embedding,
+        get_document_ids(complete_context),
+        prompt_registry.assign_version(request_json["conversation_id"]),
+    )
+
+
+def format_stream_event(event_type, **data):
+    """
+    Serialize one event of the /streaming-chat response as JSON, the data of a
+    server-sent event.
+
+    Parameters
+    ----------
+    event_type : str
+        "context" for the retrieved documents, "token" for a chunk of the answer,
+        "error" with the message shown instead when the answer couldn't be generated
+        and "done" once the answer is complete.
+    **data
+        The fields of the event.
+
+    Returns
+    -------
+    str
+        The event as a single line of JSON.
+    """
+    return json.dumps({"type": event_type, **data})
+
+
+def stream_chat_events(complete_context, response_stream, request_metrics=None, coalescer=None):
+    """
+    Frame a /streaming-chat response, the retrieved documents are sent first so the
+    browser can show them while the answer is generated.
+
+    Parameters
+    ----------
+    complete_context : list of dict
+        The documents retrieved for the prompt.
+    response_stream : generator of str
+        The streamed chunks of the answer, closed with this generator so its upstream
+        request stops.
+    request_metrics : RequestMetrics, optional
+        Records the time to the first token and of the whole stream.
+    coalescer : TokenCoalescer, optional
+        Groups the tokens into token events, see dashgpt.chat.token_coalescing.
+
+    Yields
+    ------
+    str
+        The framed events.
+    """
+    batches = coalesce_tokens(response_stream, coalescer)
+    try:
+        yield format_stream_event("context", documents=complete_context)
+        for chunks in batches:
+            if request_metrics is not None:
+                request_metrics.record_token(len(chunks))
+            yield format_stream_event("token", content="".join(chunks))
+    except STREAM_ERRORS as e:
+        logger.error(f"Generating the answer failed: {e!r}")
+        yield format_stream_event("error", message=UPSTREAM_ERROR_MESSAGE)
+    except (GeneratorExit, UpstreamCancelledError):
+        # closed when the client disconnects, or its upstream request shut down when cancelled
+        if request_metrics is not None:
+            request_metrics.cancel()
+        raise
+    finally:
+        # closes the upstream request down the chain of wrapping generators, the
+        # stream too in case it was never iterated
+        batches.close()
+        response_stream.close()
+    yield format_stream_event("done")
+
+    if request_metrics is not None:
+        request_metrics.finish()
+
+
+async def async_stream_chat_events(complete_context, response_stream, request_metrics=None, coalescer=None):
+    """
+    Async version of stream_chat_events for the ASGI streaming route.
+
+    Parameters
+    ----------
+    complete_context : list of dict
+        The documents retrieved for the prompt.
+    response_stream : async generator of str
+        The streamed chunks of the answer, closed with this generator so its upstream
+        request stops.
+    request_metrics : RequestMetrics, optional
+        Records the time to the first token and of the whole stream.
+    coalescer : TokenCoalescer, optional
+        Groups the tokens into token events, see dashgpt.chat.token_coalescing.
+
+    Yields
+    ------
+    str
+        The framed events.
+    """
+    batches = async_coalesce_tokens(response_stream, coalescer)
+    try:
+        yield format_stream_event("context", documents=complete_context)
+        async for chunks in batches:
+            if request_metrics is not None:
+                request_metrics.record_token(len(chunks))
+            yield format_stream_event("token", content="".join(chunks))
+    except STREAM_ERRORS as e:
+        logger.error(f"Generating the answer failed: {e!r}")
+        yield format_stream_event("error", message=UPSTREAM_ERROR_MESSAGE)
+    except (GeneratorExit, asyncio.CancelledError):
+        # the stream is cancelled or closed when the client disconnects
+        if request_metrics is not None:
+            request_metrics.cancel()
+        raise
+    finally:
+        await batches.aclose()
+        await response_stream.aclose()
+    yield format_stream_event("done")
+
+    if request_metrics is not None:
+        request_metrics.finish()
+
+
+def cache_response_stream(response_stream, cache_key):
+    """
+    Pass a response stream through, caching the full answer once it completes.
+
+    Parameters
+    ----------
+    response_stream : generator of str
+        The streamed chunks of the answer.
+    cache_key : tuple
+        The cache key from get_response_cache_key.
+
+    Yields
+    ------
+    str
+        The chunks of the answer.
+    """
+    start_time = time.perf_counter()
+    chunks = []
+    with contextlib.closing(response_stream):
+        for chunk in response_stream:
+            chunks.append(chunk)
+            yield chunk
+
+    # only reached when the stream finished, so partial answers are never cached
+    response_cache.store(*cache_key, "".join(chunks), time.perf_counter() - start_time)
+
+
+async def async_cache_response_stream(response_stream, cache_key):
+    """
+    Async version of cache_response_stream for the ASGI streaming route.
+
+    Parameters
+    ----------
+    response_stream : async generator of str
+        The streamed chunks of the answer.
+    cache_key : tuple
+        The cache key from get_response_cache_key.
+
+    Yields
+    ------
+    str
+        The chunks of the answer.
+    """
+    start_time = time.perf_counter()
+    chunks = []
+    async with contextlib.aclosing(response_stream):
+        async for chunk in response_stream:
+            chunks.append(chunk)
+            yield chunk
+
+    response_cache.store(*cache_key, "".join(chunks), time.perf_counter() - start_time)
+
+
+async def async_stream_send_messages(prompt, model=DEFAULT_MODEL, max_tokens=MAX_COMPLETION_TOKENS):
+    """
+    Send a prompt to the OpenAI API without blocking the event loop and yield the response text.
+
+    The request goes through the pooled aiohttp session, timeouts and circuit breaker of
+    dashgpt.chat.upstream.
+
+    Parameters
+    ----------
+    prompt : list of dict
+        The chat completion messages to send to the OpenAI API.
+    model : str, optional
+        The chat model to use. Default is "gpt-3.5-turbo".
+    max_tokens : int, optional
+        The maximum number of tokens to generate. Default is 1024.
+
+    Yields
+    ------
+    str
+        The content of each streamed chunk of the response.
+    """
+    response_stream = async_stream_chat_completion(prompt, model=model, max_tokens=max_tokens)
+    async with contextlib.aclosing(response_stream):
+        async for content in response_stream:
+            yield content
@@ -0,0 +1,194 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Coalescing of the streamed tokens of an answer into fewer, larger events.
+
+The OpenAI API streams a token of 3-4 characters at a time. Sent as they are, every
+token costs a JSON event, an SSE frame of about 60 bytes around it, a write to the
+connection and a markdown render in the browser. Tokens are instead buffered and sent
+together once STREAM_COALESCE_BYTES are buffered, STREAM_COALESCE_WINDOW_MS passed since
+the first of them arrived or a token ends a sentence or line. The first token of an
+answer is always sent straight away so the time to the first token doesn't change.
+
+See benchmarks/stream_coalescing_benchmark.py for the effect on CPU, bytes and renders.
+"""
+import os
+import re
+import time
+import asyncio
+import contextlib
+
+# buffered bytes that are sent at once, 0 turns coalescing off
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "64"))
+# the longest a token is held back waiting for more, in milliseconds
+STREAM_COALESCE_WINDOW = float(os.getenv("STREAM_COALESCE_WINDOW_MS", "40")) / 1000
+
+# the end of a sentence or line, optionally followed by closing markdown or whitespace
+SENTENCE_END = re.compile(r"[.!?:;\n][*_`\"')\]]*\s*$")
+
+
+class TokenCoalescer:
+    """
+    Decides when the buffered tokens of one answer are sent.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Buffered bytes that are sent at once, 0 to send every token on its own.
+    window : float, optional
+        Seconds after which the buffered tokens are sent.
+    """
+
+    def __init__(self, max_bytes=STREAM_COALESCE_BYTES, window=STREAM_COALESCE_WINDOW):
+        self.max_bytes = max_bytes
+        self.window = window
+        self._chunks = []
+        self._size = 0
+        self._started_at = None
+        self._sent_any = False
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @property
+    def pending(self):
+        return bool(self._chunks)
+
+    def add(self, chunk):
+        """
+        Buffer a token.
+
+        Parameters
+        ----------
+        chunk : str
+            The token.
+
+        Returns
+        -------
+        list of str or None
+            The buffered tokens if they should be sent now, otherwise None.
+        """
+        self._chunks.append(chunk)
+        self._size += len(chunk.encode("utf-8"))
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+
+        if (
+            not self._sent_any
+            or not self.enabled
+            or self._size >= self.max_bytes
+            or SENTENCE_END.search(chunk)
+            or self.time_left() == 0
+        ):
+            return self.flush()
+        return None
+
+    def time_left(self):
+        """
+        Get the seconds until the buffered tokens are due, None if there are none.
+        """
+        if self._started_at is None:
+            return None
+        return max(self._started_at + self.window - time.monotonic(), 0.0)
+
+    def flush(self):
+        """
+        Take the buffered tokens.
+
+        Returns
+        -------
+        list of str
+            The tokens in the order they arrived.
+        """
+        chunks = self._chunks
+        self._chunks = []
+        self._size = 0
+        self._started_at = None
+        self._sent_any = True
+        return chunks
+
+
+def coalesce_tokens(response_stream, coalescer=None):
+    """
+    Group the tokens of a response stream into the batches they are sent in.
+
+    The blocking stream can't be interrupted while waiting for the next token, so the
+    window is checked as tokens arrive. If the upstream stalls the tokens buffered in the
+    last window wait for the next token, at most a sentence fragment.
+
+    Parameters
+    ----------
+    response_stream : generator of str
+        The streamed chunks of the answer, one token each, closed with this generator.
+    coalescer : TokenCoalescer, optional
+        Decides when the tokens are sent, one per answer. Default is a TokenCoalescer
+        configured by STREAM_COALESCE_BYTES and STREAM_COALESCE_WINDOW_MS.
+
+    Yields
+    ------
+    list of str
+        The tokens sent together, never empty.
+    """
+    if coalescer is None:
+        coalescer = TokenCoalescer()
+
+    with contextlib.closing(response_stream):
+        for chunk in response_stream:
+            if chunk:
+                batch = coalescer.add(chunk)
+                if batch is not None:
+                    yield batch
+
+    if coalescer.pending:
+        yield coalescer.flush()
+
+
+async def async_coalesce_tokens(response_stream, coalescer=None):
+    """
+    Async version of coalesce_tokens for the ASGI streaming route.
+
+    The buffered tokens are sent as soon as the window passes, while the next token is
+    awaited in a task of its own.
+    """
+    if coalescer is None:
+        coalescer = TokenCoalescer()
+
+    chunks = response_stream.__aiter__()
+    next_chunk = None
+    try:
+        while True:
+            if next_chunk is None and not coalescer.pending:
+                # nothing is held back, so nothing to send while waiting
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    break
+            else:
+                if next_chunk is None:
+                    next_chunk = asyncio.ensure_future(chunks.__anext__())
+                done, _ = await asyncio.wait({next_chunk}, timeout=coalescer.time_left())
+                if not done:
+                    # the window passed, the token stays awaited for the next batch
+                    yield coalescer.flush()
+                    continue
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_chunk = None
+
+            if chunk:
+                batch = coalescer.add(chunk)
+                if batch is not None:
+                    yield batch
+
+        if coalescer.pending:
+            yield coalescer.flush()
+    finally:
+        if next_chunk is not None:
+            # closed or cancelled mid window, the upstream has to stop before it's closed
+            next_chunk.cancel()
+            await asyncio.wait({next_chunk})
+        await response_stream.aclose()
@@ -0,0 +1,595 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Shared clients of the OpenAI API with pooled connections, timeouts, retries and circuit breakers.
+
+Blocking calls share one keep-alive requests session per worker and the ASGI route one
+aiohttp session per event loop. Embedding requests are idempotent so they are retried
+with jittered backoff, chat completions are not as tokens may already be streamed.
+After CIRCUIT_BREAKER_FAILURE_THRESHOLD consecutive failures an upstream's circuit
+opens and calls fail fast with UpstreamUnavailableError for CIRCUIT_BREAKER_RESET_TIMEOUT
+seconds, then a single trial call decides whether it closes again, so a degraded upstream
+doesn't tie up every worker waiting on timeouts.
+
+A streamed chat completion closed before it finished, e.g. because the browser went
+away, closes its HTTP response so the upstream stops generating tokens nobody reads.
+A blocking stream made within a CancelScope can also be stopped from another thread
+while it waits on the upstream, by shutting down its connection.
+"""
+import os
+import time
+import socket
+import random
+import asyncio
+import threading
+import contextlib
+import contextvars
+
+import aiohttp
+import openai
+import requests
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from langchain.embeddings.base import Embeddings
+
+from dashgpt.logs import get_logger
+from dashgpt.metrics import UPSTREAM_FAILURES, CIRCUIT_BREAKER_OPENED, CANCELLED_TOKENS
+
+logger = get_logger(__name__)
+
+# maximum simultaneous upstream connections held open by one worker
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "256"))
+# seconds to establish a connection
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+# seconds from sending a request to the first byte of the response
+UPSTREAM_FIRST_BYTE_TIMEOUT = float(os.getenv("UPSTREAM_FIRST_BYTE_TIMEOUT", "20"))
+# seconds between two chunks of a streamed response
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "20"))
+# seconds a whole streamed answer may take
+UPSTREAM_TOTAL_TIMEOUT = float(os.getenv("UPSTREAM_TOTAL_TIMEOUT", "600"))
+# retries of a failed embedding request
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_RETRY_BASE_DELAY = 0.25
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_RESET_TIMEOUT", "30"))
+
+# requests' read timeout bounds the first byte and every later read alike
+REQUEST_TIMEOUT = (UPSTREAM_CONNECT_TIMEOUT, max(UPSTREAM_FIRST_BYTE_TIMEOUT, UPSTREAM_READ_TIMEOUT))
+
+# errors of a degraded upstream, invalid requests and authentication errors aren't retried
+# and don't open the circuit
+UPSTREAM_ERRORS = (
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.RateLimitError,
+    openai.error.TryAgain,
+    openai.error.APIError,
+    # raised while reading a stream, after the openai client returned the response
+    requests.exceptions.RequestException,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+)
+
+
+# collects the HTTP responses of the streamed request being made in this context, the
+# openai client leaves them open when its stream is closed before the end
+_stream_responses = contextvars.ContextVar("stream_responses", default=None)
+# the CancelScope of the blocking stream being made in this context
+_cancel_scope = contextvars.ContextVar("upstream_cancel_scope", default=None)
+
+
+class UpstreamUnavailableError(Exception):
+    """
+    Raised instead of calling an upstream whose circuit is open.
+    """
+
+
+class UpstreamCancelledError(Exception):
+    """
+    Raised by a blocking stream whose CancelScope was cancelled while it waited on the upstream.
+    """
+
+
+class CancelScope:
+    """
+    Stops the blocking upstream requests made within it from another thread.
+
+    Connections waiting for a response within the scope are tracked, cancelling shuts
+    them down so the thread blocked reading the first byte or the next chunk fails
+    straight away instead of when a token arrives. Use it with cancel_scope.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def track(self, connection):
+        with self._lock:
+            if not self.cancelled:
+                self._connections.append(connection)
+                return
+        _shutdown_connection(connection)
+
+    def release(self):
+        """
+        Stop tracking the connections, call this when the requests ended so pooled
+        connections reused by later requests aren't shut down.
+        """
+        with self._lock:
+            self._connections = []
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            _shutdown_connection(connection)
+
+
+def _shutdown_connection(connection):
+    if connection.sock is None:
+        return
+    # the plain socket's shutdown, SSLSocket's would tear down the TLS state under the reading thread
+    with contextlib.suppress(OSError):
+        socket.socket.shutdown(connection.sock, socket.SHUT_RDWR)
+
+
+@contextlib.contextmanager
+def cancel_scope(scope):
+    """
+    Make the blocking upstream streams of this context stoppable through a CancelScope.
+
+    Parameters
+    ----------
+    scope : CancelScope
+        The scope to cancel them with.
+    """
+    token = _cancel_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _cancel_scope.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one upstream, per process.
+
+    Parameters
+    ----------
+    name : str
+        The name of the upstream, e.g. "chat" or "embeddings".
+    failure_threshold : int, optional
+        Consecutive failures after which the circuit opens.
+    reset_timeout : float, optional
+        Seconds the circuit stays open before a trial call is let through.
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def before_call(self):
+        """
+        Check that a call may be made, only one trial call at a time once the circuit
+        is half open.
+
+        Raises
+        ------
+        UpstreamUnavailableError
+            If the circuit is open.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+
+        raise UpstreamUnavailableError(f"The {self.name} upstream is unavailable, its circuit is open.")
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit of the {self.name} upstream closed.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        # a call that ended without telling whether the upstream is healthy, e.g. one
+        # cancelled by the client, lets the next trial call through
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, error):
+        UPSTREAM_FAILURES.inc(upstream=self.name, error=type(error).__name__)
+        with self._lock:
+            self._failures += 1
+            # a failed trial call opens the circuit again straight away
+            if self._trial_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+                CIRCUIT_BREAKER_OPENED.inc(upstream=self.name)
+                logger.warning(
+                    f"Circuit of the {self.name} upstream opened for {self.reset_timeout:.0f}s "
+                    f"after {self._failures} consecutive failures, last: {error!r}"
+                )
+
+    def get_status(self):
+        return {"state": self.state, "consecutive_failures": self._failures}
+
+
+chat_circuit_breaker = CircuitBreaker("chat")
+embeddings_circuit_breaker = CircuitBreaker("embeddings")
+
+
+class PooledSession(requests.Session):
+    """
+    requests session shared by every thread of a worker.
+
+    The openai client closes the session of each thread every few minutes, the shared
+    session stays open so its pooled connections are kept. Streamed responses are handed
+    to stream_chat_completion so it can close them when its stream is closed early.
+    """
+
+    def close(self):
+        pass
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        responses = _stream_responses.get()
+        if responses is not None and kwargs.get("stream"):
+            responses.append(response)
+        return response
+
+
+class _TrackedConnectionMixin:
+    # registers the connection with the cancel scope of the request while it waits for the response
+    def getresponse(self, *args, **kwargs):
+        scope = _cancel_scope.get()
+        if scope is not None:
+            scope.track(self)
+        return super().getresponse(*args, **kwargs)
+
+
+class _TrackedHTTPConnection(_TrackedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TrackedHTTPSConnection(_TrackedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TrackedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class CancellableHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTP adapter whose connections can be shut down through a CancelScope.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPConnectionPool,
+            "https": _TrackedHTTPSConnectionPool,
+        }
+
+
+_requests_session = None
+_requests_session_lock = threading.Lock()
+
+
+def get_requests_session():
+    """
+    Get the requests session blocking OpenAI calls of this process share.
+
+    Returns
+    -------
+    PooledSession
+        The session, created on first use.
+    """
+    global _requests_session
+
+    with _requests_session_lock:
+        if _requests_session is None:
+            session = PooledSession()
+            # retries are made by call_with_retries where they're safe, not per connection
+            adapter = CancellableHTTPAdapter(
+                pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE, max_retries=0
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _requests_session = session
+
+    return _requests_session
+
+
+def _clear_requests_session_pool():
+    # connections opened before a fork, e.g. warming up in the gunicorn master, are shared
+    # with the parent so each worker drops them and opens its own
+    if _requests_session is not None:
+        requests.Session.close(_requests_session)
+
+
+# the openai client calls this for the session of each thread
+openai.requestssession = get_requests_session
+os.register_at_fork(after_in_child=_clear_requests_session_pool)
+
+_aiohttp_session = None
+
+
+def get_aiohttp_session():
+    """
+    Get the aiohttp session shared by all upstream requests on this worker's event loop.
+
+    The session keeps a pool of keep-alive connections to the OpenAI API so concurrent
+    streams don't each pay for a new TCP/TLS handshake.
+
+    Returns
+    -------
+    aiohttp.ClientSession
+        The shared session, created on first use.
+    """
+    global _aiohttp_session
+
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(_collect_stream_response)
+        _aiohttp_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=UPSTREAM_POOL_SIZE, keepalive_timeout=30),
+            trace_configs=[trace_config],
+        )
+
+    return _aiohttp_session
+
+
+async def _collect_stream_response(session, trace_config_ctx, params):
+    responses = _stream_responses.get()
+    if responses is not None:
+        responses.append(params.response)
+
+
+async def close_aiohttp_session():
+    """
+    Close the shared aiohttp session, call this when the event loop shuts down.
+    """
+    global _aiohttp_session
+
+    if _aiohttp_session is not None and not _aiohttp_session.closed:
+        await _aiohttp_session.close()
+    _aiohttp_session = None
+
+
+def call_with_retries(function, *args, circuit_breaker, max_retries=UPSTREAM_MAX_RETRIES, **kwargs):
+    """
+    Call an idempotent upstream function, retrying upstream errors with jittered backoff.
+
+    Parameters
+    ----------
+    function : callable
+        The function to call.
+    *args, **kwargs
+        Passed on to the function.
+    circuit_breaker : CircuitBreaker
+        The circuit breaker of the upstream, checked before every attempt.
+    max_retries : int, optional
+        The number of times to retry before giving up.
+
+    Returns
+    -------
+    object
+        What the function returns.
+
+    Raises
+    ------
+    UpstreamUnavailableError
+        If the circuit of the upstream is open.
+    """
+    for attempt in range(max_retries + 1):
+        circuit_breaker.before_call()
+        try:
+            result = function(*args, **kwargs)
+        except UPSTREAM_ERRORS as e:
+            circuit_breaker.record_failure(e)
+            if attempt == max_retries:
+                raise
+            # full jitter keeps concurrent requests from retrying in lockstep
+            delay = random.uniform(0, UPSTREAM_RETRY_BASE_DELAY * 2**attempt)
+            logger.warning(f"{circuit_breaker.name} request failed ({e!r}), retrying in {delay:.2f}s.")
+            time.sleep(delay)
+        except BaseException:
+            circuit_breaker.release()
+            raise
+        else:
+            circuit_breaker.record_success()
+            return result
+
+
+class UpstreamEmbeddings(Embeddings):
+    """
+    Embeddings of an API provider called through call_with_retries and its circuit breaker.
+
+    Parameters
+    ----------
+    embeddings : Embeddings
+        The embeddings calling the API, with its own retries turned off.
+    circuit_breaker : CircuitBreaker, optional
+        The circuit breaker of the embeddings upstream.
+    """
+
+    def __init__(self, embeddings, circuit_breaker=embeddings_circuit_breaker):
+        self.embeddings = embeddings
+        self.circuit_breaker = circuit_breaker
+
+    def embed_documents(self, texts):
+        return call_with_retries(self.embeddings.embed_documents, texts, circuit_breaker=self.circuit_breaker)
+
+    def embed_query(self, text):
+        return call_with_retries(self.embeddings.embed_query, text, circuit_breaker=self.circuit_breaker)
+
+
+def stream_chat_completion(prompt, model, max_tokens, temperature=0.5):
+    """
+    Stream a chat completion through the shared requests session.
+
+    Parameters
+    ----------
+    prompt : list of dict
+        The chat completion messages.
+    model : str
+        The chat model to use.
+    max_tokens : int
+        The maximum number of tokens to generate.
+    temperature : float, optional
+        The sampling temperature.
+
+    Yields
+    ------
+    str
+        The content of each streamed chunk of the response.
+
+    Raises
+    ------
+    UpstreamUnavailableError
+        If the circuit of the chat upstream is open.
+    UpstreamCancelledError
+        If the cancel scope of the stream was cancelled, see cancel_scope.
+    """
+    chat_circuit_breaker.before_call()
+    scope = _cancel_scope.get()
+    responded = False
+    num_chunks = 0
+    http_responses = []
+    try:
+        # set and reset before the first yield, the generator may be closed from another context
+        token = _stream_responses.set(http_responses)
+        try:
+            response = openai.ChatCompletion.create(
+                model=model,
+                messages=prompt,
+                stream=True,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                request_timeout=REQUEST_TIMEOUT,
+            )
+        finally:
+            _stream_responses.reset(token)
+        for line in response:
+            if not responded:
+                # the upstream is answering, a client closing the stream later doesn't change that
+                responded = True
+                chat_circuit_breaker.record_success()
+            num_chunks += 1
+            yield line.choices[0].delta.get("content", "")
+        if scope is not None and scope.cancelled:
+            # the connection was shut down between two chunks, the answer is cut short
+            CANCELLED_TOKENS.inc(max(max_tokens - num_chunks, 0))
+            raise UpstreamCancelledError("The stream was cancelled.")
+    except UPSTREAM_ERRORS as e:
+        if scope is not None and scope.cancelled:
+            # failed because the connection was shut down, not because of the upstream
+            CANCELLED_TOKENS.inc(max(max_tokens - num_chunks, 0))
+            raise UpstreamCancelledError("The stream was cancelled.") from e
+        chat_circuit_breaker.record_failure(e)
+        raise
+    except GeneratorExit:
+        # closed before the end, closing the connection stops the generation upstream
+        CANCELLED_TOKENS.inc(max(max_tokens - num_chunks, 0))
+        raise
+    finally:
+        if scope is not None:
+            scope.release()
+        if not responded:
+            chat_circuit_breaker.release()
+        for http_response in http_responses:
+            http_response.close()
+
+
+async def async_stream_chat_completion(prompt, model, max_tokens, temperature=0.5):
+    """
+    Async version of stream_chat_completion through the event loop's aiohttp session.
+
+    Yields
+    ------
+    str
+        The content of each streamed chunk of the response.
+    """
+    chat_circuit_breaker.before_call()
+    # openai reads the session from a context variable, set it per request so every
+    # stream on this event loop reuses the pooled connections
+    openai.aiosession.set(get_aiohttp_session())
+    responded = False
+    num_chunks = 0
+    http_responses = []
+    try:
+        # the request runs in a task of its own with a copy of this context, the list it
+        # appends its response to is shared
+        token = _stream_responses.set(http_responses)
+        try:
+            # the openai client only takes a connect and a total timeout, the first byte and
+            # the gaps between chunks are bounded here
+            response = await asyncio.wait_for(
+                openai.ChatCompletion.acreate(
+                    model=model,
+                    messages=prompt,
+                    stream=True,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    request_timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_TOTAL_TIMEOUT),
+                ),
+                timeout=UPSTREAM_FIRST_BYTE_TIMEOUT,
+            )
+        finally:
+            _stream_responses.reset(token)
+        lines = response.__aiter__()
+        while True:
+            try:
+                line = await asyncio.wait_for(lines.__anext__(), timeout=UPSTREAM_READ_TIMEOUT)
+            except StopAsyncIteration:
+                break
+            if not responded:
+                responded = True
+                chat_circuit_breaker.record_success()
+            num_chunks += 1
+            yield line.choices[0].delta.get("content", "")
+    except UPSTREAM_ERRORS as e:
+        chat_circuit_breaker.record_failure(e)
+        raise
+    except (GeneratorExit, asyncio.CancelledError):
+        # closed or cancelled when the client disconnected
+        CANCELLED_TOKENS.inc(max(max_tokens - num_chunks, 0))
+        raise
+    finally:
+        if not responded:
+            chat_circuit_breaker.release()
+        for http_response in http_responses:
+            http_response.close()
@@ -0,0 +1,186 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+import os
+import time
+import threading
+
+from dashgpt.logs import get_logger
+from dashgpt.chat.chat_utils import (
+    connect_to_vectorstore,
+    get_relevant_documents,
+    RETRIEVAL_METHOD,
+)
+from dashgpt.chat.sample_retrieval import load_sample_retrieval
+
+logger = get_logger(__name__)
+
+# question used to load the index and open the connections before the first user needs them
+WARM_UP_QUERY = "Cats"
+
+
+class VectorStoreManager:
+    """
+    Manage the lifecycle of the vector store shared by every page and route of a process.
+
+    The store is connected lazily on first use, so importing the app doesn't wait on it,
+    and is warmed up once per process instead of on every page view. With gunicorn
+    preload_app the store is loaded once in the master and the index is shared with the
+    workers copy-on-write, each worker only reopens the SQLite connections it can't
+    inherit. See gunicorn.conf.py.
+
+    Parameters
+    ----------
+    connect : callable, optional
+        Function returning a connected VectorStore object.
+    """
+
+    def __init__(self, connect=connect_to_vectorstore):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._vector_store = None
+        self._warmed_up_pid = None
+        self._warm_up_seconds = None
+        self._error = None
+        self._warm_up_thread = None
+
+        # in a forked worker another thread may have held the lock at the time of the fork
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+        # sqlite connections opened in the parent must not be used by the child,
+        # give chroma a fresh pool and keep the index it already has in memory
+        if self._vector_store is not None and hasattr(self._vector_store, "_client"):
+            from chromadb.db.impl.sqlite import SqliteDB
+            from chromadb.db.impl.sqlite_pool import PerThreadPool
+
+            sqlite_db = self._vector_store._client._system.instance(SqliteDB)
+            sqlite_db._conn_pool = PerThreadPool(sqlite_db._db_file)
+
+        # the warm up embeds a question, don't share its keep-alive connection to the OpenAI API
+        import openai.api_requestor
+
+        openai.api_requestor._thread_context.__dict__.pop("session", None)
+
+    def get(self):
+        """
+        Get the vector store, connecting to it on first use.
+
+        Returns
+        -------
+        VectorStore object
+            The VectorStore object connected to the VectorStore.
+        """
+        if self._vector_store is None:
+            with self._lock:
+                # another thread may have connected while this one waited for the lock
+                if self._vector_store is None:
+                    start_time = time.time()
+                    self._vector_store = self._connect()
+                    logger.info(
+                        f"Connected to the vector store, took {time.time() - start_time:.3f} seconds."
+                    )
+
+        return self._vector_store
+
+    def warm_up(self):
+        """
+        Load the index, the precomputed sample question results and the connections of
+        this process with a retrieval, only the first call in each process does anything.
+
+        Returns
+        -------
+        bool
+            True once the vector store is ready, False if warming up failed.
+        """
+        if self.is_ready():
+            return True
+
+        try:
+            vector_store = self.get()
+            with self._lock:
+                if self._warmed_up_pid == os.getpid():
+                    return True
+
+                start_time = time.time()
+                load_sample_retrieval(vector_store, k=3, method=RETRIEVAL_METHOD)
+                # also loads the BM25 index when the retrieval method uses it
+                get_relevant_documents(
+                    user_prompt=WARM_UP_QUERY,
+                    vector_store=vector_store,
+                    k=1,
+                    method=RETRIEVAL_METHOD,
+                )
+                self._warm_up_seconds = time.time() - start_time
+                self._warmed_up_pid = os.getpid()
+                self._error = None
+        except Exception as e:
+            self._error = repr(e)
+            logger.error(f"Warming up the vector store failed: {e}")
+            return False
+
+        logger.info(f"Vector store warmed up, took {self._warm_up_seconds:.3f} seconds.")
+
+        return True
+
+    def start_warm_up(self):
+        """
+        Warm up the vector store in a background thread so startup isn't blocked.
+
+        Returns
+        -------
+        threading.Thread
+            The thread running the warm up, an already running one is reused.
+        """
+        # threads don't survive a fork so a thread started by the parent is never alive here
+        if self._warm_up_thread is None or not self._warm_up_thread.is_alive():
+            self._warm_up_thread = threading.Thread(
+                target=self.warm_up, name="vector-store-warm-up", daemon=True
+            )
+            self._warm_up_thread.start()
+
+        return self._warm_up_thread
+
+    def is_ready(self):
+        """
+        Check if the vector store is connected and warmed up in this process.
+
+        Returns
+        -------
+        bool
+            True if retrievals won't wait on loading the vector store.
+        """
+        return self._vector_store is not None and self._warmed_up_pid == os.getpid()
+
+    def get_status(self):
+        """
+        Get the readiness of the vector store in this process for the /readyz route.
+
+        Returns
+        -------
+        dict
+            Whether it is ready, connected and the warm up time or error.
+        """
+        return {
+            "ready": self.is_ready(),
+            "connected": self._vector_store is not None,
+            "warm_up_seconds": self._warm_up_seconds if self.is_ready() else None,
+            "error": self._error,
+            "pid": os.getpid(),
+        }
+
+
+vector_store_manager = VectorStoreManager()
+
+
+def get_vector_store():
+    """
+    Get the VectorStore shared by every page and route of this process.
+
+    Returns
+    -------
+    VectorStore object
+        The VectorStore object connected to the VectorStore.
+    """
+    return vector_store_manager.get()
@@ -0,0 +1,376 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+BM25 inverted index of the documents of a collection for lexical retrieval.
+
+The postings are stored as compressed sparse rows, for each term the documents it
+appears in and their BM25 weight, precomputed at build time so a query only sums
+the weights of its terms. Build it from the Chroma collection with:
+    python src/dashgpt/data/bm25_index.py
+or when ingesting with --bm25-index.
+"""
+import os
+import re
+import json
+import hashlib
+import argparse
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from langchain.schema import Document
+
+from dashgpt.logs import get_logger
+
+logger = get_logger(__name__)
+
+BM25_INDEX_PATH = os.getenv(
+    "BM25_INDEX_PATH", os.path.join("data", "processed", "reddit_jokes_bm25_index")
+)
+# term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+POSTINGS_FILE = "postings.npz"
+DOCUMENTS_FILE = "documents.json"
+INDEX_FILE = "index.json"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    """
+    a an and are as at be but by did do does for from had has have he her his how i if in
+    into is it its me my no not of on or our say said she so that the their
+    them then there they this to was we were what when where which who why will with you your
+    """.split()
+)
+
+
+def tokenize(text):
+    """
+    Split a text into the terms of the index.
+
+    Terms are lowercase words without stopwords, with a trailing plural "s" removed so
+    "dinosaurs" matches "dinosaur".
+
+    Parameters
+    ----------
+    text : str
+        The text to tokenize.
+
+    Returns
+    -------
+    list of str
+        The terms of the text in order.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.append(token)
+
+    return terms
+
+
+class BM25Index:
+    """
+    BM25 inverted index with precomputed term weights.
+
+    Parameters
+    ----------
+    vocabulary : list of str
+        The terms, term i has the postings indptr[i]:indptr[i + 1].
+    indptr : np.ndarray
+        The offset of the postings of each term, one longer than the vocabulary.
+    doc_indices : np.ndarray
+        The document of each posting.
+    weights : np.ndarray
+        The BM25 weight of each posting.
+    documents : list of str
+        The text of each document.
+    metadatas : list of dict, optional
+        The metadata of each document.
+    ids : list of str, optional
+        The id of each document.
+    """
+
+    def __init__(self, vocabulary, indptr, doc_indices, weights, documents, metadatas=None, ids=None):
+        self.vocabulary = {term: term_id for term_id, term in enumerate(vocabulary)}
+        self._indptr = indptr
+        self._doc_indices = doc_indices
+        self._weights = weights
+        self._documents = list(documents)
+        self._metadatas = list(metadatas) if metadatas is not None else [{}] * len(self._documents)
+        self._ids = list(ids) if ids is not None else [str(i) for i in range(len(self._documents))]
+
+    @classmethod
+    def build(cls, documents, metadatas=None, ids=None, k1=BM25_K1, b=BM25_B):
+        """
+        Build the index of a list of documents.
+
+        Parameters
+        ----------
+        documents : list of str
+            The text of each document.
+        metadatas : list of dict, optional
+            The metadata of each document.
+        ids : list of str, optional
+            The id of each document.
+        k1 : float, optional
+            The BM25 term frequency saturation.
+        b : float, optional
+            The BM25 document length normalization.
+
+        Returns
+        -------
+        BM25Index
+            The index.
+        """
+        vocabulary = {}
+        term_ids, doc_indices, frequencies = [], [], []
+        lengths = np.zeros(len(documents), dtype=np.float32)
+
+        for doc_index, text in enumerate(documents):
+            terms = tokenize(text)
+            lengths[doc_index] = len(terms)
+            for term, frequency in Counter(terms).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_indices.append(doc_index)
+                frequencies.append(frequency)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_indices = np.asarray(doc_indices, dtype=np.int32)
+        frequencies = np.asarray(frequencies, dtype=np.float32)
+
+        # group the postings by term, each term's documents in order
+        order = np.lexsort((doc_indices, term_ids))
+        term_ids, doc_indices, frequencies = term_ids[order], doc_indices[order], frequencies[order]
+        document_frequencies = np.bincount(term_ids, minlength=len(vocabulary))
+        indptr = np.concatenate([[0], np.cumsum(document_frequencies)]).astype(np.int64)
+
+        num_documents = len(documents)
+        idf = np.log1p((num_documents - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        length_norm = 1 - b + b * lengths / max(float(lengths.mean()) if num_documents else 0.0, 1e-9)
+        weights = (
+            idf[term_ids] * frequencies * (k1 + 1) / (frequencies + k1 * length_norm[doc_indices])
+        ).astype(np.float32)
+
+        return cls(list(vocabulary), indptr, doc_indices, weights, documents, metadatas, ids)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved with save.
+
+        Parameters
+        ----------
+        path : str
+            The folder of the index.
+
+        Returns
+        -------
+        BM25Index
+            The loaded index.
+        """
+        with open(os.path.join(path, INDEX_FILE), "r") as f:
+            index = json.load(f)
+        with open(os.path.join(path, DOCUMENTS_FILE), "r") as f:
+            documents = json.load(f)
+        postings = np.load(os.path.join(path, POSTINGS_FILE))
+
+        logger.debug(f"Loaded the BM25 index of {index['count']} documents from {path}.")
+
+        return cls(
+            vocabulary=index["vocabulary"],
+            indptr=postings["indptr"],
+            doc_indices=postings["doc_indices"],
+            weights=postings["weights"],
+            documents=documents["documents"],
+            metadatas=documents["metadatas"],
+            ids=documents["ids"],
+        )
+
+    def save(self, path):
+        """
+        Save the index to a folder, each file is written to a temporary file first.
+
+        Parameters
+        ----------
+        path : str
+            The folder to write the index to, created if needed.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        def write(file_name, save_function):
+            temporary_path = os.path.join(path, file_name + ".tmp")
+            with open(temporary_path, "wb") as f:
+                save_function(f)
+            os.replace(temporary_path, os.path.join(path, file_name))
+
+        write(
+            POSTINGS_FILE,
+            lambda f: np.savez(
+                f, indptr=self._indptr, doc_indices=self._doc_indices, weights=self._weights
+            ),
+        )
+        write(
+            DOCUMENTS_FILE,
+            lambda f: f.write(
+                json.dumps(
+                    {"ids": self._ids, "documents": self._documents, "metadatas": self._metadatas}
+                ).encode()
+            ),
+        )
+        # written last, a folder without it isn't a complete index
+        write(
+            INDEX_FILE,
+            lambda f: f.write(
+                json.dumps({"count": len(self), "vocabulary": list(self.vocabulary)}).encode()
+            ),
+        )
+
+        logger.info(
+            f"Saved the BM25 index of {len(self)} documents and {len(self.vocabulary)} terms to {path}."
+        )
+
+    def __len__(self):
+        return len(self._documents)
+
+    def get_fingerprint(self):
+        """
+        Fingerprint the index so changes to it can be detected.
+
+        Returns
+        -------
+        str
+            A string that changes whenever the documents of the index change.
+        """
+        return f"bm25:{len(self)}:" + hashlib.sha256("\n".join(self._ids).encode()).hexdigest()
+
+    def search_with_score(self, query, k=4):
+        """
+        Find the documents with the highest BM25 score for a query.
+
+        Parameters
+        ----------
+        query : str
+            The query text.
+        k : int, optional
+            The number of documents to return.
+
+        Returns
+        -------
+        list of tuple of Document and float
+            The documents sharing terms with the query and their BM25 score, highest first.
+        """
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        if not term_ids:
+            return []
+
+        doc_indices = np.concatenate(
+            [self._doc_indices[self._indptr[term_id] : self._indptr[term_id + 1]] for term_id in term_ids]
+        )
+        weights = np.concatenate(
+            [self._weights[self._indptr[term_id] : self._indptr[term_id + 1]] for term_id in term_ids]
+        )
+
+        # only the documents containing a query term are scored
+        candidates, positions = np.unique(doc_indices, return_inverse=True)
+        scores = np.bincount(positions, weights=weights)
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return [
+            (
+                Document(
+                    page_content=self._documents[candidates[i]],
+                    metadata=dict(self._metadatas[candidates[i]] or {}),
+                ),
+                float(scores[i]),
+            )
+            for i in top
+        ]
+
+
+def build_bm25_index_from_chroma(chroma_db, path=BM25_INDEX_PATH, batch_size=5000):
+    """
+    Build the BM25 index of every document of a Chroma collection.
+
+    Parameters
+    ----------
+    chroma_db : Chroma
+        The Chroma VectorStore to index.
+    path : str, optional
+        The folder to write the index to.
+    batch_size : int, optional
+        The number of documents read from Chroma per request.
+
+    Returns
+    -------
+    BM25Index
+        The index that was written.
+    """
+    collection = chroma_db._collection
+
+    ids, documents, metadatas = [], [], []
+    for offset in range(0, collection.count(), batch_size):
+        batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        metadatas.extend(metadata or {} for metadata in batch["metadatas"])
+
+    bm25_index = BM25Index.build(documents, metadatas=metadatas, ids=ids)
+    bm25_index.save(path)
+
+    return bm25_index
+
+
+def bm25_index_exists(path=BM25_INDEX_PATH):
+    """
+    Whether the BM25 index was built, it isn't shipped with the app.
+    """
+    return os.path.exists(os.path.join(path, INDEX_FILE))
+
+
+@lru_cache(maxsize=None)
+def get_bm25_index(path=BM25_INDEX_PATH):
+    """
+    Get the BM25 index shared by this process, loaded on first use.
+
+    Parameters
+    ----------
+    path : str, optional
+        The folder of the index.
+
+    Returns
+    -------
+    BM25Index
+        The index.
+    """
+    if not bm25_index_exists(path):
+        raise FileNotFoundError(
+            f"No BM25 index at {path}, build it with python src/dashgpt/data/bm25_index.py"
+        )
+
+    return BM25Index.load(path)
+
+
+def main():
+    # imported here as chat_utils uses this module for the lexical retrieval methods
+    from dashgpt.chat.chat_utils import connect_to_chroma
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=BM25_INDEX_PATH, help="Folder to write the index to.")
+    args = parser.parse_args()
+
+    # no queries are made so the collection is opened without an embedding function
+    bm25_index = build_bm25_index_from_chroma(connect_to_chroma(embedding_function=None), path=args.output)
+
+    logger.info(f"Built the BM25 index of {len(bm25_index)} documents at {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
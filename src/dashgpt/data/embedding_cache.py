@@ -0,0 +1,247 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from dashgpt.logs import get_logger
+from dashgpt.metrics import EMBEDDING_CACHE_LOOKUPS
+
+logger = get_logger(__name__)
+
+# number of query embeddings kept in memory by each worker
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+# optional SQLite file shared by all workers on the machine, empty to disable the disk tier
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+# maximum number of rows kept in the disk tier before the oldest are pruned
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "100000"))
+
+
+def normalize_query(text):
+    """
+    Normalize a query so trivially different phrasings share a cache entry.
+
+    Parameters
+    ----------
+    text : str
+        The query text to normalize.
+
+    Returns
+    -------
+    str
+        The lower cased text with surrounding and repeated whitespace removed.
+    """
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that caches query embeddings in an in-process LRU and,
+    optionally, a SQLite file shared across gunicorn workers.
+
+    Document embeddings are passed straight through as they are only computed
+    during ingestion.
+
+    Parameters
+    ----------
+    embeddings : Embeddings
+        The embeddings to compute cache misses with, e.g. OpenAIEmbeddings.
+    model_name : str
+        The embedding model name, part of the cache key so models never share vectors.
+    max_size : int, optional
+        The maximum number of embeddings kept in memory.
+    cache_path : str, optional
+        Path of the SQLite disk tier, disabled when empty or None.
+    max_disk_size : int, optional
+        The maximum number of embeddings kept in the disk tier.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        model_name,
+        max_size=EMBEDDING_CACHE_SIZE,
+        cache_path=EMBEDDING_CACHE_PATH,
+        max_disk_size=EMBEDDING_CACHE_DISK_SIZE,
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.max_disk_size = max_disk_size
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # sqlite connections can't be shared between threads so each thread opens its own
+        self._local = threading.local()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_path:
+            self._create_disk_table()
+
+    def _get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        # a connection opened before a fork, e.g. with gunicorn preload_app, can't be used
+        # by the child so each process opens its own
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.cache_path, timeout=5)
+            # WAL lets many worker processes read while one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _create_disk_table(self):
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    model TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL DEFAULT (julianday('now')),
+                    PRIMARY KEY (model, query)
+                )
+                """
+            )
+
+    def _read_disk(self, key):
+        row = self._get_connection().execute(
+            "SELECT embedding FROM query_embeddings WHERE model = ? AND query = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def _write_disk(self, key, embedding):
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, embedding) VALUES (?, ?, ?)",
+                (*key, np.asarray(embedding, dtype=np.float32).tobytes()),
+            )
+            # prune occasionally rather than on every write to keep inserts cheap
+            if (self.misses % 100) == 0:
+                connection.execute(
+                    """
+                    DELETE FROM query_embeddings WHERE rowid IN (
+                        SELECT rowid FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_disk_size,),
+                )
+
+    def _remember(self, key, embedding):
+        with self._lock:
+            self._cache[key] = embedding
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def embed_query(self, text):
+        """
+        Embed a query, only calling the underlying embeddings on a cache miss.
+
+        Parameters
+        ----------
+        text : str
+            The query text to embed.
+
+        Returns
+        -------
+        list of float
+            The embedding of the query.
+        """
+        key = (self.model_name, normalize_query(text))
+
+        with self._lock:
+            embedding = self._cache.get(key)
+            if embedding is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                EMBEDDING_CACHE_LOOKUPS.inc(tier="memory")
+                return embedding
+
+        if self.cache_path:
+            try:
+                embedding = self._read_disk(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache read failed: {e}")
+                embedding = None
+
+            if embedding is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                EMBEDDING_CACHE_LOOKUPS.inc(tier="disk")
+                self._remember(key, embedding)
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        EMBEDDING_CACHE_LOOKUPS.inc(tier="miss")
+        embedding = self.embeddings.embed_query(text)
+        self._remember(key, embedding)
+
+        if self.cache_path:
+            try:
+                self._write_disk(key, embedding)
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache write failed: {e}")
+
+        return embedding
+
+    def prime(self, text, embedding):
+        """
+        Add a precomputed query embedding to the in-memory cache.
+
+        Parameters
+        ----------
+        text : str
+            The query text the embedding was computed for.
+        embedding : list of float
+            The embedding of the query.
+        """
+        self._remember((self.model_name, normalize_query(text)), embedding)
+
+    def embed_documents(self, texts):
+        """
+        Embed a list of documents, these are not cached.
+
+        Parameters
+        ----------
+        texts : list of str
+            The documents to embed.
+
+        Returns
+        -------
+        list of list of float
+            The embedding of each document.
+        """
+        return self.embeddings.embed_documents(texts)
+
+    def get_stats(self):
+        """
+        Get the hit and miss counts of the cache.
+
+        Returns
+        -------
+        dict
+            The memory hits, disk hits, misses, hit rate and number of cached embeddings.
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "size": len(self._cache),
+        }
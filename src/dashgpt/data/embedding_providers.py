@@ -0,0 +1,346 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Embedding providers used to embed the questions and the documents of a collection.
+
+"openai" calls the OpenAI API, "sentence-transformers" runs a small model on the CPU
+and "hashing" is a deterministic feature hashing embedder that needs no model or
+network, for tests and air-gapped environments. The provider and model a collection
+was built with are recorded in its metadata so queries are always embedded the same
+way as its documents, see get_collection_embedding_config.
+"""
+import os
+import re
+import hashlib
+import threading
+from typing import Callable
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from dashgpt.logs import get_logger
+
+logger = get_logger(__name__)
+
+# the provider of collections that don't record one, and of new collections
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+# the model of the provider, its default model when not set
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or None
+# local models share one pool per process so concurrent requests don't oversubscribe the CPU
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", os.cpu_count() or 1))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", 64))
+
+DEFAULT_EMBEDDING_MODELS = {
+    "openai": "text-embedding-ada-002",
+    "sentence-transformers": "sentence-transformers/all-MiniLM-L6-v2",
+    "hashing": "hashing-384",
+}
+
+# collection metadata keys recording how the documents were embedded
+EMBEDDING_PROVIDER_KEY = "embedding_provider"
+EMBEDDING_MODEL_KEY = "embedding_model"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+_sentence_transformers = {}
+_sentence_transformers_lock = threading.Lock()
+
+
+def get_embedding_executor():
+    """
+    Get the thread pool local embedding models run in, one per process.
+
+    Returns
+    -------
+    ThreadPoolExecutor
+        The pool of LOCAL_EMBEDDING_THREADS threads.
+    """
+    global _executor, _executor_pid
+
+    # the threads of a pool created before a fork don't exist in the child
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=LOCAL_EMBEDDING_THREADS, thread_name_prefix="local-embeddings"
+                )
+                _executor_pid = os.getpid()
+
+    return _executor
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Base class of the embeddings computed in this process.
+
+    Documents are embedded in batches of batch_size and every batch runs in the
+    process-wide embedding thread pool, so at most LOCAL_EMBEDDING_THREADS batches or
+    questions are embedded at the same time however many requests are in flight.
+    Subclasses implement _embed, returning a normalized row for each text.
+
+    Parameters
+    ----------
+    model_name : str
+        The name of the model.
+    batch_size : int, optional
+        The number of texts embedded per call to the model.
+    """
+
+    def __init__(self, model_name, batch_size=LOCAL_EMBEDDING_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+
+    def _embed(self, texts):
+        raise NotImplementedError
+
+    def embed_documents(self, texts):
+        """
+        Embed documents in batches.
+
+        Parameters
+        ----------
+        texts : list of str
+            The texts to embed.
+
+        Returns
+        -------
+        list of list of float
+            The embedding of each text.
+        """
+        texts = list(texts)
+        executor = get_embedding_executor()
+        futures = [
+            executor.submit(self._embed, texts[start : start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+
+        return [embedding for future in futures for embedding in future.result().tolist()]
+
+    def embed_query(self, text):
+        """
+        Embed a question.
+
+        Parameters
+        ----------
+        text : str
+            The question to embed.
+
+        Returns
+        -------
+        list of float
+            The embedding of the question.
+        """
+        return get_embedding_executor().submit(self._embed, [text]).result()[0].tolist()
+
+
+class HashingEmbeddings(LocalEmbeddings):
+    """
+    Deterministic embeddings hashing the words and word pairs of a text into a fixed
+    number of dimensions, with a signed hash so collisions tend to cancel out.
+
+    Only texts sharing words are similar, it is meant for tests and environments without
+    network access or a model rather than for good retrieval.
+
+    Parameters
+    ----------
+    model_name : str, optional
+        "hashing-<dimensions>", the number of dimensions is read from the name.
+    batch_size : int, optional
+        The number of texts embedded per batch.
+    """
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODELS["hashing"], batch_size=LOCAL_EMBEDDING_BATCH_SIZE):
+        super().__init__(model_name, batch_size=batch_size)
+        prefix, _, dimensions = model_name.rpartition("-")
+        if prefix != "hashing" or not dimensions.isdigit():
+            raise ValueError(f"Hashing model names look like hashing-384, got {model_name}.")
+        self.dimensions = int(dimensions)
+
+    def _embed(self, texts):
+        embeddings = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+            for feature in features:
+                # python's hash() is salted per process, embeddings must be the same everywhere
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                embeddings[row, (digest >> 1) % self.dimensions] += 1.0 if digest & 1 else -1.0
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1.0, norms)
+
+
+def load_sentence_transformer(model_name):
+    """
+    Load a sentence-transformers model once per process, every collection and thread
+    using the model shares it.
+
+    Parameters
+    ----------
+    model_name : str
+        The name or path of the model.
+
+    Returns
+    -------
+    SentenceTransformer
+        The model, on the CPU.
+    """
+    if model_name not in _sentence_transformers:
+        with _sentence_transformers_lock:
+            if model_name not in _sentence_transformers:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError:
+                    raise ImportError(
+                        "The sentence-transformers embedding provider needs the sentence-transformers "
+                        "package, install it with `pip install sentence-transformers`."
+                    )
+
+                logger.info(f"Loading the {model_name} embedding model.")
+                _sentence_transformers[model_name] = SentenceTransformer(model_name, device="cpu")
+
+    return _sentence_transformers[model_name]
+
+
+class SentenceTransformerEmbeddings(LocalEmbeddings):
+    """
+    Embeddings of a sentence-transformers model run on the CPU.
+
+    Parameters
+    ----------
+    model_name : str, optional
+        The name or path of the model.
+    batch_size : int, optional
+        The number of texts embedded per batch.
+    """
+
+    def __init__(
+        self,
+        model_name=DEFAULT_EMBEDDING_MODELS["sentence-transformers"],
+        batch_size=LOCAL_EMBEDDING_BATCH_SIZE,
+    ):
+        super().__init__(model_name, batch_size=batch_size)
+        self.model = load_sentence_transformer(model_name)
+
+    def _embed(self, texts):
+        return self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        )
+
+
+def create_openai_embeddings(model_name=DEFAULT_EMBEDDING_MODELS["openai"], **kwargs):
+    from langchain.embeddings.openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"), model=model_name, **kwargs)
+
+
+# the constructor of each provider's embeddings, taking the model name
+EMBEDDING_PROVIDERS: dict[str, Callable[..., Embeddings]] = {
+    "openai": create_openai_embeddings,
+    "sentence-transformers": SentenceTransformerEmbeddings,
+    "hashing": HashingEmbeddings,
+}
+
+
+def create_embeddings(provider=EMBEDDING_PROVIDER, model_name=None, **kwargs):
+    """
+    Create the embeddings of a provider.
+
+    Parameters
+    ----------
+    provider : str, optional
+        One of EMBEDDING_PROVIDERS.
+    model_name : str, optional
+        The model to use, the default model of the provider if not given.
+    **kwargs
+        Passed on to the embeddings of the provider.
+
+    Returns
+    -------
+    Embeddings
+        The embeddings.
+    """
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError("The embedding provider must be one of " + ", ".join(EMBEDDING_PROVIDERS))
+
+    return EMBEDDING_PROVIDERS[provider](model_name or DEFAULT_EMBEDDING_MODELS[provider], **kwargs)
+
+
+@lru_cache(maxsize=None)
+def get_embeddings(provider=EMBEDDING_PROVIDER, model_name=None):
+    """
+    Get the embeddings of a provider shared by this process.
+
+    Parameters
+    ----------
+    provider : str, optional
+        One of EMBEDDING_PROVIDERS.
+    model_name : str, optional
+        The model to use, the default model of the provider if not given.
+
+    Returns
+    -------
+    Embeddings
+        The embeddings, the same object for every call with the same arguments.
+    """
+    return create_embeddings(provider, model_name)
+
+
+def get_collection_embedding_config(collection_metadata):
+    """
+    Get the provider and model a collection was embedded with.
+
+    Parameters
+    ----------
+    collection_metadata : dict or None
+        The metadata of the collection.
+
+    Returns
+    -------
+    tuple of str
+        The provider and the model, EMBEDDING_PROVIDER and EMBEDDING_MODEL for
+        collections that don't record them.
+    """
+    collection_metadata = collection_metadata or {}
+    if EMBEDDING_PROVIDER_KEY in collection_metadata:
+        provider = collection_metadata[EMBEDDING_PROVIDER_KEY]
+        model_name = collection_metadata.get(EMBEDDING_MODEL_KEY)
+    else:
+        provider, model_name = EMBEDDING_PROVIDER, EMBEDDING_MODEL
+
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(
+            f"The collection was embedded with the unknown provider {provider}, expected one of "
+            + ", ".join(EMBEDDING_PROVIDERS)
+        )
+
+    return provider, model_name or DEFAULT_EMBEDDING_MODELS[provider]
+
+
+def make_collection_embedding_metadata(provider, model_name=None):
+    """
+    Make the collection metadata recording the provider and model of its embeddings.
+
+    Parameters
+    ----------
+    provider : str
+        One of EMBEDDING_PROVIDERS.
+    model_name : str, optional
+        The model, the default model of the provider if not given.
+
+    Returns
+    -------
+    dict
+        The metadata to add to the collection.
+    """
+    return {
+        EMBEDDING_PROVIDER_KEY: provider,
+        EMBEDDING_MODEL_KEY: model_name or DEFAULT_EMBEDDING_MODELS[provider],
+    }
@@ -0,0 +1,107 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Export the Chroma collection to a NumPy index for the "numpy" vector store backend.
+
+Run from the repository root:
+    python src/dashgpt/data/export_numpy_index.py --dtype float32
+then start the app with VECTOR_STORE_BACKEND=numpy.
+"""
+import argparse
+
+import numpy as np
+
+from dashgpt.logs import get_logger
+from dashgpt.chat.chat_utils import (
+    connect_to_chroma,
+    CHROMA_COLLECTION_NAME,
+    NUMPY_INDEX_PATH,
+)
+from dashgpt.data.numpy_vector_store import (
+    NumpyVectorStore,
+    normalize_embeddings,
+    quantize_embeddings,
+    SUPPORTED_DTYPES,
+)
+
+logger = get_logger(__name__)
+
+# documents read from Chroma per request
+EXPORT_BATCH_SIZE = 5000
+
+
+def export_chroma_to_numpy(chroma_db, path=NUMPY_INDEX_PATH, dtype="float32", batch_size=EXPORT_BATCH_SIZE):
+    """
+    Copy every document and embedding of a Chroma collection to a NumPy index.
+
+    The embeddings are copied as they are, along with the collection metadata recording
+    the embedding provider, so queries use the same embedding model as the collection.
+
+    Parameters
+    ----------
+    chroma_db : Chroma
+        The Chroma VectorStore to export.
+    path : str, optional
+        The folder to write the index to.
+    dtype : str, optional
+        Store the embeddings as "float32", "float16" or "int8". Default is "float32".
+    batch_size : int, optional
+        The number of documents read from Chroma per request.
+
+    Returns
+    -------
+    NumpyVectorStore
+        The exported index.
+    """
+    collection = chroma_db._collection
+    count = collection.count()
+
+    if count == 0:
+        raise ValueError(f"The Chroma collection {collection.name} is empty, nothing to export.")
+
+    ids, documents, metadatas, embeddings = [], [], [], []
+    for offset in range(0, count, batch_size):
+        batch = collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset
+        )
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        metadatas.extend(metadata or {} for metadata in batch["metadatas"])
+        embeddings.append(normalize_embeddings(batch["embeddings"]))
+        logger.debug(f"Read {len(ids)} of {count} documents from Chroma.")
+
+    quantized, scales = quantize_embeddings(np.concatenate(embeddings), dtype)
+
+    numpy_index = NumpyVectorStore(
+        embedding_function=chroma_db.embeddings,
+        embeddings=quantized,
+        documents=documents,
+        metadatas=metadatas,
+        ids=ids,
+        scales=scales,
+        name=collection.name,
+        path=path,
+        collection_metadata=collection.metadata,
+    )
+    numpy_index.save(path)
+
+    return numpy_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=NUMPY_INDEX_PATH, help="Folder to write the index to.")
+    parser.add_argument("--dtype", default="float32", choices=SUPPORTED_DTYPES)
+    args = parser.parse_args()
+
+    # no queries are made so the collection is opened without an embedding function
+    chroma_db = connect_to_chroma(embedding_function=None)
+    numpy_index = export_chroma_to_numpy(chroma_db, path=args.output, dtype=args.dtype)
+
+    logger.info(
+        f"Exported {len(numpy_index)} documents from {CHROMA_COLLECTION_NAME} to {args.output}."
+    )
+
+
+if __name__ == "__main__":
+    main()
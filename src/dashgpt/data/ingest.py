@@ -0,0 +1,519 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Build or update the vector store from a CSV or JSONL file.
+
+The source is streamed in chunks so it is never held in memory. Rows are identified
+by --id-column (the row number by default) and documents by a hash of their content,
+so identical texts are embedded once and later runs only embed new or changed rows.
+Progress is checkpointed after every chunk, an interrupted run picks up where it
+left off when run again.
+
+Run from the repository root, for example:
+    python src/dashgpt/data/ingest.py data/raw/reddit_jokes_sample_2000.csv \\
+        --text-column complete_joke --metadata-columns joke,punchline
+"""
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from dashgpt.logs import get_logger
+from dashgpt.chat.chat_utils import (
+    connect_to_chroma,
+    CHROMA_PERSIST_DIRECTORY,
+    CHROMA_COLLECTION_NAME,
+    NUMPY_INDEX_PATH,
+)
+from dashgpt.data.embedding_providers import (
+    create_embeddings,
+    get_collection_embedding_config,
+    make_collection_embedding_metadata,
+    EMBEDDING_PROVIDER,
+    EMBEDDING_PROVIDER_KEY,
+    EMBEDDING_MODEL,
+    EMBEDDING_PROVIDERS,
+)
+from dashgpt.data.export_numpy_index import export_chroma_to_numpy
+from dashgpt.data.bm25_index import build_bm25_index_from_chroma, BM25_INDEX_PATH
+
+logger = get_logger(__name__)
+
+# the manifest of a collection is kept next to it, see get_manifest_path
+INGEST_MANIFEST_SUFFIX = ".ingest_manifest.sqlite3"
+# rows read from the source at a time, the manifest is committed after each chunk
+INGEST_CHUNK_SIZE = 2000
+# texts per embedding request
+EMBEDDING_BATCH_SIZE = 100
+# embedding requests in flight at once
+EMBEDDING_CONCURRENCY = 4
+EMBEDDING_MAX_RETRIES = 5
+# rows looked up in the manifest per query, below SQLite's limit on query parameters
+MANIFEST_LOOKUP_SIZE = 500
+
+
+def hash_content(text):
+    """
+    Hash the content of a document, used as its id in the vector store.
+
+    Parameters
+    ----------
+    text : str
+        The text of the document.
+
+    Returns
+    -------
+    str
+        The hex digest of the text.
+    """
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def read_source(path, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Stream a CSV or JSONL file in chunks of rows.
+
+    Parameters
+    ----------
+    path : str
+        The .csv, .jsonl or .ndjson file.
+    chunk_size : int, optional
+        The number of rows per chunk.
+
+    Yields
+    ------
+    pd.DataFrame
+        The next chunk of rows, the index is the row number in the file.
+    """
+    if path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+    elif path.endswith((".jsonl", ".ndjson")):
+        with open(path, "r") as f:
+            row_number = 0
+            while True:
+                lines = [line for line in itertools.islice(f, chunk_size) if line.strip()]
+                if not lines:
+                    break
+                rows = [json.loads(line) for line in lines]
+                yield pd.DataFrame(rows, index=range(row_number, row_number + len(rows)))
+                row_number += len(rows)
+    else:
+        raise ValueError("The source must be a .csv, .jsonl or .ndjson file")
+
+
+def get_manifest_path(persist_directory, collection_name):
+    """
+    Get the path of the ingest manifest of a collection.
+
+    Each collection has its own manifest, so ingesting the same source into another
+    collection or vector store embeds all of it.
+
+    Parameters
+    ----------
+    persist_directory : str
+        The directory of the Chroma vector store.
+    collection_name : str
+        The name of the collection.
+
+    Returns
+    -------
+    str
+        The path of the SQLite database file.
+    """
+    return os.path.join(persist_directory, collection_name + INGEST_MANIFEST_SUFFIX)
+
+
+class IngestManifest:
+    """
+    Record of what has been ingested, kept in SQLite next to the vector store.
+
+    Maps each source row to the hash of its content and lists the hashes that are in
+    the vector store. It is the checkpoint a run resumes from and what later runs
+    compare against to find new or changed rows.
+
+    Parameters
+    ----------
+    path : str
+        The path of the SQLite database file, see get_manifest_path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS source_rows (
+                    source TEXT NOT NULL,
+                    row_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    PRIMARY KEY (source, row_id)
+                )
+                """
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS source_rows_hash ON source_rows (content_hash)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents (content_hash TEXT PRIMARY KEY)"
+            )
+
+    def get_row_hashes(self, source, row_ids):
+        """
+        Get the content hash recorded for each of the given rows.
+
+        Parameters
+        ----------
+        source : str
+            Identifies the source file, see ingest.
+        row_ids : list of str
+            The rows to look up.
+
+        Returns
+        -------
+        dict
+            The content hash of each row that has been ingested before.
+        """
+        row_hashes = {}
+        for start in range(0, len(row_ids), MANIFEST_LOOKUP_SIZE):
+            batch = row_ids[start : start + MANIFEST_LOOKUP_SIZE]
+            rows = self.connection.execute(
+                f"""
+                SELECT row_id, content_hash FROM source_rows
+                WHERE source = ? AND row_id IN ({",".join("?" * len(batch))})
+                """,
+                [source, *batch],
+            ).fetchall()
+            row_hashes.update(rows)
+
+        return row_hashes
+
+    def get_stored_hashes(self, content_hashes):
+        """
+        Get which of the given content hashes are already in the vector store.
+
+        Parameters
+        ----------
+        content_hashes : list of str
+            The hashes to look up.
+
+        Returns
+        -------
+        set of str
+            The hashes that are in the vector store.
+        """
+        stored = set()
+        for start in range(0, len(content_hashes), MANIFEST_LOOKUP_SIZE):
+            batch = content_hashes[start : start + MANIFEST_LOOKUP_SIZE]
+            rows = self.connection.execute(
+                f"SELECT content_hash FROM documents WHERE content_hash IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            stored.update(content_hash for (content_hash,) in rows)
+
+        return stored
+
+    def record_chunk(self, source, row_hashes, new_hashes):
+        """
+        Record the rows of a chunk once their documents are in the vector store.
+
+        Parameters
+        ----------
+        source : str
+            Identifies the source file, see ingest.
+        row_hashes : dict
+            The content hash of each new or changed row.
+        new_hashes : iterable of str
+            The hashes that were added to the vector store.
+
+        Returns
+        -------
+        list of str
+            Hashes of the old content of changed rows that no row uses anymore, these
+            should be deleted from the vector store.
+        """
+        old_hashes = set(self.get_row_hashes(source, list(row_hashes)).values())
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO documents (content_hash) VALUES (?)",
+                [(content_hash,) for content_hash in new_hashes],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO source_rows (source, row_id, content_hash) VALUES (?, ?, ?)",
+                [(source, row_id, content_hash) for row_id, content_hash in row_hashes.items()],
+            )
+
+            orphaned = [
+                content_hash
+                for content_hash in old_hashes
+                if self.connection.execute(
+                    "SELECT 1 FROM source_rows WHERE content_hash = ? LIMIT 1", (content_hash,)
+                ).fetchone()
+                is None
+            ]
+            self.connection.executemany(
+                "DELETE FROM documents WHERE content_hash = ?",
+                [(content_hash,) for content_hash in orphaned],
+            )
+
+        return orphaned
+
+
+def embed_with_retries(embedding_function, texts, max_retries=EMBEDDING_MAX_RETRIES):
+    """
+    Embed a batch of texts, retrying with exponential backoff on errors such as rate limits.
+
+    Parameters
+    ----------
+    embedding_function : Embeddings
+        The embeddings to use.
+    texts : list of str
+        The texts to embed.
+    max_retries : int, optional
+        The number of times to retry before giving up.
+
+    Returns
+    -------
+    list of list of float
+        The embedding of each text.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return embedding_function.embed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            # jitter keeps the concurrent requests from retrying in lockstep
+            delay = min(2**attempt, 60) * (0.5 + random.random())
+            logger.warning(f"Embedding {len(texts)} texts failed ({e}), retrying in {delay:.1f}s.")
+            time.sleep(delay)
+
+
+def embed_texts(embedding_function, texts, batch_size=EMBEDDING_BATCH_SIZE, concurrency=EMBEDDING_CONCURRENCY):
+    """
+    Embed texts in batches with a bounded number of requests in flight.
+
+    Parameters
+    ----------
+    embedding_function : Embeddings
+        The embeddings to use.
+    texts : list of str
+        The texts to embed.
+    batch_size : int, optional
+        The number of texts per request.
+    concurrency : int, optional
+        The maximum number of requests in flight.
+
+    Returns
+    -------
+    list of list of float
+        The embedding of each text, in order.
+    """
+    batches = [texts[start : start + batch_size] for start in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(lambda batch: embed_with_retries(embedding_function, batch), batches)
+        return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+
+def ingest(
+    source_path,
+    text_column,
+    collection,
+    embedding_function,
+    manifest,
+    id_column=None,
+    metadata_columns=(),
+    source_name=None,
+    chunk_size=INGEST_CHUNK_SIZE,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    concurrency=EMBEDDING_CONCURRENCY,
+):
+    """
+    Add the new and changed rows of a source file to a Chroma collection.
+
+    Parameters
+    ----------
+    source_path : str
+        The .csv, .jsonl or .ndjson file to ingest.
+    text_column : str
+        The column with the text to embed.
+    collection : chromadb.Collection
+        The collection to write to.
+    embedding_function : Embeddings
+        The embeddings to use.
+    manifest : IngestManifest
+        The record of what has been ingested.
+    id_column : str, optional
+        The column identifying each row, by default the row number.
+    metadata_columns : iterable of str, optional
+        Columns to store as metadata of each document.
+    source_name : str, optional
+        Identifies the source in the manifest, by default its absolute path so files of
+        the same name in different folders are told apart. Set it to keep the rows of a
+        source that was moved or renamed.
+    chunk_size : int, optional
+        The number of rows read from the source at a time.
+    batch_size : int, optional
+        The number of texts per embedding request.
+    concurrency : int, optional
+        The maximum number of embedding requests in flight.
+
+    Returns
+    -------
+    dict
+        Counts of the rows read, skipped as unchanged, embedded and deleted documents.
+    """
+    source = source_name or os.path.realpath(source_path)
+    stats = {"rows": 0, "unchanged": 0, "embedded": 0, "deleted": 0}
+    start_time = time.time()
+
+    for chunk in read_source(source_path, chunk_size=chunk_size):
+        row_ids = chunk[id_column].astype(str) if id_column else chunk.index.astype(str)
+        texts = chunk[text_column].fillna("").astype(str)
+        stats["rows"] += len(chunk)
+
+        # the rows that are new or whose content changed since the last run
+        recorded_hashes = manifest.get_row_hashes(source, list(row_ids))
+        row_hashes = {}
+        documents = {}
+        for position, (row_id, text) in enumerate(zip(row_ids, texts)):
+            if not text.strip():
+                continue
+            content_hash = hash_content(text)
+            if recorded_hashes.get(row_id) == content_hash:
+                stats["unchanged"] += 1
+                continue
+            row_hashes[row_id] = content_hash
+            # identical texts in the chunk become one document
+            if content_hash not in documents:
+                metadata = {column: str(chunk[column].iloc[position]) for column in metadata_columns}
+                documents[content_hash] = (text, {"source": os.path.basename(source), **metadata})
+
+        # documents already in the store, e.g. the same text in another row, aren't embedded again
+        stored_hashes = manifest.get_stored_hashes(list(documents))
+        new_hashes = [content_hash for content_hash in documents if content_hash not in stored_hashes]
+
+        if new_hashes:
+            embeddings = embed_texts(
+                embedding_function,
+                [documents[content_hash][0] for content_hash in new_hashes],
+                batch_size=batch_size,
+                concurrency=concurrency,
+            )
+            # upsert so a chunk that was written but not recorded before a crash is overwritten
+            collection.upsert(
+                ids=new_hashes,
+                embeddings=embeddings,
+                documents=[documents[content_hash][0] for content_hash in new_hashes],
+                metadatas=[documents[content_hash][1] for content_hash in new_hashes],
+            )
+            stats["embedded"] += len(new_hashes)
+
+        orphaned = manifest.record_chunk(source, row_hashes, new_hashes)
+        if orphaned:
+            collection.delete(ids=orphaned)
+            stats["deleted"] += len(orphaned)
+
+        elapsed = time.time() - start_time
+        logger.info(
+            f"Ingested {stats['rows']} rows, {stats['unchanged']} unchanged, "
+            f"{stats['embedded']} embedded, {stats['deleted']} deleted "
+            f"({stats['rows'] / max(elapsed, 1e-9):.0f} rows/s)."
+        )
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="The .csv, .jsonl or .ndjson file to ingest.")
+    parser.add_argument("--text-column", required=True, help="Column with the text to embed.")
+    parser.add_argument("--id-column", help="Column identifying each row, the row number by default.")
+    parser.add_argument("--metadata-columns", default="", help="Comma separated columns to keep as metadata.")
+    parser.add_argument("--persist-directory", default=CHROMA_PERSIST_DIRECTORY)
+    parser.add_argument("--collection", default=CHROMA_COLLECTION_NAME)
+    parser.add_argument(
+        "--manifest", help="The ingest manifest, <persist directory>/<collection>.ingest_manifest.sqlite3 by default."
+    )
+    parser.add_argument("--source-name", help="Identifies the source in the manifest, its absolute path by default.")
+    parser.add_argument("--embedding-provider", default=EMBEDDING_PROVIDER, choices=EMBEDDING_PROVIDERS)
+    parser.add_argument(
+        "--embedding-model", default=EMBEDDING_MODEL, help="The default model of the provider if not set."
+    )
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBEDDING_CONCURRENCY)
+    parser.add_argument(
+        "--export-numpy",
+        nargs="?",
+        const=NUMPY_INDEX_PATH,
+        help="Also export the collection to a NumPy index, optionally to the given folder.",
+    )
+    parser.add_argument(
+        "--bm25-index",
+        nargs="?",
+        const=BM25_INDEX_PATH,
+        help="Also build the BM25 index of the collection, optionally to the given folder.",
+    )
+    args = parser.parse_args()
+
+    chroma_db = connect_to_chroma(
+        None, persist_directory=args.persist_directory, collection_name=args.collection
+    )
+
+    # every document of a collection must be embedded by the same model as its queries
+    collection_metadata = chroma_db._collection.metadata or {}
+    embedding_metadata = make_collection_embedding_metadata(args.embedding_provider, args.embedding_model)
+    recorded_config = get_collection_embedding_config(collection_metadata)
+    provider, model_name = get_collection_embedding_config(embedding_metadata)
+    if chroma_db._collection.count() and recorded_config != (provider, model_name):
+        raise ValueError(
+            f"The collection {args.collection} was embedded with {' '.join(recorded_config)}, "
+            f"not {provider} {model_name}."
+        )
+    if EMBEDDING_PROVIDER_KEY not in collection_metadata:
+        chroma_db = connect_to_chroma(
+            None,
+            persist_directory=args.persist_directory,
+            collection_name=args.collection,
+            collection_metadata={**collection_metadata, **embedding_metadata},
+        )
+
+    # retries are handled per batch here
+    embedding_function = create_embeddings(
+        provider, model_name, **({"max_retries": 1} if provider == "openai" else {})
+    )
+    manifest = IngestManifest(args.manifest or get_manifest_path(args.persist_directory, args.collection))
+
+    stats = ingest(
+        args.source,
+        text_column=args.text_column,
+        collection=chroma_db._collection,
+        embedding_function=embedding_function,
+        manifest=manifest,
+        id_column=args.id_column,
+        metadata_columns=[column for column in args.metadata_columns.split(",") if column],
+        source_name=args.source_name,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    )
+    logger.info(f"Finished ingesting {args.source}: {stats}")
+
+    if args.export_numpy:
+        export_chroma_to_numpy(chroma_db, path=args.export_numpy)
+
+    if args.bm25_index:
+        build_bm25_index_from_chroma(chroma_db, path=args.bm25_index)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@
 import os
 
 from langchain.schema import Document
-import tiktoken
+
+from dashgpt.data import token_utils
 
 
 def convert_documents_to_dict(relevant_documents):
@@ -49,16 +50,19 @@ def convert_dict_to_documents(docs_dict):
 
 
 def count_tokens(text, model="gpt-3.5-turbo"):
-    # Define the tokenizer for the specific model
-    if model == "gpt-3.5-turbo":
-        tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    else:
-        raise ValueError("Unsupported model: " + model)
-
-    # Tokenize the input text
-    tokens = tokenizer.encode(text)
+    """
+    Count the number of tokens in a string using the cached tokenizer for the model.
 
-    # Count the number of tokens
-    token_count = len(tokens)
+    Parameters
+    ----------
+    text : str
+        The text to count the tokens of.
+    model : str, optional
+        The model whose tokenizer is used. Default is "gpt-3.5-turbo".
 
-    return token_count
\ No newline at end of file
+    Returns
+    -------
+    int
+        The number of tokens in the text.
+    """
+    return token_utils.count_tokens(text, model=model)
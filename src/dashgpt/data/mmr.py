@@ -0,0 +1,139 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Maximal marginal relevance re-ranking of retrieved documents.
+
+The candidates are fetched once along with their embeddings, their similarity to the
+query and to each other are computed with one matrix product each and every selection
+step only updates each candidate's similarity to the closest selected document, so
+re-ranking fetch_k candidates costs O(k * fetch_k) after the matrix products.
+"""
+import numpy as np
+from langchain.schema import Document
+
+from dashgpt.logs import get_logger
+
+logger = get_logger(__name__)
+
+
+def maximal_marginal_relevance(query_embedding, candidate_embeddings, k=4, lambda_mult=0.5):
+    """
+    Select documents that are similar to the query but not to each other.
+
+    Each step selects the candidate maximizing
+    lambda_mult * sim(query, candidate) - (1 - lambda_mult) * max sim(candidate, selected).
+
+    Parameters
+    ----------
+    query_embedding : array-like
+        The embedding of the query.
+    candidate_embeddings : array-like
+        The embeddings of the candidates, one row each.
+    k : int, optional
+        The number of candidates to select.
+    lambda_mult : float, optional
+        1 ranks by similarity to the query only, 0 by diversity only. Default is 0.5.
+
+    Returns
+    -------
+    list of int
+        The indices of the selected candidates in the order they were selected.
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+
+    # cosine similarities, the rows are normalized once rather than per comparison
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    query_similarities = candidates @ query
+    pairwise_similarities = candidates @ candidates.T
+
+    relevance = lambda_mult * query_similarities
+    # similarity of each candidate to the closest selected one
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+
+    selected = [int(np.argmax(query_similarities))]
+    for _ in range(k - 1):
+        last = selected[-1]
+        available[last] = False
+        np.maximum(redundancy, pairwise_similarities[last], out=redundancy)
+
+        scores = relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        selected.append(int(np.argmax(scores)))
+
+    return selected
+
+
+def get_candidates_with_embeddings(vector_store, embedding, fetch_k):
+    """
+    Fetch the documents most similar to an embedding along with their embeddings.
+
+    Parameters
+    ----------
+    vector_store : VectorStore object
+        A Chroma or NumPy VectorStore.
+    embedding : list of float
+        The embedding of the query.
+    fetch_k : int
+        The number of candidates to fetch.
+
+    Returns
+    -------
+    tuple of list and np.ndarray
+        The (Document, distance) pairs, most similar first, and their embeddings.
+    """
+    # the numpy index reads the rows straight from its embeddings
+    if hasattr(vector_store, "similarity_search_by_vector_with_embeddings"):
+        return vector_store.similarity_search_by_vector_with_embeddings(embedding, k=fetch_k)
+
+    # one Chroma query returns the candidates and their embeddings
+    results = vector_store._collection.query(
+        query_embeddings=[embedding],
+        n_results=fetch_k,
+        include=["documents", "metadatas", "distances", "embeddings"],
+    )
+    documents_with_distance = [
+        (Document(page_content=document, metadata=metadata or {}), distance)
+        for document, metadata, distance in zip(
+            results["documents"][0], results["metadatas"][0], results["distances"][0]
+        )
+    ]
+
+    return documents_with_distance, np.asarray(results["embeddings"][0], dtype=np.float32)
+
+
+def max_marginal_relevance_search_by_vector(vector_store, embedding, k=4, fetch_k=20, lambda_mult=0.5):
+    """
+    Re-rank the fetch_k documents most similar to an embedding by maximal marginal relevance.
+
+    Parameters
+    ----------
+    vector_store : VectorStore object
+        A Chroma or NumPy VectorStore.
+    embedding : list of float
+        The embedding of the query.
+    k : int, optional
+        The number of documents to return.
+    fetch_k : int, optional
+        The number of candidates to re-rank.
+    lambda_mult : float, optional
+        1 ranks by similarity to the query only, 0 by diversity only. Default is 0.5.
+
+    Returns
+    -------
+    list of tuple of Document and float
+        The selected documents and their distance to the query, in selection order.
+    """
+    candidates, candidate_embeddings = get_candidates_with_embeddings(vector_store, embedding, fetch_k)
+    if not candidates:
+        return []
+
+    selected = maximal_marginal_relevance(embedding, candidate_embeddings, k=k, lambda_mult=lambda_mult)
+
+    return [candidates[i] for i in selected]
@@ -0,0 +1,428 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+import os
+import json
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.vectorstore import VectorStore
+
+from dashgpt.logs import get_logger
+from dashgpt.data.mmr import max_marginal_relevance_search_by_vector
+
+logger = get_logger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+DOCUMENTS_FILE = "documents.json"
+INDEX_FILE = "index.json"
+
+# dtypes the embeddings can be stored as, int8 keeps a float32 scale per row
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+# rows converted to float32 at a time when searching float16/int8 embeddings, BLAS only
+# works on float32 and small blocks stay in the CPU cache between converting and multiplying
+SEARCH_BLOCK_SIZE = 256
+
+
+def normalize_embeddings(embeddings):
+    """
+    Scale embeddings to unit length so a dot product is their cosine similarity.
+
+    Parameters
+    ----------
+    embeddings : array-like
+        The embeddings, one per row.
+
+    Returns
+    -------
+    np.ndarray
+        The float32 unit length embeddings.
+    """
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def quantize_embeddings(embeddings, dtype="float32"):
+    """
+    Convert unit length float32 embeddings to the dtype they are stored as.
+
+    Parameters
+    ----------
+    embeddings : np.ndarray
+        The float32 embeddings, one per row.
+    dtype : str, optional
+        One of "float32", "float16" or "int8". Default is "float32".
+
+    Returns
+    -------
+    tuple of np.ndarray
+        The converted embeddings and, for int8, the scale of each row otherwise None.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError("dtype must be one of " + ", ".join(SUPPORTED_DTYPES))
+
+    if dtype == "int8":
+        # symmetric per row quantization keeps the relative error of each row the same
+        scales = np.max(np.abs(embeddings), axis=1) / 127
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        quantized = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return quantized, scales
+
+    return embeddings.astype(dtype), None
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact top-k cosine search over embeddings held in a NumPy array.
+
+    A lighter alternative to Chroma for corpora of up to a few hundred thousand
+    documents. The index is a folder with the embeddings in a .npy file, which is
+    memory-mapped so workers share the same pages of the OS page cache, and the
+    documents in a JSON file. Build one with save or dashgpt.data.export_numpy_index.
+
+    float32 is the fastest to search. int8 is a quarter of the size and close to as fast,
+    float16 is half the size but slow to convert in NumPy so is best for batched queries.
+
+    Scores are squared L2 distances between the unit length embeddings, 2 - 2 * cosine
+    similarity, so lower is more similar like Chroma's default distance.
+
+    Parameters
+    ----------
+    embedding_function : Embeddings
+        The embeddings used for the queries, the same model the documents were embedded with.
+    embeddings : np.ndarray
+        The unit length document embeddings, one per row, as float32, float16 or int8.
+    documents : list of str
+        The page content of each document.
+    metadatas : list of dict, optional
+        The metadata of each document.
+    ids : list of str, optional
+        The id of each document.
+    scales : np.ndarray, optional
+        The scale of each row for int8 embeddings.
+    name : str, optional
+        The name of the collection.
+    path : str, optional
+        The folder the index was loaded from.
+    collection_metadata : dict, optional
+        The metadata of the collection, e.g. the embedding provider it was built with.
+    """
+
+    def __init__(
+        self,
+        embedding_function,
+        embeddings,
+        documents,
+        metadatas=None,
+        ids=None,
+        scales=None,
+        name="numpy_index",
+        path=None,
+        collection_metadata=None,
+    ):
+        if embeddings.dtype == np.int8 and scales is None:
+            raise ValueError("int8 embeddings need the scale of each row")
+
+        self._embedding_function = embedding_function
+        self._embeddings = embeddings
+        self._scales = scales
+        self._documents = list(documents)
+        self._metadatas = list(metadatas) if metadatas is not None else [{}] * len(self._documents)
+        self._ids = list(ids) if ids is not None else [str(i) for i in range(len(self._documents))]
+        self.name = name
+        self.path = path
+        self.collection_metadata = dict(collection_metadata or {})
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    @classmethod
+    def load(cls, path, embedding_function, mmap=True):
+        """
+        Load an index saved with save.
+
+        Parameters
+        ----------
+        path : str
+            The folder of the index.
+        embedding_function : Embeddings
+            The embeddings used for the queries.
+        mmap : bool, optional
+            Memory-map the embeddings instead of reading them into memory. Default is True.
+
+        Returns
+        -------
+        NumpyVectorStore
+            The loaded index.
+        """
+        mmap_mode = "r" if mmap else None
+
+        with open(os.path.join(path, INDEX_FILE), "r") as f:
+            index = json.load(f)
+        with open(os.path.join(path, DOCUMENTS_FILE), "r") as f:
+            documents = json.load(f)
+
+        embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+        scales = None
+        if index["dtype"] == "int8":
+            scales = np.load(os.path.join(path, SCALES_FILE))
+
+        logger.debug(f"Loaded {index['count']} {index['dtype']} embeddings from {path}.")
+
+        return cls(
+            embedding_function=embedding_function,
+            embeddings=embeddings,
+            documents=documents["documents"],
+            metadatas=documents["metadatas"],
+            ids=documents["ids"],
+            scales=scales,
+            name=index["name"],
+            path=path,
+            collection_metadata=index.get("metadata"),
+        )
+
+    def save(self, path, dtype=None):
+        """
+        Save the index to a folder, each file is written to a temporary file first so
+        running workers never memory-map a partially written file.
+
+        Parameters
+        ----------
+        path : str
+            The folder to write the index to, created if needed.
+        dtype : str, optional
+            Convert the embeddings to "float32", "float16" or "int8", by default they are
+            kept as they are.
+        """
+        embeddings, scales = self._embeddings, self._scales
+        if dtype is not None and dtype != str(embeddings.dtype):
+            embeddings, scales = quantize_embeddings(self._get_rows(np.arange(len(self))), dtype)
+
+        os.makedirs(path, exist_ok=True)
+
+        def write(file_name, save_function):
+            temporary_path = os.path.join(path, file_name + ".tmp")
+            with open(temporary_path, "wb") as f:
+                save_function(f)
+            os.replace(temporary_path, os.path.join(path, file_name))
+
+        write(EMBEDDINGS_FILE, lambda f: np.save(f, embeddings))
+        if scales is not None:
+            write(SCALES_FILE, lambda f: np.save(f, scales))
+        write(
+            DOCUMENTS_FILE,
+            lambda f: f.write(
+                json.dumps(
+                    {"ids": self._ids, "documents": self._documents, "metadatas": self._metadatas}
+                ).encode()
+            ),
+        )
+        # written last, a folder without it isn't a complete index
+        write(
+            INDEX_FILE,
+            lambda f: f.write(
+                json.dumps(
+                    {
+                        "name": self.name,
+                        "count": len(self),
+                        "dimensions": int(embeddings.shape[1]),
+                        "dtype": str(embeddings.dtype),
+                        "metadata": self.collection_metadata,
+                    }
+                ).encode()
+            ),
+        )
+
+        logger.info(f"Saved {len(self)} {embeddings.dtype} embeddings to {path}.")
+
+    def __len__(self):
+        return len(self._documents)
+
+    def get_fingerprint(self):
+        """
+        Fingerprint the index so changes to it can be detected.
+
+        Returns
+        -------
+        str
+            A string that changes whenever documents are added, removed or re-embedded.
+        """
+        fingerprint = f"{self.name}:{len(self)}:{self._embeddings.dtype}"
+        if self.path is not None:
+            for file in sorted(os.listdir(self.path)):
+                fingerprint += f":{file}:{os.path.getsize(os.path.join(self.path, file))}"
+
+        return fingerprint
+
+    def _get_rows(self, indices):
+        # the float32 unit length embeddings of the given rows
+        rows = np.asarray(self._embeddings[indices], dtype=np.float32)
+        if self._scales is not None:
+            rows *= self._scales[indices][:, None]
+        return rows
+
+    def _similarities(self, queries):
+        # cosine similarity of every document to every query, shape (documents, queries)
+        if self._embeddings.dtype == np.float32:
+            return np.asarray(self._embeddings @ queries.T)
+
+        similarities = np.empty((len(self), len(queries)), dtype=np.float32)
+        block = np.empty((SEARCH_BLOCK_SIZE, self._embeddings.shape[1]), dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_SIZE):
+            end = min(start + SEARCH_BLOCK_SIZE, len(self))
+            rows = block[: end - start]
+            np.copyto(rows, self._embeddings[start:end], casting="unsafe")
+            np.matmul(rows, queries.T, out=similarities[start:end])
+
+        # the int8 scale of each row factors out of the dot product
+        if self._scales is not None:
+            similarities *= self._scales[:, None]
+
+        return similarities
+
+    def _make_document(self, index, distance=None):
+        # metadata is copied as callers add the score to it
+        document = Document(
+            page_content=self._documents[index], metadata=dict(self._metadatas[index] or {})
+        )
+        return document, distance
+
+    def _top_k(self, similarities, k):
+        # argpartition finds the k best in linear time, only those k are sorted
+        k = min(k, len(similarities))
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+
+        top_k = np.argpartition(-similarities, k - 1)[:k]
+        return top_k[np.argsort(-similarities[top_k], kind="stable")]
+
+    def batch_similarity_search_by_vector_with_score(self, embeddings, k=4):
+        """
+        Find the k most similar documents to each of many query embeddings at once.
+
+        Parameters
+        ----------
+        embeddings : array-like
+            The query embeddings, one per row.
+        k : int, optional
+            The number of documents to return per query. Default is 4.
+
+        Returns
+        -------
+        list of list of tuple
+            The (Document, distance) pairs of each query, most similar first.
+        """
+        queries = normalize_embeddings(embeddings)
+        similarities = self._similarities(queries)
+
+        results = []
+        for column in range(similarities.shape[1]):
+            query_similarities = similarities[:, column]
+            results.append(
+                [
+                    self._make_document(i, max(0.0, float(2 - 2 * query_similarities[i])))
+                    for i in self._top_k(query_similarities, k)
+                ]
+            )
+
+        return results
+
+    def batch_similarity_search_with_score(self, queries, k=4):
+        """
+        Find the k most similar documents to each of many queries at once.
+
+        Parameters
+        ----------
+        queries : list of str
+            The queries.
+        k : int, optional
+            The number of documents to return per query. Default is 4.
+
+        Returns
+        -------
+        list of list of tuple
+            The (Document, distance) pairs of each query, most similar first.
+        """
+        # embedded one by one so repeated questions are served from the embedding cache
+        embeddings = [self._embedding_function.embed_query(query) for query in queries]
+        return self.batch_similarity_search_by_vector_with_score(embeddings, k=k)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, **kwargs):
+        return self.batch_similarity_search_by_vector_with_score([embedding], k=k)[0]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k=k)]
+
+    def similarity_search_by_vector_with_embeddings(self, embedding, k=4):
+        """
+        Find the k most similar documents to a query embedding along with their embeddings,
+        the candidates of maximal marginal relevance re-ranking.
+
+        Parameters
+        ----------
+        embedding : list of float
+            The query embedding.
+        k : int, optional
+            The number of documents to return. Default is 4.
+
+        Returns
+        -------
+        tuple of list and np.ndarray
+            The (Document, distance) pairs, most similar first, and their unit length
+            float32 embeddings.
+        """
+        query_similarities = self._similarities(normalize_embeddings(embedding))[:, 0]
+        top_k = self._top_k(query_similarities, k)
+
+        return (
+            [self._make_document(i, max(0.0, float(2 - 2 * query_similarities[i]))) for i in top_k],
+            self._get_rows(top_k),
+        )
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        embedding = self._embedding_function.embed_query(query)
+        return [
+            document
+            for document, _ in max_marginal_relevance_search_by_vector(
+                self, embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+            )
+        ]
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        new_embeddings = normalize_embeddings(self._embedding_function.embed_documents(texts))
+        new_ids = list(ids) if ids is not None else [str(len(self) + i) for i in range(len(texts))]
+
+        # a memory-mapped index is read only, adding texts loads it into memory
+        embeddings, scales = quantize_embeddings(new_embeddings, str(self._embeddings.dtype))
+        self._embeddings = np.concatenate([self._embeddings, embeddings])
+        if scales is not None:
+            self._scales = np.concatenate([self._scales, scales])
+
+        self._documents.extend(texts)
+        self._metadatas.extend(metadatas if metadatas is not None else [{}] * len(texts))
+        self._ids.extend(new_ids)
+
+        return new_ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, dtype="float32", **kwargs):
+        texts = list(texts)
+        embeddings, scales = quantize_embeddings(
+            normalize_embeddings(embedding.embed_documents(texts)), dtype
+        )
+        return cls(
+            embedding_function=embedding,
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=metadatas,
+            ids=ids,
+            scales=scales,
+            **kwargs,
+        )
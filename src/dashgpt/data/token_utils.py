@@ -0,0 +1,121 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+from functools import lru_cache
+
+import tiktoken
+
+# models supported for token accounting, mapped to the tiktoken encoding they use
+MODEL_ENCODINGS = {
+    "gpt-3.5-turbo": "cl100k_base",
+    "gpt-3.5-turbo-16k": "cl100k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-4-32k": "cl100k_base",
+    "text-embedding-ada-002": "cl100k_base",
+}
+
+# the chat API bills a few extra tokens per message for the role/formatting wrapper,
+# plus one extra if a name is supplied and a few to prime the assistant reply
+# see: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model="gpt-3.5-turbo"):
+    """
+    Get the tiktoken encoding for a model, loading it only once per process.
+
+    Parameters
+    ----------
+    model : str, optional
+        The name of the model to get the encoding for. Default is "gpt-3.5-turbo".
+
+    Returns
+    -------
+    tiktoken.Encoding
+        The encoding used by the model.
+    """
+    if model not in MODEL_ENCODINGS:
+        raise ValueError("Unsupported model: " + model)
+
+    return tiktoken.get_encoding(MODEL_ENCODINGS[model])
+
+
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """
+    Count the number of tokens in a string.
+
+    Parameters
+    ----------
+    text : str
+        The text to count the tokens of.
+    model : str, optional
+        The model whose tokenizer is used. Default is "gpt-3.5-turbo".
+
+    Returns
+    -------
+    int
+        The number of tokens in the text.
+    """
+    # special tokens are treated as plain text so user input can't trip the tokenizer
+    return len(get_encoding(model).encode_ordinary(text))
+
+
+@lru_cache(maxsize=256)
+def count_tokens_cached(text, model="gpt-3.5-turbo"):
+    """
+    Count the number of tokens in a string, memoizing the result.
+
+    Only use this for strings that are reused across requests such as the system
+    prompt, otherwise the cache fills with one-off user text.
+
+    Parameters
+    ----------
+    text : str
+        The text to count the tokens of.
+    model : str, optional
+        The model whose tokenizer is used. Default is "gpt-3.5-turbo".
+
+    Returns
+    -------
+    int
+        The number of tokens in the text.
+    """
+    return count_tokens(text, model=model)
+
+
+def count_message_tokens(messages, model="gpt-3.5-turbo", cached_roles=("system",)):
+    """
+    Count the tokens billed for a list of chat messages in a single batch.
+
+    Parameters
+    ----------
+    messages : list of dict
+        The chat messages, each with a "role" and "content" and optionally a "name".
+    model : str, optional
+        The model whose tokenizer is used. Default is "gpt-3.5-turbo".
+    cached_roles : tuple of str, optional
+        Roles whose content is memoized as it rarely changes. Default is ("system",).
+
+    Returns
+    -------
+    int
+        The total number of tokens including the per message chat overhead.
+    """
+    encoding = get_encoding(model)
+
+    total_tokens = TOKENS_PER_REPLY
+    for message in messages:
+        total_tokens += TOKENS_PER_MESSAGE
+        if message["role"] in cached_roles:
+            total_tokens += count_tokens_cached(message["content"], model=model)
+        else:
+            total_tokens += len(encoding.encode_ordinary(message["content"]))
+
+        # roles are a fixed handful of strings so they are always memoized
+        total_tokens += count_tokens_cached(message["role"], model=model)
+        if "name" in message:
+            total_tokens += TOKENS_PER_NAME + count_tokens_cached(message["name"], model=model)
+
+    return total_tokens
@@ -9,6 +9,10 @@ from dash import html, dcc
 import re
 
 from dashgpt.logs import get_logger
+from dashgpt.layout.feedback_ui import (
+    generate_feedback_modal,
+    generate_thumbs_up_down_buttons,
+)
 
 logger = get_logger(__name__)
 
@@ -185,3 +189,92 @@ def generate_related_content_accordion(
     )
 
     return related_sources
+
+
+def generate_ai_response_card(response_md, context_docs, message_id, message_metadata=None):
+    """
+    Generate the card for a completed AI response with its related content and feedback buttons.
+
+    Parameters
+    ----------
+    response_md : str
+        The markdown of the generated response.
+    context_docs : list of Document objects
+        The documents used as context for the response.
+    message_id : str
+        The id of the message used for the feedback components.
+    message_metadata : dict, optional
+        What the message was generated from, e.g. its conversation id and prompt version,
+        kept with the card so feedback on it can be recorded with them.
+
+    Returns
+    -------
+    dbc.Card
+        The formatted response card.
+    """
+    style = {
+        "max-width": "80%",
+        "width": "max-content",
+        "padding": "0px 0px",
+        "border-radius": 25,
+        "margin-bottom": 20,
+        "margin-left": 0,
+        "margin-right": "auto",
+    }
+
+    # ------------ FORMAT THE RESPONSE CARD ------------ #
+    # take the last generated response apply custom rendering
+    card_children = [
+        html.Div(render_response(response_md.replace("* ", "• "))),
+    ]
+
+    # --------------- ADD RELATED CONTENT --------------- #
+    related_source_accordion = generate_related_content_accordion(
+        context_docs,
+        id="related-source-accordion",
+    )
+
+    card_children.append(related_source_accordion)
+
+    # --------------- ADD FEEDBACK BUTTONS --------------- #
+    feedback_modal = generate_feedback_modal(message_id=message_id)
+    thumbs_up_button, thumbs_down_button = generate_thumbs_up_down_buttons(
+        message_id=message_id,
+    )
+
+    # put the thumbsup/down buttons on the right hand edge of the card and the card on the right
+    card_children.append(
+        html.Div(
+            [
+                html.Div(),
+                html.Div(
+                    [
+                        thumbs_up_button,
+                        thumbs_down_button,
+                        feedback_modal,
+                        dcc.Store(
+                            id={"type": "message-metadata", "index": message_id},
+                            data=message_metadata or {},
+                        ),
+                    ],
+                    style={"display": "flex", "flex-wrap": "nowrap"},
+                ),
+            ],
+            style={
+                "display": "flex",
+                "justify-content": "space-between",
+                "align-items": "center",
+            },
+        )
+    )
+
+    # create a new dbc.Card to replace the one streamed to
+    card = dbc.Card(
+        card_children,
+        style=style,
+        body=True,
+        color="#ceeae5",
+        inverse=False,
+    )
+
+    return card
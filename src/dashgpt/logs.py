@@ -1,7 +1,22 @@
 # INspired from Son Nguyen Kim gist here: https://gist.github.com/nguyenkims/e92df0f8bd49973f0c94bddf36ed7fd0
+"""
+Logging of the app, configured once per process on the first get_logger call.
+
+Every logger hands its records to one QueueHandler, a QueueListener thread formats them
+as JSON lines and writes them, so requests never wait on formatting or I/O. Debug records
+can be sampled and long messages are cut to LOG_MAX_MESSAGE_CHARS.
+"""
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
 import logging
-import sys, os
-from logging.handlers import TimedRotatingFileHandler
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from datetime import datetime as dt
 
 
@@ -9,41 +24,247 @@ FORMATTER = logging.Formatter(
     "%(asctime)s - %(filename)s:%(lineno)s - %(funcName)s - %(levelname)s - %(message)s"
 )
 
-LOG_FILE = os.environ.get("LOG_OUTPUT_DIR", "") + dt.now().strftime(
-    "logs_%Y-%m-%dT%H-%M-%S.log"
-)
+# set LOG_OUTPUT_DIR to also write the logs to a file rotated at midnight
+LOG_OUTPUT_DIR = os.environ.get("LOG_OUTPUT_DIR", "")
+LOG_FILE = LOG_OUTPUT_DIR + dt.now().strftime("logs_%Y-%m-%dT%H-%M-%S.log")
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, "text" for the human readable FORMATTER
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+# share of debug records kept, e.g. 0.01 logs one in a hundred per request debug lines
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+# longer messages, e.g. a whole prompt, are cut to this many characters
+LOG_MAX_MESSAGE_CHARS = int(os.environ.get("LOG_MAX_MESSAGE_CHARS", "2000"))
+# records waiting to be written, more are dropped rather than blocking a request
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# every logger of the app is a child of this one, only it has handlers
+APP_LOGGER_NAME = "dashgpt"
+
+# attributes of every LogRecord, anything else was passed with extra= and is logged as a field
+RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+_queue_handler = None
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def truncate(text, max_chars=LOG_MAX_MESSAGE_CHARS):
+    """
+    Cut text to at most max_chars characters, noting how much was cut.
+
+    Parameters
+    ----------
+    text : str
+        The text to log.
+    max_chars : int, optional
+        The number of characters kept. Default is LOG_MAX_MESSAGE_CHARS.
+
+    Returns
+    -------
+    str
+        The text, or its start followed by the number of characters cut.
+    """
+    if len(text) <= max_chars:
+        return text
+
+    return f"{text[:max_chars]}... [{len(text) - max_chars} more characters]"
+
+
+def set_request_id(request_id):
+    """
+    Add a request id to every record logged in this context, including the threads a
+    request's work is handed to.
+
+    Parameters
+    ----------
+    request_id : str
+        The correlation ID of the request.
+
+    Returns
+    -------
+    contextvars.Token
+        Pass it to reset_request_id once the request is done.
+    """
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    """
+    Remove the request id set by set_request_id, so later work on a reused thread
+    isn't logged as part of the request.
+    """
+    _request_id.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as one line of JSON with the fields passed with extra= alongside.
+    """
+
+    def format(self, record):
+        log = {
+            "time": dt.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage()),
+            "location": f"{record.filename}:{record.lineno}",
+            "function": record.funcName,
+            "process": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                log[key] = value
+        if record.exc_info:
+            log["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(log, default=str)
+
+
+class TruncatingFormatter(logging.Formatter):
+    """
+    FORMATTER with long messages cut to LOG_MAX_MESSAGE_CHARS.
+    """
+
+    def formatMessage(self, record):
+        record.message = truncate(record.message)
+        return super().formatMessage(record)
 
-LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG").upper()
+
+class ContextFilter(logging.Filter):
+    """
+    Sample debug records and add the request id of the current context.
+
+    Runs on the thread that logs, before the record is queued, so sampled out records
+    cost nothing more and the context variables of the request are still visible.
+
+    Parameters
+    ----------
+    debug_sample_rate : float
+        The share of debug records kept.
+    """
+
+    def __init__(self, debug_sample_rate=LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and self.debug_sample_rate < 1.0:
+            if random.random() >= self.debug_sample_rate:
+                return False
+            # lets counts of sampled records be scaled back up
+            record.sample_rate = self.debug_sample_rate
+
+        request_id = _request_id.get()
+        if request_id is not None and not hasattr(record, "request_id"):
+            record.request_id = request_id
+
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that drops records when the queue is full instead of raising, and
+    leaves the formatting to the listener thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the message is merged with its arguments now so they can't change before it's
+        # written, formatting the record happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
 
 def get_console_handler():
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(FORMATTER)
+    console_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TruncatingFormatter(FORMATTER._fmt))
     return console_handler
 
 
 def get_file_handler():
     file_handler = TimedRotatingFileHandler(LOG_FILE, when="midnight")
-    file_handler.setFormatter(FORMATTER)
+    file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TruncatingFormatter(FORMATTER._fmt))
     return file_handler
 
 
-def get_logger(logger_name):
-    logger = logging.getLogger(logger_name)
+def _start_listener():
+    global _listener
 
-    if logger.hasHandlers():
-        logger.handlers.clear()
+    handlers = [get_console_handler()]
+    if LOG_OUTPUT_DIR:
+        handlers.append(get_file_handler())
 
-    logger.addHandler(get_console_handler())
-    # logger.addHandler(get_file_handler())
+    _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    # writes the records still queued, called at exit
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def configure_logging():
+    """
+    Route the records of every app logger through the queue to the listener thread.
+
+    Runs once per process, later calls do nothing. Under gunicorn the app is imported
+    in the master, the listener thread isn't copied by fork so every worker starts
+    its own with a new queue.
+    """
+    global _queue_handler
+
+    with _configure_lock:
+        if _queue_handler is not None:
+            return
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _queue_handler.addFilter(ContextFilter())
+
+        app_logger = logging.getLogger(APP_LOGGER_NAME)
+        app_logger.handlers.clear()
+        app_logger.addHandler(_queue_handler)
+        app_logger.setLevel(LOG_LEVEL)
+        # with this pattern, it's rarely necessary to propagate the error up to parent
+        app_logger.propagate = False
+
+        _start_listener()
+        atexit.register(_stop_listener)
+        os.register_at_fork(after_in_child=_start_listener)
+
+
+def get_logger(logger_name):
+    """
+    Get the logger of a module, configuring logging on the first call.
 
-    gunicorn_logger = logging.getLogger("gunicorn.error")
-    for h in gunicorn_logger.handlers:
-        logger.addHandler(h)
+    Parameters
+    ----------
+    logger_name : str
+        The name of the logger, usually __name__.
 
-    logger.setLevel(LOG_LEVEL)  # better to have too much log than not enough
+    Returns
+    -------
+    logging.Logger
+        A child of the app logger, so it shares its one queue handler.
+    """
+    configure_logging()
 
-    # with this pattern, it's rarely necessary to propagate the error up to parent
-    logger.propagate = False
+    if logger_name != APP_LOGGER_NAME and not logger_name.startswith(APP_LOGGER_NAME + "."):
+        logger_name = f"{APP_LOGGER_NAME}.{logger_name}"
 
-    return logger
+    return logging.getLogger(logger_name)
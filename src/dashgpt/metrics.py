@@ -0,0 +1,342 @@
+# Author: Ty Andrews
+# Date: 2026-10-17
+"""
+Latency metrics of answering a question, exported in the Prometheus text format on /metrics.
+
+Every /streaming-chat request gets a RequestMetrics timing its stages, the time to
+the first token and the whole stream. It is found through a context variable so the
+retrieval code records its stages without being passed the request. Metrics are kept
+per process, with several gunicorn workers each scrape reaches one of them.
+"""
+import re
+import time
+import uuid
+import threading
+import contextlib
+import contextvars
+
+from dashgpt.logs import get_logger, set_request_id, reset_request_id
+
+logger = get_logger(__name__)
+
+# sent by the browser with each /streaming-chat request and echoed in the response
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 40, 60, 80, 120, 200)
+
+
+def format_labels(labelnames, labelvalues, **extra):
+    labels = list(zip(labelnames, labelvalues)) + list(extra.items())
+    if not labels:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    """
+    Prometheus counter.
+
+    Parameters
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The help text of the metric.
+    labelnames : tuple of str, optional
+        The label names, their values are given to inc.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Prometheus histogram with cumulative buckets.
+
+    Parameters
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The help text of the metric.
+    labelnames : tuple of str, optional
+        The label names, their values are given to observe.
+    buckets : tuple of float, optional
+        The upper bounds of the buckets, +Inf is added.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values, the count of each bucket, the sum and the count
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            bucket_counts, total = self._values.get(key, ([0] * len(self.buckets), [0.0, 0]))
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    bucket_counts[i] += 1
+            total[0] += value
+            total[1] += 1
+            self._values[key] = (bucket_counts, total)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (bucket_counts, (value_sum, count)) in sorted(self._values.items()):
+                for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                    labels = format_labels(self.labelnames, key, le=f"{upper_bound:g}")
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = format_labels(self.labelnames, key, le="+Inf")
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {value_sum}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "dashgpt_stage_seconds",
+    "Seconds spent in each stage of answering a question.",
+    labelnames=("stage",),
+)
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "dashgpt_time_to_first_token_seconds",
+    "Seconds from receiving a /streaming-chat request to sending the first token.",
+    labelnames=("cached",),
+)
+STREAM_SECONDS = Histogram(
+    "dashgpt_stream_seconds",
+    "Seconds from receiving a /streaming-chat request to sending the last token.",
+    labelnames=("cached",),
+)
+STREAM_TOKENS_PER_SECOND = Histogram(
+    "dashgpt_stream_tokens_per_second",
+    "Tokens per second streamed after the first token.",
+    labelnames=("cached",),
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+STREAMING_REQUESTS = Counter(
+    "dashgpt_streaming_requests_total",
+    "Completed /streaming-chat requests.",
+    labelnames=("cached",),
+)
+UPSTREAM_FAILURES = Counter(
+    "dashgpt_upstream_failures_total",
+    "Failed OpenAI API calls by upstream and error.",
+    labelnames=("upstream", "error"),
+)
+CIRCUIT_BREAKER_OPENED = Counter(
+    "dashgpt_circuit_breaker_opened_total",
+    "Times the circuit of an upstream opened.",
+    labelnames=("upstream",),
+)
+ADMISSION_REJECTIONS = Counter(
+    "dashgpt_admission_rejections_total",
+    "/streaming-chat requests rejected with a 429 by reason.",
+    labelnames=("reason",),
+)
+STREAMS_CANCELLED = Counter(
+    "dashgpt_streams_cancelled_total",
+    "/streaming-chat responses the client disconnected from before the end.",
+    labelnames=("cached",),
+)
+CANCELLED_TOKENS = Counter(
+    "dashgpt_cancelled_tokens_total",
+    "Completion tokens not generated because the stream was cancelled, max_tokens less the tokens already streamed.",
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "dashgpt_response_cache_lookups_total",
+    "Semantic response cache lookups by result, hit or miss.",
+    labelnames=("result",),
+)
+RESPONSE_CACHE_LATENCY_SAVED = Counter(
+    "dashgpt_response_cache_latency_saved_seconds_total",
+    "Seconds of answer generation saved by answers served from the response cache.",
+)
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    "dashgpt_embedding_cache_lookups_total",
+    "Question embedding lookups by the cache tier that answered, memory or disk, or miss when the embeddings were called.",
+    labelnames=("tier",),
+)
+
+METRICS = [
+    STAGE_SECONDS,
+    TIME_TO_FIRST_TOKEN_SECONDS,
+    STREAM_SECONDS,
+    STREAM_TOKENS_PER_SECOND,
+    STREAMING_REQUESTS,
+    UPSTREAM_FAILURES,
+    CIRCUIT_BREAKER_OPENED,
+    ADMISSION_REJECTIONS,
+    STREAMS_CANCELLED,
+    CANCELLED_TOKENS,
+    RESPONSE_CACHE_LOOKUPS,
+    RESPONSE_CACHE_LATENCY_SAVED,
+    EMBEDDING_CACHE_LOOKUPS,
+]
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def render_metrics():
+    """
+    Render every metric in the Prometheus text format.
+
+    Returns
+    -------
+    str
+        The body of the /metrics response.
+    """
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+def get_request_id(headers):
+    """
+    Get the correlation ID of a request from its headers, or make a new one.
+
+    Parameters
+    ----------
+    headers : mapping
+        The request headers.
+
+    Returns
+    -------
+    str
+        The ID sent by the browser if it is well formed, a new random one otherwise.
+    """
+    request_id = headers.get(REQUEST_ID_HEADER, "")
+    return request_id if REQUEST_ID_PATTERN.match(request_id) else uuid.uuid4().hex
+
+
+class RequestMetrics:
+    """
+    Timings of one /streaming-chat request.
+
+    Parameters
+    ----------
+    request_id : str
+        The correlation ID of the request.
+    """
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.cached = False
+        self.tokens = 0
+        self.first_token_time = None
+
+    @contextlib.contextmanager
+    def activate(self):
+        """
+        Make this the request whose stages are recorded by time_stage in this context,
+        until the with block ends.
+
+        Context variables are copied to the threads retrieval runs in and the stream is
+        produced on, they record into this same object. Records logged in this context
+        carry its request id. Both are reset at the end as WSGI servers reuse threads.
+        """
+        request_token = _current_request.set(self)
+        request_id_token = set_request_id(self.request_id)
+        try:
+            yield self
+        finally:
+            reset_request_id(request_id_token)
+            _current_request.reset(request_token)
+
+    def record_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def record_token(self, count=1):
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.tokens += count
+
+    def cancel(self):
+        """
+        Record a stream the client disconnected from, its timings are left out.
+        """
+        cached = str(self.cached).lower()
+        STREAMS_CANCELLED.inc(cached=cached)
+        logger.info(
+            f"request_id={self.request_id} cached={cached} cancelled after tokens={self.tokens} "
+            f"total={(time.perf_counter() - self.start_time) * 1000:.1f}ms"
+        )
+
+    def finish(self):
+        """
+        Record the stream timings once the last token was sent and log a summary.
+        """
+        end_time = time.perf_counter()
+        cached = str(self.cached).lower()
+
+        STREAMING_REQUESTS.inc(cached=cached)
+        STREAM_SECONDS.observe(end_time - self.start_time, cached=cached)
+
+        time_to_first_token = None
+        tokens_per_second = None
+        if self.first_token_time is not None:
+            time_to_first_token = self.first_token_time - self.start_time
+            TIME_TO_FIRST_TOKEN_SECONDS.observe(time_to_first_token, cached=cached)
+            if self.tokens > 1 and end_time > self.first_token_time:
+                tokens_per_second = (self.tokens - 1) / (end_time - self.first_token_time)
+                STREAM_TOKENS_PER_SECOND.observe(tokens_per_second, cached=cached)
+
+        timings = {"ttft": time_to_first_token, "total": end_time - self.start_time, **self.stages}
+        logger.info(
+            f"request_id={self.request_id} cached={cached} tokens={self.tokens} "
+            f"tokens_per_second={tokens_per_second or 0:.1f} "
+            + " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in timings.items() if seconds is not None)
+        )
+
+
+@contextlib.contextmanager
+def time_stage(stage):
+    """
+    Time a stage of answering a question, recorded in the stage histogram and, inside
+    a request, in its RequestMetrics.
+
+    Parameters
+    ----------
+    stage : str
+        The name of the stage, e.g. "embed" or "vector_search".
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start_time
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        request_metrics = _current_request.get()
+        if request_metrics is not None:
+            request_metrics.record_stage(stage, seconds)
@@ -14,11 +14,13 @@ from dash import (
     ctx,
     callback, 
     ALL, 
-    MATCH
+    MATCH,
+    Patch,
 )
 import time
 import random
 import json
+import functools
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
 from flask import request, Response
@@ -29,31 +31,47 @@ from dotenv import load_dotenv, find_dotenv
 
 
 from dashgpt.logs import get_logger
-from dashgpt.data.langchain_utils import (
-    convert_documents_to_dict,
-    convert_dict_to_documents,
+from dashgpt.metrics import RequestMetrics, get_request_id, time_stage, REQUEST_ID_HEADER
+from dashgpt.data.langchain_utils import convert_dict_to_documents
+from dashgpt.chat.chat_utils import stream_send_messages
+from dashgpt.chat.vector_store import get_vector_store
+from dashgpt.chat.streaming import (
+    retrieve_context,
+    build_chat_completion_prompt,
+    RETRIEVAL_ERRORS,
+    UPSTREAM_ERROR_MESSAGE,
+    get_response_cache_key,
+    cache_response_stream,
+    stream_chat_events,
 )
-from dashgpt.chat.chat_utils import (
-    stream_send_messages,
-    get_relevant_documents,
-    connect_to_vectorstore,
-    convert_documents_to_chat_context,
-    convert_chat_history_to_string,
+from dashgpt.chat.response_cache import response_cache, replay_response, get_document_ids
+from dashgpt.chat.prompts import prompt_registry
+from dashgpt.chat.feedback_store import get_feedback_sink
+from dashgpt.chat.conversation_store import get_conversation_store
+from dashgpt.chat.prompt_assembly import MAX_COMPLETION_TOKENS
+from dashgpt.chat.admission import (
+    admission_controller,
+    get_client_key,
+    ReleaseUnusedTokens,
+    RateLimitExceeded,
 )
-from dashgpt.chat.prompts import (
-    generate_user_prompt,
-    load_system_prompt,
+from dashgpt.chat.stream_buffer import (
+    start_stream,
+    follow_stream,
+    resume_stream,
+    stream_registry,
+    StreamNotFound,
+    StreamExpired,
+    STREAM_ID_HEADER,
+    LAST_EVENT_ID_HEADER,
+    SSE_HEADERS,
 )
 from dashgpt.layout.chat_ui import (
     generate_user_textbox,
     generate_ai_textbox,
     render_response,
     generate_chat_controls,
-    generate_related_content_accordion,
-)
-from dashgpt.layout.feedback_ui import (
-    generate_feedback_modal,
-    generate_thumbs_up_down_buttons,
+    generate_ai_response_card,
 )
 from dashgpt.layout.settings_ui import generate_settings_offcanvas
 from dashgpt.layout.information_ui import generate_information_modal
@@ -67,8 +85,8 @@ logger = get_logger(__name__)
 
 dash.register_page(__name__, path="/")
 
-# get the langchain vecotr store to use for similarity search
-vector_store = connect_to_vectorstore()
+# server side store of each conversation's messages, keyed by conversation-id
+conversation_store = get_conversation_store()
 
 
 def layout():
@@ -78,7 +96,7 @@ def layout():
         html.Div(id="chat-history", 
                  children=[
                     html.Div(
-                        "Running Vector Store Setup for DashGPT...",
+                        "Loading DashGPT...",
                         style={
                             "display": "flex",
                             "justify-content": "center",
@@ -89,17 +107,6 @@ def layout():
                             "color": "white",  
                         },
                     ),
-                    # put in a smaller font sized line saying thins should take no more than 5s
-                    html.Div(
-                        "This shouldn't take more than 5 seconds.",
-                        style={
-                            "display": "flex",
-                            "justify-content": "center",
-                            "align-items": "center",
-                            "font-size": "16px",
-                            "color": "white",  
-                        },
-                    ),
                 ]
         ),
         style={
@@ -128,22 +135,23 @@ def layout():
                 id="dashgpt-first-load",
                 children=[],  # don't put anything in here, it's just a trigger
             ),
-            # store the current conversation uuid
-            dcc.Store(id="conversation-id", data=""),
+            # store the current conversation uuid, the messages are kept server side
+            dcc.Store(id="conversation-id", data=str(uuid.uuid4())),
             # data store for triggering when a new prompt is submitted and ready for generation
             dcc.Store(id="new-prompt", data=""),
             # data store to house the generated response
             dcc.Store(id="last-generated-response", data=""),
-            # use a store to access the current-context formatted as a string
-            dcc.Store(id="formatted-context", data=""),
-            # store the complete context including metadaata
+            # store the complete context including metadaata, sent by /streaming-chat
             dcc.Store(id="complete-context", data=""),
             # a store to track the object id of the card that streaming should output text to
             dcc.Store(id="current-streaming-object-id", data=""),
+            # number of cards in chat-history so callbacks can patch cards by index
+            # without round tripping the whole chat history, 0 when only sample questions show
+            dcc.Store(id="chat-card-count", data=0),
             # spot to store the current ai message id
             dcc.Store(id="current-ai-message-id", data=""),
-            # store the history of the conversation
-            dcc.Store(id="raw-chat-history", data='{"chat_history": []}'),
+            # correlation id of the question being answered, sent with /streaming-chat
+            dcc.Store(id="request-id", data=""),
             settings_offcanvas,
             information_modal,
             dmc.Button(
@@ -252,18 +260,8 @@ def run_on_first_load(id, children):
     Callback that runs on the first load of the dashgpt page.
     """
     if len(children) == 0:
-        start_time = time.time()
-        # run a simple retrieval to warm up the vector store connection
-        _ = get_relevant_documents(
-            user_prompt="Cats",
-            vector_store=vector_store,
-            k=1,
-            method="similarity",
-        )
-        logger.info(
-            f"Vector store connection warmed up, took {time.time() - start_time:.3f} seconds."
-        )
-
+        # the vector store is warmed up once per process, see dashgpt.chat.vector_store,
+        # so page loads don't wait on it
         chat_controls = generate_chat_controls(
             text_input_id="text-prompt", submit_button_id="submit-prompt"
         )
@@ -284,28 +282,31 @@ def run_on_first_load(id, children):
     Output("text-prompt", "value"),
     Output("submit-prompt", "disabled", allow_duplicate=True),
     Output("current-streaming-object-id", "data"),
-    Output("raw-chat-history", "data", allow_duplicate=True),
+    Output("chat-card-count", "data"),
+    Output("request-id", "data"),
     Input("submit-prompt", "n_clicks"),
     Input("text-prompt", "value"),
-    State("chat-history", "children"),
-    State("raw-chat-history", "data"),
+    State("chat-card-count", "data"),
+    State("conversation-id", "data"),
     prevent_initial_call=True,
 )
-def add_chat_card(n_clicks, user_prompt, chat_history, 
-                  raw_chat_history
+def add_chat_card(n_clicks, user_prompt, chat_card_count, 
+                  conversation_id
     ):
     if user_prompt is None or user_prompt == "":
         # don't do anything if the user prompt is empty
         raise dash.exceptions.PreventUpdate
     
-    # case when only sample question buttons are present, reset
-    # if chat_history is a dict, it's the first time the callback is being called
-    if (len(chat_history) <= 1) or (chat_history is None) or (isinstance(chat_history, dict)):
+    # case when only sample question buttons are present, replace them, otherwise only
+    # the new cards are sent and appended to the cards already in the browser
+    if chat_card_count == 0:
         chat_history = []
+    else:
+        chat_history = Patch()
 
-    raw_chat_dict = json.loads(raw_chat_history)
-
-    raw_chat_dict["chat_history"].append({"role": "user", "content": user_prompt})
+    conversation_store.append_message(
+        conversation_id, {"role": "user", "content": user_prompt}
+    )
 
     # create the users prompt card
     user_card = generate_user_textbox(user_prompt)
@@ -314,7 +315,7 @@ def add_chat_card(n_clicks, user_prompt, chat_history,
     # this is used to trigger the streaming_chat callback
     streaming_object_id = f"streaming-object-{random.randint(1000, 9999)}"
 
-    # create the AI response card
+    # create the AI response card, the text is replaced once the context arrives
     ai_card = generate_ai_textbox(
         streaming_object_id, text="🔬 Searching relevant content..."
     )
@@ -323,82 +324,42 @@ def add_chat_card(n_clicks, user_prompt, chat_history,
     chat_history.append(user_card)
     chat_history.append(ai_card)
 
+    # the streaming request and the callback formatting its answer log the same id
+    request_id = uuid.uuid4().hex
+    logger.debug(f"request_id={request_id} new prompt in conversation {conversation_id}")
+
     return (
         chat_history,
         user_prompt,
         "",  # clear the input field
         True,  # disable the submit button
         streaming_object_id,
-        json.dumps(raw_chat_dict),
+        chat_card_count + 2,
+        request_id,
     )
 
 
-# once new-prompt is updated, get the context and update the context objects to prepare
-# for chat completions
-@callback(
-    Output("formatted-context", "data"),
+# JS callback to send the question to the flask API as soon as the cards are added, the
+# route retrieves the context and streams the answer in one request. At the end it enables
+# the submit button and returns the generated html response so formatting can be maintained
+clientside_callback(
+    ClientsideFunction(namespace="clientside", function_name="streaming_GPT"),
+    Output("submit-prompt", "disabled"),
+    Output("last-generated-response", "data"),
     Output("complete-context", "data"),
-    Output("conversation-id", "data", allow_duplicate=True),
-    Output("chat-history", "children", allow_duplicate=True),
     Input("new-prompt", "data"),
+    State("current-streaming-object-id", "data"),
     State("conversation-id", "data"),
-    State("raw-chat-history", "data"),
-    State("chat-history", "children"),
+    State("request-id", "data"),
     prevent_initial_call=True,
 )
-# function to get context and update context objects
-def update_context(
-    user_prompt,
-    conversation_id,
-    raw_chat_history,
-    chat_history_cards,
-):
-    if user_prompt is None or user_prompt == "":
-        # don't do anything if the user prompt is empty
-        raise dash.exceptions.PreventUpdate
 
-    chat_history_dict = json.loads(raw_chat_history)
-
-    question_for_retrieval = user_prompt
-    logger.debug(f"Original question used for retrieval: {question_for_retrieval}")
-
-    relevant_docs = get_relevant_documents(
-        user_prompt=question_for_retrieval,
-        vector_store=vector_store,
-        k=3,
-        method="similarity",
-    )
-
-    relevant_docs_dict = convert_documents_to_dict(relevant_docs)
-
-    formatted_context_str = convert_documents_to_chat_context(relevant_docs)
-
-    # change the text in the last card to "Generating answer..."
-    last_card = chat_history_cards[-1]
-    last_card["props"]["children"][0]["props"]["children"]["props"][
-        "children"
-    ] = "✨Generating answer..."
-    chat_history_cards[-1] = last_card
-
-    return (
-        formatted_context_str,
-        relevant_docs_dict,
-        conversation_id,
-        chat_history_cards,
-    )
-
-
-# JS callback to send the question to the flask API, at the end it enables the submit button
-# and returns the generated html response so formatting can be maintained
+# starting a new conversation aborts the answer being streamed, the server sees the
+# disconnect and stops generating it
 clientside_callback(
-    ClientsideFunction(namespace="clientside", function_name="streaming_GPT"),
-    Output("submit-prompt", "disabled"),
-    Output("last-generated-response", "data"),
-    Input("formatted-context", "data"),
-    State("submit-prompt", "n_clicks"),
-    State("new-prompt", "data"),
-    State("current-streaming-object-id", "data"),
-    State("raw-chat-history", "data"),
+    ClientsideFunction(namespace="clientside", function_name="abort_streaming_GPT"),
+    Output("submit-prompt", "disabled", allow_duplicate=True),
+    Input("new-prompt-button", "n_clicks"),
     prevent_initial_call=True,
 )
 
@@ -409,158 +370,177 @@ clientside_callback(
 app = dash.get_app()
 
 
-@app.server.route("/streaming-chat", methods=["POST"])
-def streaming_chat():
-    user_prompt = request.json["prompt"]
-    context_str = request.json["formatted_context"]
-    chat_history = json.loads(request.json["chat_history"])
-
-    # prompt engineering/data augmentation can be performed here
-    # important thing is that this is happening on the backend, so that the users can't tamper with this
-    # JS front-end only handles the response, and nothing else
-    system_prompt = {
-        "role": "system",
-        "content": load_system_prompt(),
-    }
-
-    chat_completion_prompt = []
-    chat_completion_prompt.append(system_prompt)
-
-    # take the chat history and output it into a string llike "user: message\nassistant: message\nuser: message"
-    # keep all but the lase message as it is the prompt
-    chat_history_str = convert_chat_history_to_string(chat_history)
-
-    user_prompt = generate_user_prompt(
-        user_prompt=user_prompt,
-        chat_context=context_str,
-        chat_history=chat_history_str,
-    )
+def rate_limited_response(error, headers):
+    body, retry_headers = error.to_response()
+    logger.info(f"Rejected /streaming-chat request: {error}")
+    return Response(json.dumps(body), status=429, mimetype="application/json", headers={**headers, **retry_headers})
 
-    chat_completion_prompt.append(user_prompt)
 
-    logger.debug(f"chat Prompt: {chat_completion_prompt}")
+def upstream_error_response(error, headers):
+    logger.error(f"Retrieving the context failed: {error!r}")
+    body = {"message": UPSTREAM_ERROR_MESSAGE}
+    return Response(json.dumps(body), status=503, mimetype="application/json", headers=headers)
 
-    def response_stream():
-        yield from (
-            line.choices[0].delta.get("content", "")
-            for line in stream_send_messages(chat_completion_prompt)
-        )
 
-    logger.debug("End of streaming_chat function.")
+def event_stream_response(buffer, events, headers):
+    return Response(
+        events,
+        mimetype="text/event-stream",
+        headers={**headers, **SSE_HEADERS, STREAM_ID_HEADER: buffer.stream_id},
+    )
 
-    return Response(response_stream(), mimetype="text/response-stream")
+
+@app.server.route("/streaming-chat", methods=["POST"])
+def streaming_chat():
+    # blocking version of the route for the Dash dev server and WSGI deployments,
+    # see dashgpt.asgi for the asyncio version
+    # retrieval happens here rather than in a callback so the first token is one
+    # round trip away, the documents are the first event of the stream
+    request_json = request.json
+    # the ID ties this request to the Dash callbacks of the same question in the logs
+    request_metrics = RequestMetrics(get_request_id(request.headers))
+    with request_metrics.activate():
+        headers = {REQUEST_ID_HEADER: request_metrics.request_id}
+
+        # a client over its rate is turned away before any retrieval or upstream work
+        client_key = get_client_key(request.remote_addr, request.headers, request_json["conversation_id"])
+        try:
+            admission_controller.check_client(client_key)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e, headers)
+
+        vector_store = get_vector_store()
+        try:
+            complete_context = retrieve_context(request_json["prompt"], vector_store)
+        except RETRIEVAL_ERRORS as e:
+            # the embeddings upstream is down and there's no BM25 index to fall back to
+            return upstream_error_response(e, headers)
+
+        # near identical first questions are answered from the cache, replayed as a stream
+        # so the client handles it exactly like a generated answer
+        with time_stage("cache_lookup"):
+            cache_key = get_response_cache_key(request_json, complete_context, vector_store)
+            cached_response = response_cache.lookup(*cache_key) if cache_key else None
+        if cached_response is not None:
+            request_metrics.cached = True
+            events = stream_chat_events(complete_context, replay_response(cached_response), request_metrics)
+            buffer = start_stream(events)
+            return event_stream_response(buffer, follow_stream(buffer), headers)
+
+        chat_completion_prompt, prompt_tokens = build_chat_completion_prompt(request_json, complete_context)
+
+        # the whole completion is reserved from the tokens per minute budget up front, what
+        # the answer didn't use is given back when the stream ends
+        try:
+            reservation = admission_controller.reserve(prompt_tokens + MAX_COMPLETION_TOKENS)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e, headers)
+        if reservation.wait > 0:
+            with time_stage("admission"):
+                try:
+                    time.sleep(reservation.wait)
+                finally:
+                    reservation.done_waiting()
+
+        logger.debug("End of streaming_chat function.")
+
+        stream = ReleaseUnusedTokens(stream_send_messages(chat_completion_prompt), reservation, MAX_COMPLETION_TOKENS)
+        if cache_key is not None:
+            stream = cache_response_stream(stream, cache_key)
+
+        # the answer is generated into a buffer on a thread of its own, so it carries on when
+        # the connection drops and a reconnect picks up where it left off
+        events = stream_chat_events(complete_context, stream, request_metrics)
+        buffer = start_stream(events, on_finish=functools.partial(reservation.release_unused, MAX_COMPLETION_TOKENS))
+        return event_stream_response(buffer, follow_stream(buffer), headers)
+
+
+@app.server.route("/streaming-chat", methods=["GET"])
+def resume_streaming_chat():
+    # a reconnect after the connection dropped, the browser sends the id of the last event
+    # it received and gets the rest of the answer from the buffer
+    try:
+        buffer, after_seq = resume_stream(request.headers.get(LAST_EVENT_ID_HEADER))
+    except StreamNotFound as e:
+        logger.info(f"Can't resume stream: {e}")
+        status = 410 if isinstance(e, StreamExpired) else 404
+        body = {"message": "The answer can no longer be resumed, please ask again."}
+        return Response(json.dumps(body), status=status, mimetype="application/json")
+
+    return event_stream_response(buffer, follow_stream(buffer, after_seq), {})
+
+
+@app.server.route("/streaming-chat/<stream_id>", methods=["DELETE"])
+def cancel_streaming_chat(stream_id):
+    # sent by the browser when it aborts an answer on purpose, a dropped connection
+    # instead keeps generating for STREAM_RESUME_TIMEOUT seconds in case it reconnects
+    stream_registry.cancel(stream_id)
+    return Response(status=204)
 
 
 # callback which is triggered when the last-generated-text is updated meaning streaming is done
-# it takes the state of conversation-history and updates the last childs text with reformatted text
+# it replaces only the streamed to card with the formatted response card
 @callback(
     Output("chat-history", "children", allow_duplicate=True),
-    Output("raw-chat-history", "data", allow_duplicate=True),
     Output("current-ai-message-id", "data", allow_duplicate=True),
     Input("last-generated-response", "data"),
-    State("chat-history", "children"),
+    State("chat-card-count", "data"),
     State("complete-context", "data"),
-    State("raw-chat-history", "data"),
     State("conversation-id", "data"),
     State("current-ai-message-id", "data"),
+    State("request-id", "data"),
     prevent_initial_call=True,
 )
 def format_chat_history(
     last_generated_response,
-    chat_history,
+    chat_card_count,
     complete_context_dict,
-    raw_chat_history,
     conversation_id,
     current_ai_message_id,
+    request_id,
 ):
-    raw_chat_dict = json.loads(raw_chat_history)
-
-    if chat_history is None:
-        chat_history = []
-
     # if the last generated response is empty, don't do anything
     if last_generated_response is None or last_generated_response == "":
         logger.debug("Preventing format_chat_history callback from being called.")
         raise dash.exceptions.PreventUpdate
 
-    # convert complete_context to a list of Document objects
-    complete_context_docs = convert_dict_to_documents(complete_context_dict)
+    with time_stage("format_response"):
+        # convert complete_context to a list of Document objects
+        complete_context_docs = convert_dict_to_documents(complete_context_dict)
 
-    style = {
-        "max-width": "80%",
-        "width": "max-content",
-        "padding": "0px 0px",
-        "border-radius": 25,
-        "margin-bottom": 20,
-        "margin-left": 0,
-        "margin-right": "auto",
-    }
+        # convert the html to markdown, without this the returned raw text loses it's
+        # formatting/bullet points etc.
+        last_generated_response_md = markdownify(last_generated_response)
 
-    # convert the html to markdown, without this the returned raw text loses it's
-    # formatting/bullet points etc.
-    last_generated_response_md = markdownify(last_generated_response)
+        message_id = str(uuid.uuid4())
 
-    message_id = str(uuid.uuid4())
-
-    # ------------ FORMAT THE RESPONSE CARD ------------ #
-    raw_chat_dict["chat_history"].append(
-        {"role": "assistant", "content": last_generated_response_md}
-    )
-
-    # take the last generated response apply custom rendering
-    card_children = [
-        html.Div(render_response(last_generated_response_md.replace("* ", "• "))),
-    ]
-
-    # --------------- ADD RELATED CONTENT --------------- #
-    related_source_accordion = generate_related_content_accordion(
-        complete_context_docs,
-        id="related-source-accordion",
-    )
+        conversation_store.append_message(
+            conversation_id, {"role": "assistant", "content": last_generated_response_md}
+        )
 
-    card_children.append(related_source_accordion)
+        # recorded along with any feedback on the answer
+        message_metadata = {
+            "conversation_id": conversation_id,
+            "request_id": request_id,
+            "prompt_version": prompt_registry.assign_version(conversation_id),
+            "document_ids": list(get_document_ids(complete_context_dict)),
+        }
 
-    # --------------- ADD FEEDBACK BUTTONS --------------- #
-    feedback_modal = generate_feedback_modal(message_id=message_id)
-    thumbs_up_button, thumbs_down_button = generate_thumbs_up_down_buttons(
-        message_id=message_id,
-    )
+        card = generate_ai_response_card(
+            last_generated_response_md, complete_context_docs, message_id, message_metadata
+        )
 
-    # put the thumbsup/down buttons on the right hand edge of the card and the card on the right
-    card_children.append(
-        html.Div(
+        # replace the streamed to card, the last one in the chat history, with the new card
+        chat_history = Patch()
+        chat_history[chat_card_count - 1] = html.Div(
             [
-                html.Div(),
-                html.Div(
-                    [thumbs_up_button, thumbs_down_button, feedback_modal],
-                    style={"display": "flex", "flex-wrap": "nowrap"},
-                ),
-            ],
-            style={
-                "display": "flex",
-                "justify-content": "space-between",
-                "align-items": "center",
-            },
+                card,
+            ]
         )
-    )
 
-    # create a new dbc.Card to replace the one streamed to
-    card = dbc.Card(
-        card_children,
-        style=style,
-        body=True,
-        color="#ceeae5",
-        inverse=False,
-    )
+    logger.debug(f"request_id={request_id} answer formatted as message {message_id}")
 
-    # replace the streamed to card with the new card
-    chat_history[-1] = html.Div(
-        [
-            card,
-        ]
-    )
-
-    return chat_history, json.dumps(raw_chat_dict), message_id
+    return chat_history, message_id
 
 
 # a call back that takes settings-button as input and outputs is_open to settings-backdrop offcanvas
@@ -580,19 +560,22 @@ def toggle_settings_offcanvas(n, is_open):
 @callback(
     Output("chat-history", "children", allow_duplicate=True),
     Output("conversation-id", "data", allow_duplicate=True),
-    Output("raw-chat-history", "data", allow_duplicate=True),
+    Output("chat-card-count", "data", allow_duplicate=True),
     Input("new-prompt-button", "n_clicks"),
+    State("conversation-id", "data"),
     prevent_initial_call=True,
 )
 def clear_chat_history(
-    n_clicks, 
+    n_clicks, conversation_id
     ):
     if n_clicks:
+        # the old conversation can't be returned to so free it straight away
+        conversation_store.delete_conversation(conversation_id)
         new_conversation_id = str(uuid.uuid4())
         logger.debug("New conversation id: " + new_conversation_id)
         # generate a sample quesiton button and put as children
         sample_questions = generate_sample_questions()
-        return [sample_questions], new_conversation_id , '{"chat_history": []}'
+        return [sample_questions], new_conversation_id, 0
     raise dash.exceptions.PreventUpdate
 
 
@@ -612,16 +595,16 @@ def clear_chat_history(
     [Input({"type": "thumbs-up-button", "index": MATCH}, "n_clicks")],
     [
         State({"type": "thumbs-up-button", "index": MATCH}, "id"),
+        State({"type": "message-metadata", "index": MATCH}, "data"),
     ],
     prevent_initial_call=True,
 )
-def thumbs_up(n_clicks, current_message_id
+def thumbs_up(n_clicks, current_message_id, message_metadata
     ):
     if n_clicks:
         message_id = current_message_id["index"]
-        logger.debug(
-            f"Thumbs up button clicked for message {message_id}, do something with this..."
-        )
+        logger.debug(f"Thumbs up button clicked for message {message_id}")
+        get_feedback_sink().record(message_id=message_id, rating="up", **(message_metadata or {}))
         return {"from": "green", "to": "green"}, {"from": "grey", "to": "grey"}
     raise dash.exceptions.PreventUpdate
 
@@ -647,11 +630,19 @@ def thumbs_up(n_clicks, current_message_id
     [
         Input({"type": "thumbs-down-button", "index": MATCH}, "n_clicks"),
     ],
-    [State({"type": "feedback-modal", "index": MATCH}, "opened")],
+    [
+        State({"type": "feedback-modal", "index": MATCH}, "opened"),
+        State({"type": "thumbs-down-button", "index": MATCH}, "id"),
+        State({"type": "message-metadata", "index": MATCH}, "data"),
+    ],
     prevent_initial_call=True,
 )
-def thumbs_down(n_clicks, is_open):
+def thumbs_down(n_clicks, is_open, current_message_id, message_metadata):
     if n_clicks > 0:
+        # recorded now in case the feedback modal is closed without submitting
+        get_feedback_sink().record(
+            message_id=current_message_id["index"], rating="down", **(message_metadata or {})
+        )
         return (
             not is_open,
             {"from": "red", "to": "#dc143c"},
@@ -670,11 +661,12 @@ def thumbs_down(n_clicks, is_open):
     State({"type": "feedback-modal", "index": MATCH}, "id"),
     State({"type": "feedback-text-area", "index": MATCH}, "value"),
     State({"type": "feedback-type", "index": MATCH}, "value"),
+    State({"type": "message-metadata", "index": MATCH}, "data"),
     prevent_initial_call=True,
 )
 def submit_feedback(
     n_clicks, is_open, current_message_index,
-    feedback_text, feedback_type
+    feedback_text, feedback_type, message_metadata
 ):
     logger.debug(f"Feedback type: {feedback_type}")
     message_id = current_message_index["index"]
@@ -683,7 +675,14 @@ def submit_feedback(
         if feedback_type is None or feedback_type == "":
             logger.debug("Feedback type not provided, preventing callback")
             raise dash.exceptions.PreventUpdate
-        logger.debug("Negative feedback submit button clicked, do something with this...")
+        logger.debug(f"Negative feedback submitted for message {message_id}")
+        get_feedback_sink().record(
+            message_id=message_id,
+            rating="down",
+            feedback_type=feedback_type,
+            feedback_text=feedback_text,
+            **(message_metadata or {}),
+        )
         return not is_open
     raise dash.exceptions.PreventUpdate
 